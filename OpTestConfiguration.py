@@ -20,6 +20,7 @@ from common.OpTestEBMC import EBMCHostManagement
 from common.OpTestWeb import OpTestWeb
 from common.OpTestUtil import OpTestUtil
 from common.OpTestCronus import OpTestCronus
+from common.OpTestConsoleRecorder import OpTestConsoleRecorder
 from common.Exceptions import HostLocker, AES, ParameterCheck, OpExit
 from common.OpTestConstants import OpTestConstants as BMC_CONST
 import atexit
@@ -172,6 +173,8 @@ def get_parser():
                         help="Run individual tests")
     tgroup.add_argument("-f", "--failfast", action='store_true',
                         help="Stop on first failure")
+    tgroup.add_argument("--schedule-by-state", action='store_true', default=False,
+                        help="Reorder the tests to group them by the system state they need, fewer IPLs")
     tgroup.add_argument("--quiet", action='store_true', default=False,
                         help="Don't splat lots of things to the console")
 
@@ -187,6 +190,14 @@ def get_parser():
     parser.add_argument(
         "--suffix", help="Suffix to add to all reports.  Default is current time.")
 
+    fleetgroup = parser.add_argument_group('Fleet',
+                                           'Run the tests on several machines at once, see common/OpTestFleet.py')
+    fleetgroup.add_argument("--fleet", action='append', metavar="FILE",
+                            help="Machine config file of a fleet target, repeat for each target")
+    fleetgroup.add_argument("--fleet-jobs", type=int, default=0,
+                            help="Most lock groups to run at a time, targets sharing a machine (lock)"
+                            " always run one after another, default all")
+
     lockgroup = parser.add_mutually_exclusive_group()
     lockgroup.add_argument("--hostlocker", metavar="HOST_NAME",
                            help="Hostlocker host name to checkout, see HOSTLOCKER GROUP below for more options")
@@ -250,8 +261,25 @@ def get_parser():
     bmcgroup.add_argument("--bmc-prompt", default="#",
                           help="Prompt for BMC ssh session")
     bmcgroup.add_argument("--smc-presshipmicmd")
+    bmcgroup.add_argument("--ipmi-shell-sessions", type=int, default=0, metavar="N",
+                          help="Run ipmitool commands over up to N persistent 'ipmitool shell'"
+                          " sessions (default 0, one ipmitool process per command)")
     bmcgroup.add_argument("--qemu-binary", default=qemu_default,
                           help="[QEMU Only] qemu simulator binary")
+    bmcgroup.add_argument("--qemu-memory", default="4G",
+                          help="[QEMU Only] Memory of the simulated machine")
+    bmcgroup.add_argument("--qemu-smp", type=int, default=None,
+                          help="[QEMU Only] Number of CPUs of the simulated machine")
+    bmcgroup.add_argument("--qemu-accel", default=None,
+                          help="[QEMU Only] Accelerator, e.g. tcg,thread=multi for multi-threaded TCG")
+    bmcgroup.add_argument("--qemu-mac", default="52:54:00:22:34:56",
+                          help="[QEMU Only] MAC address of the simulated NIC")
+    bmcgroup.add_argument("--qemu-farm", type=int, default=0, metavar="N",
+                          help="[QEMU Only] Run the selected tests sharded across N QEMU instances,"
+                          " each in an op-test of its own, see common/OpTestFleet.py")
+    bmcgroup.add_argument("--qemu-snapshot-dir", default=None,
+                          help="[QEMU Only] Save the VM at the Petitboot shell here and restore it"
+                          " on later power ons instead of IPLing, see common/OpTestQemu.py")
     bmcgroup.add_argument("--mambo-binary", default=mambo_default,
                           help="[Mambo Only] mambo simulator binary, defaults to /opt/ibm/systemsim-p9/run/p9/power9")
     bmcgroup.add_argument("--mambo-initial-run-script", default=mambo_initial_run_script,
@@ -260,6 +288,14 @@ def get_parser():
                           help="[Mambo Only] mambo autorun, defaults to '1' to autorun")
     bmcgroup.add_argument("--mambo-timeout-factor", default=mambo_timeout_factor,
                           help="[Mambo Only] factor to multiply all timeouts by, defaults to 2")
+    bmcgroup.add_argument("--mambo-checkpoint-dir", default=None,
+                          help="[Mambo Only] Checkpoint the simulator at the Petitboot shell here and restore it"
+                          " on later power ons instead of booting, see common/OpTestMambo.py")
+    bmcgroup.add_argument("--mambo-boot-mode", default="fastest",
+                          help="[Mambo Only] simulator mode to boot in, defaults to fastest")
+    bmcgroup.add_argument("--mambo-test-mode", default=None,
+                          help="[Mambo Only] simulator mode to switch to once Petitboot is reached,"
+                          " e.g. a cycle accurate one, defaults to staying in the boot mode")
 
     hostgroup = parser.add_argument_group('Host', 'Installed OS information')
     hostgroup.add_argument("--host-ip", help="Host address")
@@ -318,6 +354,11 @@ def get_parser():
     osgroup.add_argument(
         "--os-cdrom", help="OS CD/DVD install image", default=None)
     osgroup.add_argument("--os-repo", help="OS repo", default="")
+    osgroup.add_argument("--artifact-cache", default=os.path.join("~", ".cache", "op-test"),
+                         help="Directory caching downloaded ISOs and netboot files across runs,"
+                         " empty to disable, see common/OpTestArtifactCache.py")
+    osgroup.add_argument("--artifact-cache-size", type=float, default=20,
+                         help="Size in GiB the artifact cache is trimmed to, 0 for no limit")
     osgroup.add_argument("--no-os-reinstall",
                          help="If set, don't run OS Install test",
                          action='store_true', default=False)
@@ -517,6 +558,11 @@ class OpTestConfiguration():
         if self.atexit_ready:
             # calling cleanup before args initialized pointless
             # attribute errors thrown in cleanup, e.g. ./op-test -h
+            try:
+                self.host().export_command_history()
+            except Exception as e:
+                OpTestLogger.optest_logger_glob.optest_logger.debug(
+                    "Unable to export the host command history: {}".format(e))
             self.util.cleanup()
 
     def parse_config_file(self, filename, optional=False):
@@ -641,16 +687,11 @@ class OpTestConfiguration():
         # set up where all the logs go
         logfile = os.path.join(self.output, "%s.log" % self.outsuffix)
 
-        logcmd = "tee %s" % (logfile)
-        # we use 'cat -v' to convert control characters
-        # to something that won't affect the user's terminal
         if self.args.quiet:
-            logcmd = logcmd + "> /dev/null"
             # save sh_level for later refresh loggers
             OpTestLogger.optest_logger_glob.sh_level = logging.ERROR
             OpTestLogger.optest_logger_glob.sh.setLevel(logging.ERROR)
         else:
-            logcmd = logcmd + "| sed -u -e 's/\\r$//g'|cat -v"
             # save sh_level for later refresh loggers
             OpTestLogger.optest_logger_glob.sh_level = logging.INFO
             OpTestLogger.optest_logger_glob.sh.setLevel(logging.INFO)
@@ -664,14 +705,15 @@ class OpTestConfiguration():
         OpTestLogger.optest_logger_glob.optest_logger.info(
             'StreamHandler setup {}'.format('quiet' if self.args.quiet else 'normal'))
 
-        self.logfile_proc = subprocess.Popen(logcmd,
-                                             stdin=subprocess.PIPE,
-                                             stderr=sys.stderr,
-                                             stdout=sys.stdout,
-                                             shell=True,
-                                             universal_newlines=True,
-                                             encoding='utf-8')
-        self.logfile = self.logfile_proc.stdin
+        # console output goes to logfile and, control characters made
+        # visible, to the terminal, written by the log pipeline thread
+        self.logfile = OpTestLogger.optest_logger_glob.console_stream(
+            logfile, None if self.args.quiet else sys.stdout)
+        # compressed console recording indexed by test, see ./op-console
+        recorder = OpTestConsoleRecorder(os.path.join(self.output, "console-record"),
+                                         OpTestLogger.optest_logger_glob.pipeline)
+        atexit.register(recorder.close)
+        OpTestLogger.optest_logger_glob.console_recorder = recorder
 
         # we have enough setup to allow
         # signal handler cleanup to run
@@ -796,6 +838,7 @@ class OpTestConfiguration():
                                       host=host,
                                       host_console_command=self.args.host_serial_console_command,
                                       logfile=self.logfile,
+                                      shell_sessions=self.args.ipmi_shell_sessions,
                                       )
 
                     bmc = OpTestBMC(ip=self.args.bmc_ip,
@@ -813,6 +856,7 @@ class OpTestConfiguration():
                                          self.args.bmc_passwordipmi,
                                          logfile=self.logfile,
                                          host=host,
+                                         shell_sessions=self.args.ipmi_shell_sessions,
                                          )
                     bmc = OpTestSMC(ip=self.args.bmc_ip,
                                     username=self.args.bmc_username,
@@ -835,7 +879,8 @@ class OpTestConfiguration():
                                   None,  # FSP does not use UID
                                   self.args.bmc_passwordipmi,
                                   host=host,
-                                  logfile=self.logfile)
+                                  logfile=self.logfile,
+                                  shell_sessions=self.args.ipmi_shell_sessions)
                 bmc = OpTestFSP(self.args.bmc_ip,
                                 self.args.bmc_username,
                                 self.args.bmc_password,
@@ -896,7 +941,8 @@ class OpTestConfiguration():
                                   self.args.bmc_usernameipmi,
                                   self.args.bmc_passwordipmi,
                                   host=host,
-                                  logfile=self.logfile)
+                                  logfile=self.logfile,
+                                  shell_sessions=self.args.ipmi_shell_sessions)
                 rest_api = HostManagement(conf=self,
                                           ip=self.args.bmc_ip,
                                           username=self.args.bmc_username,
@@ -981,7 +1027,12 @@ class OpTestConfiguration():
                                  kernel=self.args.flash_kernel,
                                  initramfs=self.args.flash_initramfs,
                                  cdrom=self.args.os_cdrom,
-                                 logfile=self.logfile)
+                                 logfile=self.logfile,
+                                 snapshot_dir=self.args.qemu_snapshot_dir,
+                                 memory=self.args.qemu_memory,
+                                 smp=self.args.qemu_smp,
+                                 accel=self.args.qemu_accel,
+                                 mac=self.args.qemu_mac)
                 self.op_system = common.OpTestSystem.OpTestQemuSystem(host=host,
                                                                       bmc=bmc,
                                                                       state=self.startState,
@@ -1007,6 +1058,9 @@ class OpTestConfiguration():
                                   kernel=self.args.flash_kernel,
                                   initramfs=self.args.flash_initramfs,
                                   timeout_factor=self.args.mambo_timeout_factor,
+                                  checkpoint_dir=self.args.mambo_checkpoint_dir,
+                                  boot_mode=self.args.mambo_boot_mode,
+                                  test_mode=self.args.mambo_test_mode,
                                   logfile=self.logfile)
                 self.op_system = common.OpTestSystem.OpTestMamboSystem(host=host,
                                                                        bmc=bmc,
@@ -20,18 +20,253 @@
 
 # This implements all the python logger setup for op-test
 
+import atexit
+import copy
 import os
+import queue
 import sys
+import threading
+import time
 from datetime import datetime
 import logging
 from logging.handlers import RotatingFileHandler
 
+# console control characters shown the way 'cat -v' shows them
+control_chars = {c: '^' + chr(c + 64) for c in range(32) if c not in (9, 10)}
+control_chars[127] = '^?'
+
+
+def sanitize(text):
+    '''
+    Console text made safe for a terminal, CR LF line ends become LF and
+    other control characters are shown as ^X.
+    '''
+    return text.replace('\r\n', '\n').translate(control_chars)
+
+
+class OpTestLogPipeline():
+    '''
+    Writes log records and console output from one background thread, so
+    a slow disk or terminal never stalls the thread producing them (e.g. a
+    pexpect console read).
+
+    Entries go through a bounded queue and are written in batches with one
+    flush per target per batch. Under pressure DEBUG entries are dropped
+    first (once the queue is `high_water` full), INFO and above wait up to
+    `block_timeout` seconds for room and are only dropped when that runs out.
+    Console output never waits. Drops are counted and reported in the logs.
+    '''
+
+    def __init__(self, capacity=20000, high_water=0.75, batch=1000, block_timeout=1.0):
+        self.queue = queue.Queue(capacity)
+        self.high_water = int(capacity * high_water)
+        self.batch = batch
+        self.block_timeout = block_timeout
+        # reentrant, the signal handler logs and flushes on the main thread
+        # which may be interrupted holding it in put()
+        self.lock = threading.RLock()
+        self.idle = threading.Condition(self.lock)
+        self.pending = 0
+        self.dropped = {}
+        self.reported = 0
+        self.thread = None
+        self.closed = False
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None or self.closed:
+                return
+            self.thread = threading.Thread(target=self.run, name="op-test-log-writer")
+            self.thread.daemon = True
+            self.thread.start()
+        atexit.register(self.close)
+
+    def put(self, level, target, item, wait=True):
+        '''
+        Queues item for target.write_batch(), wait=False never blocks.
+        '''
+        if self.thread is None or self.closed \
+                or threading.current_thread() is self.thread:
+            target.write_batch([item])
+            return
+        with self.lock:
+            self.pending += 1
+        try:
+            if level < logging.INFO:
+                if self.queue.qsize() >= self.high_water:
+                    raise queue.Full
+                self.queue.put_nowait((target, item))
+            elif wait:
+                self.queue.put((target, item), timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait((target, item))
+        except queue.Full:
+            name = logging.getLevelName(level)
+            with self.lock:
+                self.pending -= 1
+                self.dropped[name] = self.dropped.get(name, 0) + 1
+
+    def run(self):
+        while True:
+            entries = [self.queue.get()]
+            try:
+                while len(entries) < self.batch:
+                    entries.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            stop = None in entries
+            targets = {}
+            for entry in entries:
+                if entry is not None:
+                    targets.setdefault(entry[0], []).append(entry[1])
+            for target, items in targets.items():
+                try:
+                    target.write_batch(items)
+                except Exception as e:
+                    sys.stderr.write("op-test log writer failed: {}\n".format(e))
+            self.report_drops()
+            with self.lock:
+                self.pending -= len(entries) - (1 if stop else 0)
+                self.idle.notify_all()
+            if stop:
+                return
+
+    def report_drops(self):
+        if not self.dropped or time.time() - self.reported < 10:
+            return
+        with self.lock:
+            dropped, self.dropped = self.dropped, {}
+        self.reported = time.time()
+        # from the writer thread this is written straight away
+        logging.getLogger('op-test.OpTestLogger').warning(
+            "Log writer fell behind, dropped {}".format(
+                ", ".join("{} {}".format(n, name) for name, n in sorted(dropped.items()))))
+
+    def flush(self, timeout=10):
+        '''
+        Waits for everything queued so far to be written.
+        '''
+        deadline = time.time() + timeout
+        with self.idle:
+            while self.pending > 0 and self.thread is not None and not self.closed:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.idle.wait(remaining)
+        return True
+
+    def close(self, timeout=10):
+        if self.thread is None or self.closed:
+            self.closed = True
+            return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self.thread.join(timeout)
+        self.closed = True
+        self.report_drops()
+
+
+class BatchRotatingFileHandler(RotatingFileHandler):
+    '''
+    RotatingFileHandler that writes a batch of records with one flush.
+    '''
+
+    def write_batch(self, records):
+        self.acquire()
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            for record in records:
+                if record.levelno < self.level:
+                    continue
+                try:
+                    msg = self.format(record) + self.terminator
+                    if self.maxBytes > 0:
+                        pos = self.stream.tell()
+                        if pos and pos + len(msg) >= self.maxBytes:
+                            self.doRollover()
+                    self.stream.write(msg)
+                except Exception:
+                    self.handleError(record)
+            self.stream.flush()
+        finally:
+            self.release()
+
+
+class QueuedHandler(logging.Handler):
+    '''
+    Handler passing records to `target` through the log pipeline.
+    '''
+
+    def __init__(self, pipeline, target):
+        logging.Handler.__init__(self)
+        self.pipeline = pipeline
+        self.target = target
+
+    def emit(self, record):
+        try:
+            # format now, args may not be safe to use later from another thread
+            record = copy.copy(record)
+            record.msg = logging.Formatter().format(record)
+            record.args = None
+            record.exc_info = None
+            record.exc_text = None
+            record.stack_info = None
+            self.pipeline.put(record.levelno, self.target, record)
+        except Exception:
+            self.handleError(record)
+
+
+class OpTestLogStream():
+    '''
+    File like console log, what tee|sed|cat -v used to do in process.
+    Raw output is written to `path`, and if `terminal` is given, sanitized
+    copies go there. Writes never block, flush() is a no-op.
+    '''
+
+    def __init__(self, pipeline, path, terminal=None):
+        self.pipeline = pipeline
+        self.file = open(path, 'a', encoding='utf-8', errors='replace')
+        self.terminal = terminal
+        # CR held back in case the next chunk starts with LF
+        self.cr = ''
+
+    def write(self, data):
+        if data:
+            self.pipeline.put(logging.INFO, self, data, wait=False)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def write_batch(self, chunks):
+        text = ''.join(chunks)
+        self.file.write(text)
+        self.file.flush()
+        if self.terminal is None:
+            return
+        text = self.cr + text
+        self.cr = '\r' if text.endswith('\r') else ''
+        if self.cr:
+            text = text[:-1]
+        self.terminal.write(sanitize(text))
+        self.terminal.flush()
+
+    def close(self):
+        self.pipeline.flush()
+        self.file.close()
+
 
 class FileLikeLogger():
     def __init__(self, l):
         self.log = l
 
     def write(self, data):
+        recorder = optest_logger_glob.console_recorder
+        if recorder is not None:
+            recorder.write(data, self.log.name)
         lines = data.splitlines()
         for line in lines:
             self.log.debug(line.rstrip("\n"))
@@ -75,6 +310,10 @@ class OpTestLogger():
         self.optest_logger.addHandler(self.sh)
         self.fh = None
         self.dh = None
+        # file handlers and console logs are written from this thread
+        self.pipeline = OpTestLogPipeline()
+        # common.OpTestConsoleRecorder of the run, gets all console output
+        self.console_recorder = None
 
     def get_logger(self, myname):
         '''
@@ -100,12 +339,13 @@ class OpTestLogger():
         self.logger_file = logger_file
         if (not os.path.exists(self.logdir)):
             os.makedirs(self.logdir)
-        self.fh = RotatingFileHandler(os.path.join(self.logdir, self.logger_file),
+        fh = BatchRotatingFileHandler(os.path.join(self.logdir, self.logger_file),
                                       maxBytes=self.maxBytes_logger_file, backupCount=self.backupCount_logger_files,
                                       encoding="utf8")
-        self.fh.setLevel(logging.INFO)
-        self.fh.setFormatter(logging.Formatter(
+        fh.setLevel(logging.INFO)
+        fh.setFormatter(logging.Formatter(
             '%(asctime)s:%(name)s:%(levelname)s:%(message)s'))
+        self.fh = self.queued(fh)
         self.optest_logger.addHandler(self.fh)
         self.optest_logger.debug('FileHandler settings updated')
         self.optest_logger.info('Log file: {}'.format(
@@ -122,17 +362,60 @@ class OpTestLogger():
         self.logger_debug_file = logger_debug_file
         if (not os.path.exists(self.logdir)):
             os.makedirs(self.logdir)
-        self.dh = RotatingFileHandler(os.path.join(self.logdir, self.logger_debug_file),
-                                      maxBytes=self.maxBytes_logger_debug_file, backupCount=self.backupCount_debug_files,
-                                      encoding="utf8")
-        self.dh.setLevel(logging.DEBUG)
-        self.dh.setFormatter(logging.Formatter(
-            '%(asctime)s:%(name)s:%(funcName)s:%(levelname)s:%(message)s'))
+        self.dh = self.queued(self.debug_file_handler())
         self.optest_logger.addHandler(self.dh)
         self.optest_logger.debug('DebugHandler settings updated')
         self.optest_logger.info('Debug Log file: {}'.format(
             os.path.join(self.logdir, self.logger_debug_file)))
 
+    def debug_file_handler(self):
+        dh = BatchRotatingFileHandler(os.path.join(self.logdir, self.logger_debug_file),
+                                      maxBytes=self.maxBytes_logger_debug_file, backupCount=self.backupCount_debug_files,
+                                      encoding="utf8")
+        dh.setLevel(logging.DEBUG)
+        dh.setFormatter(logging.Formatter(
+            '%(asctime)s:%(name)s:%(funcName)s:%(levelname)s:%(message)s'))
+        return dh
+
+    def queued(self, handler):
+        '''
+        Handler at the level of `handler` that writes to it through the log
+        pipeline.
+        '''
+        self.pipeline.start()
+        queued = QueuedHandler(self.pipeline, handler)
+        queued.setLevel(handler.level)
+        return queued
+
+    def console_stream(self, path, terminal=None):
+        '''
+        File like object for raw console output, written to path and, when
+        given, to terminal with control characters made visible.
+        '''
+        self.pipeline.start()
+        return OpTestLogStream(self.pipeline, path, terminal)
+
+    def record_console(self, pty, source):
+        '''
+        Records what pty reads in the console recording, if any, for consoles
+        only logging to the console stream (QEMU, Mambo).
+        '''
+        if self.console_recorder is not None:
+            pty.logfile_read = self.console_recorder.tap(source)
+
+    def console_mark(self, kind, **fields):
+        '''
+        Marks a test or state change in the console recording, if any.
+        '''
+        if self.console_recorder is not None:
+            self.console_recorder.mark(kind, **fields)
+
+    def flush(self, timeout=10):
+        '''
+        Waits for queued log records and console output to be written.
+        '''
+        return self.pipeline.flush(timeout)
+
     def setUpChildLogger(self, logger_name=None, logger_debug_file=None):
         # setup library to send to optest_logger
         if logger_debug_file is None:
@@ -157,12 +440,7 @@ class OpTestLogger():
         self.logger_debug_file = logger_debug_file
         if (not os.path.exists(self.logdir)):
             os.makedirs(self.logdir)
-        self.dh = RotatingFileHandler(os.path.join(self.logdir, self.logger_debug_file),
-                                      maxBytes=self.maxBytes_logger_debug_file, backupCount=self.backupCount_debug_files,
-                                      encoding="utf8")
-        self.dh.setLevel(logging.DEBUG)
-        self.dh.setFormatter(logging.Formatter(
-            '%(asctime)s:%(name)s:%(funcName)s:%(levelname)s:%(message)s'))
+        self.dh = self.queued(self.debug_file_handler())
         self.optest_custom_logger.addHandler(self.dh)
         self.optest_custom_logger.debug(
             'DebugHandler settings updated for custom logger')
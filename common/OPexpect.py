@@ -34,9 +34,123 @@ certain error conditions to occur, you can catch the exceptions that OPexpect
 throws.
 """
 
+import re
+import time
 import pexpect
+from pexpect.expect import Expecter
 from .Exceptions import *
 
+import OpTestLogger
+log = OpTestLogger.optest_logger_glob.get_logger(__name__)
+
+# Error conditions looked for ahead of every caller pattern, the order here
+# is the index order spawn.expect() relies on to raise the right exception.
+op_patterns = ["qemu: could find kernel",
+               "INFO: rcu_sched self-detected stall on CPU",
+               "kernel BUG at",
+               "Kernel panic",
+               "Watchdog .* Hard LOCKUP",
+               "Oops: Kernel access of bad area",
+               "watchdog: .* detected hard LOCKUP on other CPUs",
+               "Watchdog .* detected Hard LOCKUP other CPUS",
+               "watchdog: BUG: soft lockup",
+               "\[[0-9. ]+,0\] Assert fail:",
+               "\[[0-9. ]+,[0-9]\] Unexpected exception",
+               "OPAL exiting with locks held",
+               "LOCK ERROR: Releasing lock we don't hold",
+               "OPAL: Reboot requested due to Platform error."
+               ]
+
+# All the error conditions as one alternation so they cost a single pass over
+# the buffer, the group name gives back the index into op_patterns. Same flags
+# pexpect compiles string patterns with.
+op_patterns_re = re.compile("|".join("(?P<op{}>{})".format(i, p)
+                                     for i, p in enumerate(op_patterns)),
+                            re.DOTALL)
+
+# How far back into already scanned data the error conditions are looked for
+# again when new data arrives, so a message split across reads still matches.
+SCAN_OVERLAP = 4096
+
+# Number of distinct patterns spawn.scan_stats keeps match costs for.
+SCAN_STATS_MAX = 256
+
+
+class OpSearcher(object):
+    '''
+    pexpect searcher which looks for the op_patterns only in newly arrived
+    data (plus SCAN_OVERLAP) using one combined regex, then for the caller
+    patterns the same way pexpect.searcher_re does. Indexes returned are
+    into op_patterns + caller patterns, first match in the buffer wins and
+    ties go to the lowest index, exactly like searcher_re.
+    '''
+
+    def __init__(self, compiled_pattern_list, stats):
+        self.eof_index = -1
+        self.timeout_index = -1
+        self.stats = stats
+        self._searches = []
+        for n, s in enumerate(compiled_pattern_list, len(op_patterns)):
+            if s is pexpect.EOF:
+                self.eof_index = n
+            elif s is pexpect.TIMEOUT:
+                self.timeout_index = n
+            else:
+                self._searches.append((n, s))
+
+    def __str__(self):
+        ss = ['OpSearcher:', '    0-{}: op_patterns'.format(len(op_patterns) - 1)]
+        ss += ['    {}: re.compile({!r})'.format(n, s.pattern) for n, s in self._searches]
+        if self.eof_index >= 0:
+            ss.append('    {}: EOF'.format(self.eof_index))
+        if self.timeout_index >= 0:
+            ss.append('    {}: TIMEOUT'.format(self.timeout_index))
+        return '\n'.join(ss)
+
+    def count(self, key, scanned, started, matched):
+        if key not in self.stats and len(self.stats) >= SCAN_STATS_MAX:
+            # one shot patterns (e.g. run_command frame markers) end up here
+            key = 'other patterns'
+        entry = self.stats.setdefault(key, [0, 0, 0.0, 0])
+        entry[0] += 1
+        entry[1] += scanned
+        entry[2] += time.perf_counter() - started
+        if matched:
+            entry[3] += 1
+
+    def search(self, buffer, freshlen, searchwindowsize=None):
+        if searchwindowsize is None:
+            searchstart = 0
+        else:
+            searchstart = max(0, len(buffer) - searchwindowsize)
+        first_match = None
+        scanstart = max(searchstart, len(buffer) - freshlen - SCAN_OVERLAP)
+        started = time.perf_counter()
+        match = op_patterns_re.search(buffer, scanstart)
+        self.count('op_patterns', len(buffer) - scanstart, started, match)
+        if match is not None:
+            first_match = match.start()
+            the_match = match
+            best_index = int(match.lastgroup[2:])
+            self.stats.setdefault(op_patterns[best_index], [0, 0, 0.0, 0])[3] += 1
+        for index, s in self._searches:
+            started = time.perf_counter()
+            match = s.search(buffer, searchstart)
+            self.count(s.pattern, len(buffer) - searchstart, started, match)
+            if match is None:
+                continue
+            n = match.start()
+            if first_match is None or n < first_match:
+                first_match = n
+                the_match = match
+                best_index = index
+        if first_match is None:
+            return -1
+        self.start = first_match
+        self.match = the_match
+        self.end = self.match.end()
+        return best_index
+
 
 class spawn(pexpect.spawn):
 
@@ -48,6 +162,8 @@ class spawn(pexpect.spawn):
         self.command = command
         self.failure_callback = failure_callback
         self.failure_callback_data = failure_callback_data
+        # pattern -> [scans, chars scanned, seconds, matches]
+        self.scan_stats = {}
         super(spawn, self).__init__(command, args=args,
                                     maxread=maxread,
                                     searchwindowsize=searchwindowsize,
@@ -61,32 +177,36 @@ class spawn(pexpect.spawn):
         self.op_test_system = system
         return
 
-    def expect(self, pattern, timeout=-1, searchwindowsize=-1):
-        op_patterns = ["qemu: could find kernel",
-                       "INFO: rcu_sched self-detected stall on CPU",
-                       "kernel BUG at",
-                       "Kernel panic",
-                       "Watchdog .* Hard LOCKUP",
-                       "Oops: Kernel access of bad area",
-                       "watchdog: .* detected hard LOCKUP on other CPUs",
-                       "Watchdog .* detected Hard LOCKUP other CPUS",
-                       "watchdog: BUG: soft lockup",
-                       "\[[0-9. ]+,0\] Assert fail:",
-                       "\[[0-9. ]+,[0-9]\] Unexpected exception",
-                       "OPAL exiting with locks held",
-                       "LOCK ERROR: Releasing lock we don't hold",
-                       "OPAL: Reboot requested due to Platform error."
-                       ]
+    def scan_stats_report(self):
+        '''
+        Returns the match cost of each pattern expect() has looked for on this
+        spawn, most expensive first, one line per pattern.
+        '''
+        report = []
+        for key, (scans, scanned, seconds, matches) in sorted(
+                self.scan_stats.items(), key=lambda x: x[1][2], reverse=True):
+            report.append("{:10.6f}s scans={} chars={} matches={} pattern={!r}".format(
+                seconds, scans, scanned, matches, key))
+        return report
+
+    def close(self, force=True):
+        if self.scan_stats:
+            log.debug("Expect match cost for '{}':\n{}".format(
+                self.command, "\n".join(self.scan_stats_report())))
+        super(spawn, self).close(force=force)
 
+    def expect(self, pattern, timeout=-1, searchwindowsize=-1):
         patterns = list(op_patterns)  # we want a *copy*
         if isinstance(pattern, list):
             patterns = patterns + pattern
         else:
             patterns.append(pattern)
 
-        r = super(spawn, self).expect(patterns,
-                                      timeout=timeout,
-                                      searchwindowsize=searchwindowsize)
+        if timeout == -1:
+            timeout = self.timeout
+        searcher = OpSearcher(self.compile_pattern_list(patterns[len(op_patterns):]),
+                              self.scan_stats)
+        r = Expecter(self, searcher, searchwindowsize).expect_loop(timeout)
 
         if r in [pexpect.EOF, pexpect.TIMEOUT]:
             return r
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# OpenPOWER Automated Test Project
+#
+# Contributors Listed Below - COPYRIGHT 2026
+# [+] International Business Machines Corp.
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+'''
+Artifact Cache
+--------------
+A local cache for install ISOs and netboot files (vmlinux, initrd) shared by
+every op-test process on the machine (--artifact-cache, --artifact-cache-size).
+
+Downloads are streamed into objects/<sha256> and a per URL entry in urls/
+remembers the ETag/Last-Modified the server sent with it, so the next run
+only sends a conditional GET. Identical content from different URLs is
+stored once. Files derived from an object (e.g. the vmlinux inside an ISO)
+are cached under a key made of the object's SHA-256 and their name.
+
+Downloads hold an exclusive lock on the URL, so parallel op-test runs
+wait for a single download instead of each fetching the ISO. Once the cache
+is over its size the least recently used objects are removed, except for
+ones in use (a shared lock held with hold()).
+'''
+
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+import OpTestLogger
+log = OpTestLogger.optest_logger_glob.get_logger(__name__)
+
+CHUNK_BYTES = 1024 * 1024
+# how often to log download progress, seconds
+PROGRESS_SECONDS = 30
+
+
+def url_key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+class CacheLock(object):
+    '''
+    flock() on a lock file, exclusive by default, as a context manager.
+    '''
+
+    def __init__(self, path, shared=False, blocking=True):
+        self.path = path
+        self.shared = shared
+        self.blocking = blocking
+        self.f = None
+
+    def acquire(self):
+        '''
+        Returns False when non blocking and the lock is taken.
+        '''
+        self.f = open(self.path, 'a')
+        flags = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        if not self.blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(self.f.fileno(), flags)
+        except (IOError, OSError):
+            self.f.close()
+            self.f = None
+            return False
+        return True
+
+    def release(self):
+        if self.f is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+            self.f.close()
+            self.f = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class OpTestArtifactCache(object):
+    '''
+    Content addressed cache of downloaded artifacts in directory, evicting
+    least recently used objects beyond max_bytes (0 for no limit).
+    '''
+
+    def __init__(self, directory, max_bytes=0):
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_bytes = max_bytes
+        self.objects = os.path.join(self.directory, "objects")
+        self.urls = os.path.join(self.directory, "urls")
+        self.locks = os.path.join(self.directory, "locks")
+        for d in (self.objects, self.urls, self.locks):
+            os.makedirs(d, exist_ok=True)
+        self.held = []
+
+    def lock(self, key, shared=False, blocking=True):
+        return CacheLock(os.path.join(self.locks, key + ".lock"), shared, blocking)
+
+    def object_path(self, digest):
+        return os.path.join(self.objects, digest)
+
+    def touch(self, path):
+        # the object mtime is its last use for the LRU
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def hold(self, path):
+        '''
+        Keeps the object at path from being evicted while this process runs
+        (e.g. an ISO that stays loop mounted).
+        '''
+        lock = self.lock(os.path.basename(path), shared=True)
+        lock.acquire()
+        self.held.append(lock)
+
+    def release(self):
+        for lock in self.held:
+            lock.release()
+        self.held = []
+
+    def read_entry(self, url):
+        try:
+            with open(os.path.join(self.urls, url_key(url) + ".json")) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.isfile(self.object_path(entry.get("sha256", ""))):
+            return None
+        return entry
+
+    def write_entry(self, url, entry):
+        path = os.path.join(self.urls, url_key(url) + ".json")
+        with open(path + ".tmp", 'w') as f:
+            json.dump(entry, f, indent=2)
+        os.rename(path + ".tmp", path)
+
+    def fetch(self, url, hold=False):
+        '''
+        Path of the cached copy of url, downloading it if it is not cached
+        or the server says it changed. Local files are returned as they are.
+        With hold the object is held (see hold()) before the URL lock is
+        released, so it can't be evicted before the caller gets to it.
+        '''
+        if os.path.isfile(url):
+            return url
+        with self.lock(url_key(url)):
+            path = self.validate(url)
+            if hold:
+                self.hold(path)
+                if not os.path.isfile(path):
+                    # another op-test evicted it before the hold took
+                    self.held.pop().release()
+                    path = self.validate(url)
+                    self.hold(path)
+            return path
+
+    def validate(self, url):
+        '''
+        fetch() with the URL lock held.
+        '''
+        entry = self.read_entry(url)
+        request = urllib.request.Request(url)
+        if entry and entry.get("etag"):
+            request.add_header("If-None-Match", entry["etag"])
+        if entry and entry.get("last_modified"):
+            request.add_header("If-Modified-Since", entry["last_modified"])
+        if entry and not entry.get("etag") and not entry.get("last_modified"):
+            # nothing to validate against, a same size HEAD will do
+            request.method = "HEAD"
+        try:
+            response = urllib.request.urlopen(request)
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and entry:
+                return self.hit(url, entry, "not modified")
+            raise
+        except (urllib.error.URLError, OSError) as e:
+            if entry:
+                log.warning("Artifact cache: {} unreachable ({}), using the cached copy".format(url, e))
+                return self.hit(url, entry, "unvalidated")
+            raise
+        if request.get_method() == "HEAD":
+            with response:
+                length = response.headers.get("Content-Length")
+            if length is None or int(length) == entry["length"]:
+                return self.hit(url, entry, "same size")
+            response = urllib.request.urlopen(url)
+        with response:
+            path = self.download(url, response)
+        self.evict(keep=path)
+        return path
+
+    def hit(self, url, entry, why):
+        path = self.object_path(entry["sha256"])
+        self.touch(path)
+        log.info("Artifact cache: using cached {} ({}, {})".format(url, entry["sha256"][:12], why))
+        return path
+
+    def download(self, url, response):
+        '''
+        Streams response into the cache, returns the object path.
+        '''
+        sha = hashlib.sha256()
+        length = 0
+        start = last = time.time()
+        total = response.headers.get("Content-Length")
+        fd, tmp = tempfile.mkstemp(dir=self.objects, prefix="download-")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    data = response.read(CHUNK_BYTES)
+                    if not data:
+                        break
+                    sha.update(data)
+                    f.write(data)
+                    length += len(data)
+                    if time.time() - last > PROGRESS_SECONDS:
+                        last = time.time()
+                        log.info("Artifact cache: {} {} MiB of {} MiB".format(
+                            url, length // 1048576,
+                            int(total) // 1048576 if total else "?"))
+            if total is not None and int(total) != length:
+                raise IOError("Download of {} truncated at {} of {} bytes".format(url, length, total))
+            digest = sha.hexdigest()
+            path = self.object_path(digest)
+            if os.path.isfile(path):
+                os.remove(tmp)
+                self.touch(path)
+            else:
+                os.chmod(tmp, 0o644)
+                os.rename(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.write_entry(url, {"url": url,
+                               "sha256": digest,
+                               "length": length,
+                               "etag": response.headers.get("ETag"),
+                               "last_modified": response.headers.get("Last-Modified"),
+                               "fetched": time.time()})
+        seconds = time.time() - start
+        log.info("Artifact cache: downloaded {} ({} MiB in {:.0f}s, {})".format(
+            url, length // 1048576, seconds, digest[:12]))
+        return path
+
+    def derived(self, source, name, produce):
+        '''
+        Path of a file derived from the cached object source (e.g. a file
+        inside an ISO), calling produce(destination) to create it when it is
+        not cached yet.
+        '''
+        key = hashlib.sha256("{}:{}".format(
+            os.path.basename(source), name).encode('utf-8')).hexdigest()
+        path = self.object_path(key)
+        with self.lock(key):
+            if os.path.isfile(path):
+                self.touch(path)
+                log.debug("Artifact cache: using cached {} of {}".format(name, os.path.basename(source)[:12]))
+                return path
+            fd, tmp = tempfile.mkstemp(dir=self.objects, prefix="derive-")
+            os.close(fd)
+            try:
+                produce(tmp)
+                os.chmod(tmp, 0o644)
+                os.rename(tmp, path)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        '''
+        Removes least recently used objects until the cache fits max_bytes.
+        '''
+        if not self.max_bytes:
+            return
+        objects = []
+        total = 0
+        for name in os.listdir(self.objects):
+            path = self.object_path(name)
+            if name.startswith(("download-", "derive-")):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            objects.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        for mtime, size, path in sorted(objects):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            lock = self.lock(os.path.basename(path), blocking=False)
+            if not lock.acquire():
+                # held by a running op-test
+                continue
+            try:
+                os.remove(path)
+                total -= size
+                log.info("Artifact cache: evicted {} ({} MiB)".format(
+                    os.path.basename(path)[:12], size // 1048576))
+            except OSError:
+                pass
+            finally:
+                lock.release()
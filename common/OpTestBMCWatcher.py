@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# OpenPOWER Automated Test Project
+#
+# Contributors Listed Below - COPYRIGHT 2026
+# [+] International Business Machines Corp.
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+'''
+BMC State Watcher
+-----------------
+Waits for OpenBMC D-Bus objects (host state, BMC state, software
+activations) to reach a value over the REST API.
+
+When the websocket-client package is installed the watcher subscribes to the
+OpenBMC /subscribe websocket and re-reads an object as soon as the BMC says
+one of its properties changed. Without it, or while the websocket is down
+(e.g. across a BMC reboot), it polls, quickly at first and backing off.
+
+Concurrent waiters on the same object share one in flight GET, and each
+response is parsed once.
+'''
+
+import json
+import ssl
+import threading
+import time
+
+from .Exceptions import HTTPCheck
+
+import OpTestLogger
+log = OpTestLogger.optest_logger_glob.get_logger(__name__)
+
+try:
+    import websocket
+    HAS_WEBSOCKET = True
+except ImportError:
+    HAS_WEBSOCKET = False
+
+# adaptive polling, seconds
+POLL_FIRST = 0.25
+POLL_GROWTH = 1.5
+POLL_MAX = 5
+# with a live subscription polling is only a safety net
+POLL_SUBSCRIBED = 30
+
+
+def dbus_path(uri):
+    '''
+    D-Bus object path of a REST uri, e.g.
+    /xyz/openbmc_project/state/bmc0/attr/CurrentBMCState is
+    /xyz/openbmc_project/state/bmc0
+    '''
+    return uri.split("/attr/")[0].rstrip("/")
+
+
+class Flight(object):
+    '''
+    One GET in progress, shared by every waiter asking for the same uri.
+    '''
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.data = None
+        self.error = None
+
+
+class OpBMCStateWatcher(object):
+    '''
+    Waits on OpenBMC REST objects for OpTestOpenBMC.HostManagement.
+
+    `server` is the OpTestUtil.Server used for the REST calls.
+    '''
+
+    def __init__(self, server, subscribe=True):
+        self.server = server
+        self.subscribe = subscribe and HAS_WEBSOCKET
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.flights = {}
+        self.paths = set()
+        # path -> number of change events seen, waiters compare counts
+        self.generation = {}
+        self.ws = None
+        self.ws_thread = None
+        self.ws_connected = False
+        self.stats = {"gets": 0, "shared": 0, "events": 0}
+
+    def fetch(self, uri, minutes=None):
+        '''
+        GETs uri and returns its parsed 'data', joining a GET already in
+        flight for the same uri rather than sending another.
+        '''
+        with self.lock:
+            flight = self.flights.get(uri)
+            leader = flight is None
+            if leader:
+                flight = self.flights[uri] = Flight()
+                self.stats["gets"] += 1
+            else:
+                self.stats["shared"] += 1
+        if not leader:
+            flight.done.wait()
+        else:
+            try:
+                r = self.server.get(uri=uri, minutes=minutes)
+                flight.data = r.json().get('data')
+            except Exception as e:
+                flight.error = e
+            finally:
+                with self.lock:
+                    del self.flights[uri]
+                flight.done.set()
+        if flight.error is not None:
+            raise flight.error
+        return flight.data
+
+    def wait(self, uri, match, minutes=10, description=None):
+        '''
+        Waits until match(data) is true for the 'data' of uri, returns that
+        data. Raises HTTPCheck after `minutes`.
+        '''
+        path = dbus_path(uri)
+        self.watch(path)
+        timeout = time.time() + 60 * minutes
+        interval = POLL_FIRST
+        start = time.time()
+        while True:
+            with self.lock:
+                seen = self.generation.get(path, 0)
+            data = self.fetch(uri, minutes=minutes)
+            if match(data):
+                log.debug("BMC \"{}\" matched after {:.1f}s".format(
+                    uri, time.time() - start))
+                return data
+            if time.time() > timeout:
+                log.warning("We timed out waiting for \"{}\", we waited {} minutes for \"{}\"".format(
+                    uri, minutes, description))
+                raise HTTPCheck(message="HTTP problem getting \"{}\", we waited {} minutes for \"{}\"".format(
+                    uri, minutes, description))
+            wait = POLL_SUBSCRIBED if self.ws_connected else interval
+            wait = max(0, min(wait, timeout - time.time()))
+            with self.changed:
+                if self.generation.get(path, 0) == seen:
+                    self.changed.wait(wait)
+            interval = min(interval * POLL_GROWTH, POLL_MAX)
+
+    def watch(self, path):
+        '''
+        Adds path to the websocket subscription, starting the websocket on
+        first use.
+        '''
+        if not self.subscribe:
+            return
+        with self.lock:
+            if path in self.paths:
+                return
+            self.paths.add(path)
+            paths = list(self.paths)
+            start = self.ws_thread is None
+        if start:
+            self.ws_thread = threading.Thread(target=self.ws_loop,
+                                              name="bmc-state-watcher")
+            self.ws_thread.daemon = True
+            self.ws_thread.start()
+        elif self.ws_connected:
+            self.send_subscription(paths)
+
+    def send_subscription(self, paths):
+        try:
+            self.ws.send(json.dumps({"paths": paths}))
+        except Exception as e:
+            log.debug("BMC subscription update failed: {}".format(e))
+
+    def ws_url(self):
+        base = self.server.base_url
+        if base.startswith("https://"):
+            return "wss://" + base[len("https://"):].split("/")[0] + "/subscribe"
+        return "ws://" + base[len("http://"):].split("/")[0] + "/subscribe"
+
+    def on_open(self, ws):
+        self.ws_connected = True
+        with self.lock:
+            paths = list(self.paths)
+        log.debug("BMC subscription open for {}".format(paths))
+        self.send_subscription(paths)
+
+    def on_message(self, ws, message):
+        try:
+            event = json.loads(message)
+        except ValueError:
+            return
+        path = event.get("path")
+        if not path:
+            return
+        with self.changed:
+            self.stats["events"] += 1
+            for watched in self.paths:
+                if path == watched or path.startswith(watched + "/"):
+                    self.generation[watched] = self.generation.get(watched, 0) + 1
+            self.changed.notify_all()
+
+    def on_close(self, ws, *args):
+        self.ws_connected = False
+        # wake the waiters so they fall back to polling
+        with self.changed:
+            self.changed.notify_all()
+
+    def ws_loop(self):
+        backoff = 1
+        while self.subscribe:
+            headers = ["{}: {}".format(k, v)
+                       for k, v in self.server.xAuthHeader.items()]
+            cookie = "; ".join("{}={}".format(k, v)
+                               for k, v in self.server.session.cookies.get_dict().items())
+            self.ws = websocket.WebSocketApp(self.ws_url(), header=headers,
+                                             cookie=cookie or None,
+                                             on_open=self.on_open,
+                                             on_message=self.on_message,
+                                             on_close=self.on_close,
+                                             on_error=lambda ws, e: log.debug(
+                                                 "BMC subscription error: {}".format(e)))
+            opened = time.time()
+            try:
+                self.ws.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE},
+                                    ping_interval=30, ping_timeout=10)
+            except Exception as e:
+                log.debug("BMC subscription failed: {}".format(e))
+            self.on_close(self.ws)
+            # a subscription that keeps failing quickly is not supported,
+            # back off up to a minute and rely on polling meanwhile
+            backoff = 1 if time.time() - opened > 60 else min(backoff * 2, 60)
+            time.sleep(backoff)
+
+    def close(self):
+        self.subscribe = False
+        if self.ws is not None:
+            try:
+                self.ws.close()
+            except Exception:
+                pass
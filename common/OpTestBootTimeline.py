@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# OpenPOWER Automated Test Project
+#
+# Contributors Listed Below - COPYRIGHT 2026
+# [+] International Business Machines Corp.
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+'''
+Boot Timeline
+-------------
+Records when the OpTestSystem state machine changes state and when boot
+milestones (Hostboot isteps, skiboot, petitboot, kernel, userspace) show up
+on the console, and writes the timeline of the run to the output directory
+as boot-timeline.json and boot-timeline.csv.
+
+Comparing these files between runs shows where IPL time went and catches
+boot time regressions between firmware builds.
+'''
+
+import csv
+import datetime
+import json
+import os
+import re
+import threading
+import time
+
+import OpTestLogger
+log = OpTestLogger.optest_logger_glob.get_logger(__name__)
+
+# console milestones, only the first hit of each per boot is recorded except
+# for isteps where every new istep is a milestone of its own
+console_milestones = [
+    ("istep", re.compile(r"ISTEP +(\d+)\. *(\d+)")),
+    ("skiboot", re.compile(r"OPAL (skiboot-\S+|v\S+) starting")),
+    ("petitboot", re.compile(r"Petitboot")),
+    ("kernel", re.compile(r"Linux version \d")),
+    ("userspace", re.compile(r"systemd\[1\]|Welcome to |INIT: version")),
+    ("login", re.compile(r"login: ")),
+]
+
+TIMELINE_FIELDS = ["offset", "time", "kind", "name", "detail", "seconds"]
+
+
+def utc_iso(when):
+    return datetime.datetime.fromtimestamp(when, datetime.timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class OpBootTimeline(object):
+    '''
+    Timeline of state transitions and console milestones for one op-test run.
+
+    Events are dicts with the fields in TIMELINE_FIELDS, `offset` is seconds
+    since the timeline was created and `seconds` is the duration of the step
+    that ended with the event, when there is one.
+    '''
+
+    def __init__(self, output=None, name="boot-timeline"):
+        self.output = output
+        self.name = name
+        self.start = time.time()
+        self.events = []
+        self.seen = set()
+        self.lock = threading.Lock()
+
+    def add(self, kind, name, detail=None, seconds=None):
+        now = time.time()
+        event = {"offset": round(now - self.start, 3),
+                 "time": utc_iso(now),
+                 "kind": kind,
+                 "name": name,
+                 "detail": detail,
+                 "seconds": None if seconds is None else round(seconds, 3)}
+        with self.lock:
+            self.events.append(event)
+        log.debug("Boot timeline {:10.3f}s {} {} {}".format(
+            event["offset"], kind, name, detail if detail is not None else ""))
+        return event
+
+    def state(self, name, detail=None, seconds=None):
+        '''
+        Records an OpSystemState transition, `seconds` being the time the
+        state handler took.
+        '''
+        if name in ["OFF", "IPLing", "POWERING_OFF", "UNKNOWN_BAD"]:
+            # a new boot, milestones count afresh
+            with self.lock:
+                self.seen.clear()
+        return self.add("state", name, detail, seconds)
+
+    def milestone(self, name, detail=None):
+        '''
+        Records a boot milestone, callbacks and matched console strings.
+        '''
+        return self.add("milestone", name, detail)
+
+    def console_line(self, line):
+        '''
+        Console line listener, records the first of each console milestone.
+        '''
+        for name, pattern in console_milestones:
+            m = pattern.search(line)
+            if m is None:
+                continue
+            key = "istep {}.{}".format(*m.groups()) if name == "istep" else name
+            with self.lock:
+                if key in self.seen:
+                    continue
+                self.seen.add(key)
+            self.add("console", key, line.strip()[:200])
+
+    def phases(self):
+        '''
+        Returns (from, to, seconds) for each pair of consecutive events.
+        '''
+        with self.lock:
+            events = list(self.events)
+        return [(a["name"], b["name"], round(b["offset"] - a["offset"], 3))
+                for a, b in zip(events, events[1:])]
+
+    def write(self):
+        if not self.output:
+            return
+        with self.lock:
+            events = list(self.events)
+        try:
+            with open(os.path.join(self.output, self.name + ".json"), 'w') as f:
+                json.dump({"start": utc_iso(self.start),
+                           "events": events}, f, indent=2)
+            with open(os.path.join(self.output, self.name + ".csv"), 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=TIMELINE_FIELDS)
+                writer.writeheader()
+                writer.writerows(events)
+        except Exception as e:
+            log.warning("Unable to write the boot timeline to {}: {}".format(self.output, e))
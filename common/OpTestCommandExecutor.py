@@ -30,7 +30,8 @@ import threading
 from typing import Optional, List, Callable
 from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
 
-from .OpTestSSHConnection import OpTestSSHConnection, OpTestCommandResult
+from .OpTestSSHConnection import OpTestSSHConnection, OpTestCommandResult, STREAM_MAX_BUFFER
+from .OpTestCommandHistory import OpTestCommandHistory, OpTestCommandRecord
 from .Exceptions import SSHCommandFailed, SSHSessionDisconnected, CommandFailed
 
 import logging
@@ -47,7 +48,7 @@ class OpTestCommandExecutor:
     - Exponential backoff for retries
     - Sudo command execution without expect patterns
     - Async command execution
-    - Command history tracking
+    - Bounded command history with per command duration percentiles
     - Comprehensive logging
     
     Example:
@@ -59,7 +60,8 @@ class OpTestCommandExecutor:
     """
     
     def __init__(self, connection: OpTestSSHConnection, 
-                 default_timeout: int = 60, default_retry: int = 0):
+                 default_timeout: int = 60, default_retry: int = 0,
+                 history_depth: int = 1000, history_output_limit: int = 4096):
         """
         Initialize command executor.
         
@@ -67,11 +69,14 @@ class OpTestCommandExecutor:
             connection: OpTestSSHConnection instance
             default_timeout: Default command timeout in seconds
             default_retry: Default number of retries for failed commands
+            history_depth: Number of recent commands kept in the history
+            history_output_limit: Characters of output kept per history entry
         """
         self.connection = connection
         self.default_timeout = default_timeout
         self.default_retry = default_retry
-        self.command_history: List[OpTestCommandResult] = []
+        self.command_history = OpTestCommandHistory(depth=history_depth,
+                                                    output_limit=history_output_limit)
         self.lock = threading.RLock()
         
         log.debug(f"OpTestCommandExecutor initialized for {connection.host}")
@@ -268,7 +273,8 @@ class OpTestCommandExecutor:
     
     def run_commands_parallel(self, commands: List[str], 
                              timeout: Optional[int] = None,
-                             max_workers: int = 5) -> List[OpTestCommandResult]:
+                             max_workers: int = 5,
+                             connection_manager=None) -> List[OpTestCommandResult]:
         """
         Execute multiple commands in parallel.
         
@@ -276,14 +282,23 @@ class OpTestCommandExecutor:
             commands: List of commands to execute
             timeout: Timeout for each command
             max_workers: Maximum number of parallel workers
+            connection_manager: OpTestConnectionManager to take one pooled
+                connection per worker from, see its run_commands_parallel
             
         Returns:
             List[OpTestCommandResult]: List of command results
             
         Note:
-            This requires multiple SSH connections. Use with OpTestConnectionManager.
+            Without a connection_manager all commands share this executor's
+            connection and run one at a time.
         """
         timeout = timeout if timeout is not None else self.default_timeout
+        if connection_manager is not None:
+            # each result goes in the history of the pooled executor that ran it
+            return connection_manager.run_commands_parallel(
+                self.connection.host, self.connection.username,
+                self.connection.password, commands, port=self.connection.port,
+                timeout=timeout, max_workers=max_workers)
         results = []
         
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
@@ -292,7 +307,7 @@ class OpTestCommandExecutor:
                 for cmd in commands
             ]
             
-            for future in futures:
+            for cmd, future in zip(commands, futures):
                 try:
                     result = future.result(timeout=timeout + 10)
                     results.append(result)
@@ -300,7 +315,7 @@ class OpTestCommandExecutor:
                     log.error(f"Parallel command execution failed: {e}")
                     # Create error result
                     error_result = OpTestCommandResult(
-                        command="<parallel command>",
+                        command=cmd,
                         exit_code=-1,
                         stdout="",
                         stderr=str(e),
@@ -313,7 +328,11 @@ class OpTestCommandExecutor:
     
     def run_command_with_output_callback(self, command: str,
                                         output_callback: Callable[[str], None],
-                                        timeout: Optional[int] = None) -> OpTestCommandResult:
+                                        timeout: Optional[int] = None,
+                                        spill_file: Optional[str] = None,
+                                        max_buffer_bytes: Optional[int] = STREAM_MAX_BUFFER,
+                                        stderr_callback: Optional[Callable[[str], None]] = None
+                                        ) -> OpTestCommandResult:
         """
         Execute command and stream output to callback function.
         
@@ -323,64 +342,104 @@ class OpTestCommandExecutor:
             command: Command to execute
             output_callback: Function to call with each line of output
             timeout: Command timeout in seconds
+            spill_file: Write all of stdout to this file
+            max_buffer_bytes: Keep at most this much output in the result
+            stderr_callback: Function to call with each line of stderr
             
         Returns:
             OpTestCommandResult: Command execution result
+            
+        Raises:
+            SSHCommandFailed: If command fails
         """
-        # For now, execute normally and call callback with full output
-        # Future enhancement: implement true streaming
-        result = self.run_command(command, timeout=timeout)
+        timeout = timeout if timeout is not None else self.default_timeout
+        partial = {'stdout': '', 'stderr': ''}
+        callbacks = {'stdout': output_callback, 'stderr': stderr_callback}
+        
+        def on_chunk(stream, data):
+            # hand complete lines to the callback, keep the partial last line
+            lines = (partial[stream] + data).split('\n')
+            partial[stream] = lines.pop()
+            if callbacks[stream]:
+                for line in lines:
+                    callbacks[stream](line.rstrip('\r'))
+        
+        try:
+            result = self.connection.execute_command_streaming(
+                command=command,
+                timeout=timeout,
+                output_callback=on_chunk,
+                spill_file=spill_file,
+                max_buffer_bytes=max_buffer_bytes
+            )
+        finally:
+            for stream, rest in partial.items():
+                if rest and callbacks[stream]:
+                    callbacks[stream](rest.rstrip('\r'))
         
-        for line in result.stdout.splitlines():
-            output_callback(line)
+        with self.lock:
+            self.command_history.append(result)
         
         return result
     
-    def get_command_history(self, limit: Optional[int] = None) -> List[OpTestCommandResult]:
+    def get_command_history(self, limit: Optional[int] = None) -> List[OpTestCommandRecord]:
         """
         Get command execution history.
         
         Args:
-            limit: Maximum number of recent commands to return (None for all)
+            limit: Maximum number of recent commands to return (None for all
+                retained)
             
         Returns:
-            List[OpTestCommandResult]: List of command results
+            List[OpTestCommandRecord]: Commands with truncated output, oldest first
         """
-        with self.lock:
-            if limit:
-                return self.command_history[-limit:]
-            return self.command_history.copy()
+        return self.command_history.entries(limit)
     
     def clear_command_history(self) -> None:
         """Clear command execution history."""
-        with self.lock:
-            self.command_history.clear()
-            log.debug("Command history cleared")
+        self.command_history.clear()
+        log.debug("Command history cleared")
+    
+    def export_command_history(self, directory: str,
+                               name: Optional[str] = None) -> Optional[str]:
+        """
+        Write the command history and statistics to directory.
+        
+        Args:
+            directory: Directory to write to, usually the results directory
+            name: Base file name (defaults to command-history-<host>)
+            
+        Returns:
+            str: Path of the history file, None if nothing was written
+        """
+        name = name or f"command-history-{self.connection.host}"
+        return self.command_history.export(directory, name)
     
     def get_statistics(self) -> dict:
         """
         Get executor statistics.
         
         Returns:
-            dict: Statistics including command count, success rate, etc.
+            dict: Statistics including command count, success rate, duration
+            percentiles and the same per command prefix
         """
-        with self.lock:
-            total_commands = len(self.command_history)
-            successful_commands = sum(1 for r in self.command_history if r.success)
-            failed_commands = total_commands - successful_commands
-            
-            total_duration = sum(r.duration for r in self.command_history)
-            avg_duration = total_duration / total_commands if total_commands > 0 else 0
-            
-            return {
-                'total_commands': total_commands,
-                'successful_commands': successful_commands,
-                'failed_commands': failed_commands,
-                'success_rate': successful_commands / total_commands if total_commands > 0 else 0,
-                'total_duration': total_duration,
-                'average_duration': avg_duration,
-                'connection_host': self.connection.host
-            }
+        stats = self.command_history.statistics()
+        total = stats['total']
+        
+        return {
+            'total_commands': total['count'],
+            'successful_commands': total['count'] - total['failures'],
+            'failed_commands': total['failures'],
+            'success_rate': 1 - total['failure_rate'] if total['count'] > 0 else 0,
+            'total_duration': total['total_duration'],
+            'average_duration': total['average_duration'],
+            'p50_duration': total['p50'],
+            'p95_duration': total['p95'],
+            'p99_duration': total['p99'],
+            'retained_commands': stats['retained'],
+            'prefixes': stats['prefixes'],
+            'connection_host': self.connection.host
+        }
     
     def __str__(self):
         stats = self.get_statistics()
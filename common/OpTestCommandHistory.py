@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# OpenPOWER Automated Test Project
+#
+# Contributors Listed Below - COPYRIGHT 2026
+# [+] International Business Machines Corp.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""
+OpTestCommandHistory
+--------------------
+
+Bounded command history for OpTestCommandExecutor.
+Keeps the most recent commands in a ring buffer with their output truncated,
+and running per command aggregates (count, failures, duration percentiles)
+that are updated in constant time, so multi-day runs do not grow memory.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import OpTestLogger
+log = OpTestLogger.optest_logger_glob.get_logger(__name__)
+
+# duration histogram, log scaled buckets from 1ms up to about 28 hours
+BUCKET_BASE = 0.001
+BUCKET_GROWTH = 1.1
+BUCKET_COUNT = 180
+
+# run_sudo_command puts the password in the command line
+sudo_password = re.compile(r"^echo '.*?' \| sudo -S -p '' ")
+# commands running the next word as the command, with their options that
+# take an argument
+wrapper_options = {"sudo": ["-u", "-g", "-p", "-C", "-h", "-U", "-r", "-t", "-D", "-R", "-T"],
+                   "env": ["-u", "-C", "-S"],
+                   "nohup": [],
+                   "time": ["-f", "-o"]}
+
+
+def command_prefix(command: str) -> str:
+    """
+    Aggregation key of a command, the program name without path, sudo or
+    leading variable assignments, e.g. "/usr/bin/sudo FOO=1 lsprop -R" is
+    "lsprop".
+    """
+    command = sudo_password.sub("", command)
+    words = command.split()
+    wrapper = None
+    while words:
+        word = words.pop(0)
+        name = os.path.basename(word)
+        if name in wrapper_options:
+            wrapper = name
+            continue
+        if re.match(r"\w+=", word):
+            continue
+        if wrapper and word.startswith("-"):
+            # the wrapper's options, and the argument of those taking one
+            if word in wrapper_options[wrapper] and words:
+                words.pop(0)
+            continue
+        return name
+    return ""
+
+
+class OpTestCommandRecord:
+    """
+    One command in the history, output truncated to the history limit.
+    Has the same attributes as OpTestCommandResult.
+    """
+    __slots__ = ('command', 'exit_code', 'stdout', 'stderr', 'duration',
+                 'timestamp', 'success', 'host')
+
+    def __init__(self, result, output_limit: int):
+        self.command = sudo_password.sub("echo '****' | sudo -S -p '' ", result.command)
+        self.exit_code = result.exit_code
+        self.stdout = truncate(result.stdout, output_limit)
+        self.stderr = truncate(result.stderr, output_limit)
+        self.duration = result.duration
+        self.timestamp = result.timestamp
+        self.success = result.success
+        self.host = result.host
+
+    def to_dict(self) -> dict:
+        return {'command': self.command,
+                'exit_code': self.exit_code,
+                'duration': round(self.duration, 3),
+                'timestamp': self.timestamp.isoformat(),
+                'success': self.success,
+                'host': self.host,
+                'stdout': self.stdout,
+                'stderr': self.stderr}
+
+    def __str__(self):
+        return (f"CommandRecord(cmd='{self.command[:50]}...', "
+                f"exit_code={self.exit_code}, duration={self.duration:.2f}s)")
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def truncate(text: str, limit: int) -> str:
+    """Keeps the head and tail of text, limit characters in all."""
+    if limit is None or len(text) <= limit:
+        return text
+    half = limit // 2
+    return "{}\n...[{} chars truncated]...\n{}".format(
+        text[:half], len(text) - limit, text[len(text) - (limit - half):])
+
+
+class OpTestCommandStats:
+    """
+    Running aggregates for one command prefix. Durations go into a fixed log
+    scaled histogram, percentiles are read from it to within ~10%.
+    """
+    __slots__ = ('count', 'failures', 'total_duration', 'min_duration',
+                 'max_duration', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.total_duration = 0.0
+        self.min_duration = None
+        self.max_duration = 0.0
+        self.buckets = [0] * BUCKET_COUNT
+
+    def add(self, duration: float, success: bool) -> None:
+        self.count += 1
+        if not success:
+            self.failures += 1
+        self.total_duration += duration
+        self.max_duration = max(self.max_duration, duration)
+        self.min_duration = duration if self.min_duration is None else min(self.min_duration, duration)
+        if duration <= BUCKET_BASE:
+            bucket = 0
+        else:
+            bucket = min(BUCKET_COUNT - 1,
+                         int(math.log(duration / BUCKET_BASE, BUCKET_GROWTH)) + 1)
+        self.buckets[bucket] += 1
+
+    def percentile(self, p: float) -> float:
+        """Upper bound of the bucket holding the p-th percentile duration."""
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * p / 100.0)
+        seen = 0
+        for bucket, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(BUCKET_BASE * BUCKET_GROWTH ** bucket, self.max_duration)
+        return self.max_duration
+
+    def to_dict(self) -> dict:
+        return {'count': self.count,
+                'failures': self.failures,
+                'failure_rate': self.failures / self.count if self.count else 0,
+                'total_duration': round(self.total_duration, 3),
+                'average_duration': self.total_duration / self.count if self.count else 0,
+                'min_duration': self.min_duration or 0.0,
+                'max_duration': self.max_duration,
+                'p50': self.percentile(50),
+                'p95': self.percentile(95),
+                'p99': self.percentile(99)}
+
+
+class OpTestCommandHistory:
+    """
+    Ring buffer of the last `depth` commands plus aggregates over every
+    command ever added.
+
+    Example:
+        >>> history = OpTestCommandHistory(depth=500, output_limit=2048)
+        >>> history.append(result)
+        >>> history.statistics()['prefixes']['lsprop']['p95']
+        >>> history.export('/path/to/results')
+    """
+
+    def __init__(self, depth: int = 1000, output_limit: int = 4096):
+        """
+        Args:
+            depth: Number of recent commands kept
+            output_limit: Characters of stdout and of stderr kept per command
+        """
+        self.depth = depth
+        self.output_limit = output_limit
+        self.records = deque(maxlen=depth)
+        self.total = OpTestCommandStats()
+        self.prefixes: Dict[str, OpTestCommandStats] = {}
+        self.lock = threading.Lock()
+
+    def append(self, result) -> None:
+        """Adds an OpTestCommandResult."""
+        record = OpTestCommandRecord(result, self.output_limit)
+        prefix = command_prefix(result.command)
+        with self.lock:
+            self.records.append(record)
+            self.total.add(record.duration, record.success)
+            stats = self.prefixes.get(prefix)
+            if stats is None:
+                stats = self.prefixes[prefix] = OpTestCommandStats()
+            stats.add(record.duration, record.success)
+
+    def entries(self, limit: Optional[int] = None) -> List[OpTestCommandRecord]:
+        """Most recent records, oldest first."""
+        with self.lock:
+            records = list(self.records)
+        if limit:
+            return records[-limit:]
+        return records
+
+    def clear(self) -> None:
+        with self.lock:
+            self.records.clear()
+            self.total = OpTestCommandStats()
+            self.prefixes = {}
+
+    def statistics(self) -> dict:
+        with self.lock:
+            return {'total': self.total.to_dict(),
+                    'retained': len(self.records),
+                    'depth': self.depth,
+                    'prefixes': {prefix: stats.to_dict()
+                                 for prefix, stats in self.prefixes.items()}}
+
+    def export(self, directory: str, name: str = "command-history") -> Optional[str]:
+        """
+        Writes the retained records as JSON lines to <name>.jsonl and the
+        aggregates to <name>-stats.json in directory.
+
+        Returns:
+            str: Path of the records file, None if nothing was written
+        """
+        if not directory:
+            return None
+        records = self.entries()
+        path = os.path.join(directory, name + ".jsonl")
+        try:
+            with open(path, 'w') as f:
+                for record in records:
+                    f.write(json.dumps(record.to_dict()) + "\n")
+            with open(os.path.join(directory, name + "-stats.json"), 'w') as f:
+                json.dump(dict(self.statistics(),
+                               exported=datetime.now().isoformat()), f, indent=2)
+        except Exception as e:
+            log.warning(f"Unable to export command history to {directory}: {e}")
+            return None
+        log.debug(f"Exported {len(records)} commands to {path}")
+        return path
+
+    def __len__(self):
+        with self.lock:
+            return len(self.records)
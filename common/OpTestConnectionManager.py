@@ -23,14 +23,19 @@ OpTestConnectionManager
 Connection pool manager for SSH connections.
 Manages multiple SSH connections efficiently with connection pooling,
 health monitoring, and automatic cleanup.
+
+Each host (username@host:port) gets its own pool of up to
+max_connections_per_host connections, so several threads can run commands
+on the same host at once, each on its own connection.
 """
 
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Optional, List, Tuple
 from datetime import datetime, timedelta
 
-from .OpTestSSHConnection import OpTestSSHConnection
+from .OpTestSSHConnection import OpTestSSHConnection, OpTestCommandResult
 from .OpTestCommandExecutor import OpTestCommandExecutor
 from .Exceptions import SSHConnectionFailed
 
@@ -46,15 +51,18 @@ class ConnectionInfo:
     Attributes:
         connection: The SSH connection object
         executor: Command executor for this connection
+        key: Pool key ("username@host:port") the connection belongs to
         created_at: When the connection was created
         last_used: When the connection was last used
         use_count: Number of times connection has been used
         in_use: Whether connection is currently in use
     """
     
-    def __init__(self, connection: OpTestSSHConnection, executor: OpTestCommandExecutor):
+    def __init__(self, connection: OpTestSSHConnection, executor: OpTestCommandExecutor,
+                 key: Optional[str] = None):
         self.connection = connection
         self.executor = executor
+        self.key = key
         self.created_at = datetime.now()
         self.last_used = datetime.now()
         self.use_count = 0
@@ -90,16 +98,46 @@ class ConnectionInfo:
         return (datetime.now() - self.last_used).total_seconds()
 
 
+class HostPool:
+    """
+    Connections to one host (username@host:port).
+    
+    Attributes:
+        key: Pool key
+        host, username, password, port, timeout: How to open new connections
+        idle: Connections not in use, least recently used first
+        busy: Connections handed out by get_connection
+        creating: Connections being opened right now (outside the manager lock)
+    """
+    
+    def __init__(self, key: str, host: str, username: str, password: str,
+                 port: int, timeout: int):
+        self.key = key
+        self.host = host
+        self.username = username
+        self.password = password
+        self.port = port
+        self.timeout = timeout
+        self.idle: List[ConnectionInfo] = []
+        self.busy: List[ConnectionInfo] = []
+        self.creating = 0
+    
+    def size(self) -> int:
+        """Connections open or being opened."""
+        return len(self.idle) + len(self.busy) + self.creating
+
+
 class OpTestConnectionManager:
     """
     Manage pool of SSH connections with health monitoring and cleanup.
     
     This class provides:
-    - Connection pooling and reuse
-    - Automatic health monitoring
-    - Stale connection cleanup
-    - Connection lifecycle management
-    - Thread-safe operations
+    - Per host connection pools with a minimum and maximum size
+    - Blocking acquire with timeout when a host's pool is exhausted
+    - Connections opened outside the manager lock, so a slow host does not
+      stall threads working with other hosts
+    - Least recently used eviction of idle connections at max_connections
+    - Automatic health monitoring and idle connection reaping
     - Connection statistics
     
     Example:
@@ -113,7 +151,10 @@ class OpTestConnectionManager:
     def __init__(self, max_connections: int = 20, 
                  max_idle_time: int = 300,
                  max_connection_age: int = 3600,
-                 health_check_interval: int = 60):
+                 health_check_interval: int = 60,
+                 min_connections_per_host: int = 0,
+                 max_connections_per_host: int = 8,
+                 acquire_timeout: int = 300):
         """
         Initialize connection manager.
         
@@ -122,35 +163,103 @@ class OpTestConnectionManager:
             max_idle_time: Maximum idle time before cleanup (seconds)
             max_connection_age: Maximum connection age before refresh (seconds)
             health_check_interval: Interval for health checks (seconds)
+            min_connections_per_host: Idle connections kept open per host
+            max_connections_per_host: Maximum connections per host
+            acquire_timeout: Default time to wait for a free connection (seconds)
         """
         self.max_connections = max_connections
         self.max_idle_time = max_idle_time
         self.max_connection_age = max_connection_age
         self.health_check_interval = health_check_interval
+        self.min_connections_per_host = min_connections_per_host
+        self.max_connections_per_host = max_connections_per_host
+        self.acquire_timeout = acquire_timeout
         
-        # Connection pool: key = "username@host:port"
-        self.connections: Dict[str, ConnectionInfo] = {}
+        # Connection pools: key = "username@host:port"
+        self.pools: Dict[str, HostPool] = {}
+        # ConnectionInfo by id() of the connection handed out
+        self.connections: Dict[int, ConnectionInfo] = {}
         self.lock = threading.RLock()
+        # signalled whenever a connection is released or closed
+        self.available = threading.Condition(self.lock)
         
         # Statistics
         self.total_connections_created = 0
         self.total_connections_reused = 0
         self.total_connections_closed = 0
+        self.total_connections_evicted = 0
+        self.total_acquire_waits = 0
         
         # Health monitoring thread
         self.health_monitor_running = False
         self.health_monitor_thread: Optional[threading.Thread] = None
         
-        log.info(f"OpTestConnectionManager initialized (max_connections={max_connections})")
+        log.info(f"OpTestConnectionManager initialized (max_connections={max_connections}, "
+                 f"per host {min_connections_per_host}-{max_connections_per_host})")
     
     def _get_connection_key(self, host: str, username: str, port: int = 22) -> str:
         """Generate unique key for connection."""
         return f"{username}@{host}:{port}"
     
+    def _total_connections(self) -> int:
+        """Connections open or being opened over all pools (lock held)."""
+        return sum(pool.size() for pool in self.pools.values())
+    
+    def _pop_lru_idle(self) -> Optional[ConnectionInfo]:
+        """Remove and return the least recently used idle connection (lock held)."""
+        victim = None
+        for pool in self.pools.values():
+            if pool.idle and (victim is None or pool.idle[0].last_used < victim.last_used):
+                victim = pool.idle[0]
+        if victim is not None:
+            self.pools[victim.key].idle.remove(victim)
+            del self.connections[id(victim.connection)]
+        return victim
+    
+    def _disconnect(self, conn_info: ConnectionInfo) -> None:
+        """Disconnect a connection already removed from its pool (lock not held)."""
+        try:
+            conn_info.connection.disconnect()
+        except Exception as e:
+            log.debug(f"Error closing connection {conn_info.key}: {e}")
+        with self.lock:
+            self.total_connections_closed += 1
+            self.available.notify_all()
+        log.debug(f"Closed connection: {conn_info.key}")
+    
+    def _open_connection(self, pool: HostPool) -> ConnectionInfo:
+        """Open a new connection for pool, pool.creating already counted (lock not held)."""
+        log.info(f"Creating new SSH connection: {pool.key}")
+        try:
+            connection = OpTestSSHConnection(
+                host=pool.host,
+                username=pool.username,
+                password=pool.password,
+                port=pool.port,
+                timeout=pool.timeout
+            )
+            connection.connect()
+        except Exception as e:
+            with self.lock:
+                pool.creating -= 1
+                self.available.notify_all()
+            log.error(f"Failed to create connection {pool.key}: {e}")
+            raise SSHConnectionFailed(f"Failed to create connection to {pool.key}", e)
+        conn_info = ConnectionInfo(connection, OpTestCommandExecutor(connection), pool.key)
+        with self.lock:
+            pool.creating -= 1
+            self.connections[id(connection)] = conn_info
+            self.total_connections_created += 1
+        log.info(f"Successfully created connection: {pool.key}")
+        return conn_info
+    
     def get_connection(self, host: str, username: str, password: str,
-                      port: int = 22, timeout: int = 30) -> Tuple[OpTestSSHConnection, OpTestCommandExecutor]:
+                      port: int = 22, timeout: int = 30,
+                      acquire_timeout: Optional[int] = None) -> Tuple[OpTestSSHConnection, OpTestCommandExecutor]:
         """
-        Get or create SSH connection and executor.
+        Get a connection and executor from the host's pool, opening a new
+        connection if none is idle, or waiting for one to be released if the
+        pool is at max_connections_per_host.
         
         Args:
             host: Hostname or IP address
@@ -158,67 +267,75 @@ class OpTestConnectionManager:
             password: SSH password
             port: SSH port
             timeout: Connection timeout
+            acquire_timeout: Time to wait for a free connection (uses default if None)
             
         Returns:
             Tuple[OpTestSSHConnection, OpTestCommandExecutor]: Connection and executor
             
         Raises:
-            SSHConnectionFailed: If connection cannot be established
+            SSHConnectionFailed: If connection cannot be established or no
+                connection became free within acquire_timeout
         """
         key = self._get_connection_key(host, username, port)
+        acquire_timeout = acquire_timeout if acquire_timeout is not None else self.acquire_timeout
+        deadline = time.time() + acquire_timeout
         
-        with self.lock:
-            # Check if connection exists and is healthy
-            if key in self.connections:
-                conn_info = self.connections[key]
-                
-                # Check if connection is healthy and not too old
-                if (conn_info.is_healthy() and 
-                    conn_info.get_age() < self.max_connection_age):
-                    
-                    if conn_info.acquire():
-                        self.total_connections_reused += 1
-                        log.debug(f"Reusing existing connection: {key}")
-                        return conn_info.connection, conn_info.executor
-                    else:
-                        log.debug(f"Connection {key} is in use, creating new one")
-                else:
-                    log.debug(f"Connection {key} is unhealthy or too old, recreating")
-                    self._close_connection(key)
+        while True:
+            candidate = None
+            victim = None
+            create = False
+            with self.lock:
+                pool = self.pools.get(key)
+                if pool is None:
+                    pool = self.pools[key] = HostPool(key, host, username, password, port, timeout)
+                pool.password = password
+                if pool.idle:
+                    # most recently used first, it is the most likely to still be up
+                    candidate = pool.idle.pop()
+                    candidate.acquire()
+                    pool.busy.append(candidate)
+                elif pool.size() < self.max_connections_per_host:
+                    if self._total_connections() >= self.max_connections:
+                        victim = self._pop_lru_idle()
+                    if victim is not None or self._total_connections() < self.max_connections:
+                        pool.creating += 1
+                        create = True
+                if candidate is None and not create:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise SSHConnectionFailed(
+                            f"No connection to {key} became free within {acquire_timeout}s "
+                            f"(pool size {pool.size()}, max {self.max_connections_per_host})")
+                    self.total_acquire_waits += 1
+                    log.debug(f"Connection pool {key} exhausted, waiting up to {remaining:.0f}s")
+                    self.available.wait(remaining)
+                    continue
             
-            # Check connection limit
-            if len(self.connections) >= self.max_connections:
-                log.warning(f"Connection limit reached ({self.max_connections}), "
-                          "cleaning up stale connections")
-                self._cleanup_stale_connections_internal()
+            if victim is not None:
+                log.debug(f"Connection limit reached ({self.max_connections}), evicting {victim.key}")
+                with self.lock:
+                    self.total_connections_evicted += 1
+                self._disconnect(victim)
             
-            # Create new connection
-            log.info(f"Creating new SSH connection: {key}")
+            if candidate is not None:
+                # health check outside the lock, it talks to the host
+                if candidate.is_healthy() and candidate.get_age() < self.max_connection_age:
+                    with self.lock:
+                        self.total_connections_reused += 1
+                    log.debug(f"Reusing existing connection: {key}")
+                    return candidate.connection, candidate.executor
+                log.debug(f"Connection {key} is unhealthy or too old, recreating")
+                with self.lock:
+                    pool.busy.remove(candidate)
+                    del self.connections[id(candidate.connection)]
+                self._disconnect(candidate)
+                continue
             
-            try:
-                connection = OpTestSSHConnection(
-                    host=host,
-                    username=username,
-                    password=password,
-                    port=port,
-                    timeout=timeout
-                )
-                connection.connect()
-                
-                executor = OpTestCommandExecutor(connection)
-                
-                conn_info = ConnectionInfo(connection, executor)
+            conn_info = self._open_connection(pool)
+            with self.lock:
                 conn_info.acquire()
-                
-                self.connections[key] = conn_info
-                self.total_connections_created += 1
-                
-                log.info(f"Successfully created connection: {key}")
-                return connection, executor
-                
-            except Exception as e:
-                log.error(f"Failed to create connection {key}: {e}")
-                raise SSHConnectionFailed(f"Failed to create connection to {key}", e)
+                pool.busy.append(conn_info)
+            return conn_info.connection, conn_info.executor
     
     def release_connection(self, connection: OpTestSSHConnection) -> None:
         """
@@ -227,27 +344,31 @@ class OpTestConnectionManager:
         Args:
             connection: Connection to release
         """
-        key = self._get_connection_key(connection.host, connection.username, connection.port)
-        
         with self.lock:
-            if key in self.connections:
-                self.connections[key].release()
-                log.debug(f"Released connection: {key}")
-            else:
-                log.warning(f"Attempted to release unknown connection: {key}")
+            conn_info = self.connections.get(id(connection))
+            if conn_info is None or not conn_info.in_use:
+                log.warning(f"Attempted to release unknown connection: "
+                            f"{self._get_connection_key(connection.host, connection.username, connection.port)}")
+                return
+            pool = self.pools[conn_info.key]
+            pool.busy.remove(conn_info)
+            conn_info.release()
+            pool.idle.append(conn_info)
+            self.available.notify_all()
+            log.debug(f"Released connection: {conn_info.key}")
     
     def _close_connection(self, key: str) -> None:
-        """Internal method to close and remove connection."""
-        if key in self.connections:
-            conn_info = self.connections[key]
-            try:
-                conn_info.connection.disconnect()
-            except Exception as e:
-                log.debug(f"Error closing connection {key}: {e}")
-            finally:
-                del self.connections[key]
-                self.total_connections_closed += 1
-                log.debug(f"Closed connection: {key}")
+        """Internal method to close and remove all idle connections of a pool."""
+        with self.lock:
+            pool = self.pools.get(key)
+            if pool is None:
+                return
+            closing = pool.idle
+            pool.idle = []
+            for conn_info in closing:
+                del self.connections[id(conn_info.connection)]
+        for conn_info in closing:
+            self._disconnect(conn_info)
     
     def close_connection(self, connection: OpTestSSHConnection) -> None:
         """
@@ -256,36 +377,51 @@ class OpTestConnectionManager:
         Args:
             connection: Connection to close
         """
-        key = self._get_connection_key(connection.host, connection.username, connection.port)
-        
         with self.lock:
-            self._close_connection(key)
+            conn_info = self.connections.pop(id(connection), None)
+            if conn_info is None:
+                return
+            pool = self.pools[conn_info.key]
+            if conn_info in pool.busy:
+                pool.busy.remove(conn_info)
+            else:
+                pool.idle.remove(conn_info)
+        self._disconnect(conn_info)
     
     def _cleanup_stale_connections_internal(self) -> int:
-        """Internal method to cleanup stale connections (must be called with lock held)."""
-        cleaned = 0
-        keys_to_remove = []
+        """Internal method to cleanup stale connections, idle ones only."""
+        with self.lock:
+            candidates = [c for pool in self.pools.values() for c in pool.idle]
         
-        for key, conn_info in self.connections.items():
-            # Skip connections currently in use
-            if conn_info.in_use:
-                continue
-            
-            # Check if connection is stale
-            if (not conn_info.is_healthy() or
-                conn_info.get_idle_time() > self.max_idle_time or
-                conn_info.get_age() > self.max_connection_age):
-                
-                keys_to_remove.append(key)
+        # health checks talk to the hosts, keep them outside the lock
+        stale = [c for c in candidates
+                 if (c.get_idle_time() > self.max_idle_time or
+                     c.get_age() > self.max_connection_age or
+                     not c.is_healthy())]
         
-        for key in keys_to_remove:
-            self._close_connection(key)
-            cleaned += 1
+        removed = []
+        with self.lock:
+            for conn_info in stale:
+                pool = self.pools[conn_info.key]
+                # somebody may have picked it up meanwhile
+                if conn_info not in pool.idle:
+                    continue
+                # keep the pool minimum unless the connection is broken or old
+                if (len(pool.idle) + len(pool.busy) <= self.min_connections_per_host and
+                        conn_info.get_age() <= self.max_connection_age and
+                        conn_info.is_healthy()):
+                    continue
+                pool.idle.remove(conn_info)
+                del self.connections[id(conn_info.connection)]
+                removed.append(conn_info)
+        
+        for conn_info in removed:
+            self._disconnect(conn_info)
         
-        if cleaned > 0:
-            log.info(f"Cleaned up {cleaned} stale connections")
+        if removed:
+            log.info(f"Cleaned up {len(removed)} stale connections")
         
-        return cleaned
+        return len(removed)
     
     def cleanup_stale_connections(self) -> int:
         """
@@ -294,19 +430,50 @@ class OpTestConnectionManager:
         Returns:
             int: Number of connections cleaned up
         """
+        return self._cleanup_stale_connections_internal()
+    
+    def fill_pools(self) -> int:
+        """
+        Open connections until every pool has min_connections_per_host.
+        
+        Returns:
+            int: Number of connections opened
+        """
+        opened = 0
         with self.lock:
-            return self._cleanup_stale_connections_internal()
+            pools = list(self.pools.values())
+        for pool in pools:
+            while True:
+                with self.lock:
+                    if (pool.size() >= self.min_connections_per_host or
+                            self._total_connections() >= self.max_connections):
+                        break
+                    pool.creating += 1
+                try:
+                    conn_info = self._open_connection(pool)
+                except SSHConnectionFailed as e:
+                    log.debug(f"Unable to fill pool {pool.key}: {e}")
+                    break
+                with self.lock:
+                    pool.idle.append(conn_info)
+                    self.available.notify_all()
+                opened += 1
+        return opened
     
     def cleanup_all(self) -> None:
         """Close all connections and cleanup."""
         with self.lock:
-            log.info(f"Closing all {len(self.connections)} connections")
-            
-            keys = list(self.connections.keys())
-            for key in keys:
-                self._close_connection(key)
-            
-            log.info("All connections closed")
+            closing = list(self.connections.values())
+            log.info(f"Closing all {len(closing)} connections")
+            self.connections.clear()
+            for pool in self.pools.values():
+                pool.idle = []
+                pool.busy = []
+        
+        for conn_info in closing:
+            self._disconnect(conn_info)
+        
+        log.info("All connections closed")
     
     def start_health_monitor(self) -> None:
         """Start background health monitoring thread."""
@@ -334,7 +501,7 @@ class OpTestConnectionManager:
         log.info("Health monitor stopped")
     
     def _health_monitor_loop(self) -> None:
-        """Background thread for health monitoring."""
+        """Background thread for health monitoring, reaps idle connections."""
         log.debug("Health monitor loop started")
         
         while self.health_monitor_running:
@@ -346,12 +513,51 @@ class OpTestConnectionManager:
                 
                 log.debug("Running health check...")
                 self.cleanup_stale_connections()
+                self.fill_pools()
                 
             except Exception as e:
                 log.error(f"Error in health monitor loop: {e}")
         
         log.debug("Health monitor loop stopped")
     
+    def run_commands_parallel(self, host: str, username: str, password: str,
+                              commands: List[str], port: int = 22,
+                              timeout: Optional[int] = None,
+                              max_workers: Optional[int] = None) -> List[OpTestCommandResult]:
+        """
+        Run commands on a host concurrently, each worker on its own pooled
+        connection. A command that could not run (disconnect, timeout) gets
+        a result with exit code -1 and the error as stderr.
+        
+        Args:
+            host: Hostname or IP address
+            username: SSH username
+            password: SSH password
+            commands: List of commands to execute
+            port: SSH port
+            timeout: Timeout for each command
+            max_workers: Parallel workers (defaults to max_connections_per_host)
+            
+        Returns:
+            List[OpTestCommandResult]: Results in command order
+        """
+        max_workers = max_workers or self.max_connections_per_host
+        
+        def run_one(command):
+            try:
+                connection, executor = self.get_connection(host, username, password, port)
+                try:
+                    return executor.run_command_ignore_fail(command, timeout=timeout)
+                finally:
+                    self.release_connection(connection)
+            except Exception as e:
+                log.error(f"Parallel command execution failed: {e}")
+                return OpTestCommandResult(command=command, exit_code=-1, stdout="",
+                                           stderr=str(e), duration=0.0, host=host)
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(run_one, commands))
+    
     def get_connection_stats(self) -> dict:
         """
         Get connection pool statistics.
@@ -360,20 +566,28 @@ class OpTestConnectionManager:
             dict: Statistics about connection pool
         """
         with self.lock:
-            active_connections = sum(1 for c in self.connections.values() if c.in_use)
-            idle_connections = len(self.connections) - active_connections
+            all_connections = list(self.connections.values())
+            active_connections = sum(1 for c in all_connections if c.in_use)
+            idle_connections = len(all_connections) - active_connections
             
-            total_use_count = sum(c.use_count for c in self.connections.values())
-            avg_use_count = total_use_count / len(self.connections) if self.connections else 0
+            total_use_count = sum(c.use_count for c in all_connections)
+            avg_use_count = total_use_count / len(all_connections) if all_connections else 0
             
             return {
-                'total_connections': len(self.connections),
+                'total_connections': len(all_connections),
                 'active_connections': active_connections,
                 'idle_connections': idle_connections,
                 'max_connections': self.max_connections,
+                'max_connections_per_host': self.max_connections_per_host,
+                'min_connections_per_host': self.min_connections_per_host,
+                'pools': {key: {'idle': len(pool.idle), 'busy': len(pool.busy),
+                                'creating': pool.creating}
+                          for key, pool in self.pools.items()},
                 'total_created': self.total_connections_created,
                 'total_reused': self.total_connections_reused,
                 'total_closed': self.total_connections_closed,
+                'total_evicted': self.total_connections_evicted,
+                'total_acquire_waits': self.total_acquire_waits,
                 'reuse_rate': (self.total_connections_reused / 
                              (self.total_connections_created + self.total_connections_reused)
                              if (self.total_connections_created + self.total_connections_reused) > 0 
@@ -390,23 +604,24 @@ class OpTestConnectionManager:
             List[dict]: List of connection information
         """
         with self.lock:
-            connections = []
-            for key, conn_info in self.connections.items():
-                connections.append({
-                    'key': key,
-                    'host': conn_info.connection.host,
-                    'port': conn_info.connection.port,
-                    'username': conn_info.connection.username,
-                    'connected': conn_info.connection.connected,
-                    'healthy': conn_info.is_healthy(),
-                    'in_use': conn_info.in_use,
-                    'use_count': conn_info.use_count,
-                    'age_seconds': conn_info.get_age(),
-                    'idle_seconds': conn_info.get_idle_time(),
-                    'created_at': conn_info.created_at.isoformat(),
-                    'last_used': conn_info.last_used.isoformat()
-                })
-            return connections
+            all_connections = list(self.connections.values())
+        connections = []
+        for conn_info in all_connections:
+            connections.append({
+                'key': conn_info.key,
+                'host': conn_info.connection.host,
+                'port': conn_info.connection.port,
+                'username': conn_info.connection.username,
+                'connected': conn_info.connection.connected,
+                'healthy': conn_info.is_healthy(),
+                'in_use': conn_info.in_use,
+                'use_count': conn_info.use_count,
+                'age_seconds': conn_info.get_age(),
+                'idle_seconds': conn_info.get_idle_time(),
+                'created_at': conn_info.created_at.isoformat(),
+                'last_used': conn_info.last_used.isoformat()
+            })
+        return connections
     
     def __enter__(self):
         """Context manager entry."""
@@ -427,4 +642,3 @@ class OpTestConnectionManager:
     
     def __repr__(self):
         return self.__str__()
-
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+# OpenPOWER Automated Test Project
+#
+# Contributors Listed Below - COPYRIGHT 2026
+# [+] International Business Machines Corp.
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+'''
+Console Recorder
+----------------
+Keeps everything the consoles printed during a run, compressed and indexed
+by test and system state, in <output>/console-record.
+
+Records are timestamped and length prefixed:
+
+  <f8 time><B kind><B source length><I data length> source data
+
+kind 0 is console data, source being the console logger name, kind 1 a
+JSON marker (test start/stop, state change). Records are packed into blocks
+of up to BLOCK_BYTES or BLOCK_SECONDS, cut whenever the test or state
+changes, and each block is compressed on its own (a gzip member, or a zstd
+frame when the zstandard package is installed) and appended to the current
+console-NNNN.rec.gz|zst segment. Concatenated members are still a valid
+gzip/zstd file, so zcat works on a whole segment.
+
+console-index.jsonl has one line per block (segment, offset, length, time
+range, test, state) and one per marker, so a test's console output is found
+by bisecting the blocks by time and only those blocks are decompressed:
+
+  ./op-console test-reports/test-run-X/console-record --list
+  ./op-console test-reports/test-run-X/console-record --failed
+  ./op-console test-reports/test-run-X/console-record --test testcases.Foo.Bar.runTest
+'''
+
+import argparse
+import bisect
+import gzip
+import json
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+from datetime import datetime
+
+import OpTestLogger
+log = OpTestLogger.optest_logger_glob.get_logger(__name__)
+
+try:
+    import zstandard
+    HAS_ZSTD = True
+except ImportError:
+    HAS_ZSTD = False
+
+RECORD = struct.Struct("<dBBI")
+CONSOLE = 0
+MARK = 1
+
+BLOCK_BYTES = 64 * 1024
+BLOCK_SECONDS = 5
+SEGMENT_BYTES = 64 * 1024 * 1024
+INDEX_FILE = "console-index.jsonl"
+
+outcomes_failed = ["failure", "error", "unexpected success"]
+
+
+def compress(data, compression):
+    if compression == "zst":
+        return zstandard.ZstdCompressor().compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def decompress(data, compression):
+    if compression == "zst":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def parse_records(data):
+    '''
+    Yields (time, kind, source, text) from a decompressed block.
+    '''
+    pos = 0
+    while pos + RECORD.size <= len(data):
+        when, kind, source_len, data_len = RECORD.unpack_from(data, pos)
+        pos += RECORD.size
+        source = data[pos:pos + source_len].decode('utf-8', 'replace')
+        pos += source_len
+        text = data[pos:pos + data_len].decode('utf-8', 'replace')
+        pos += data_len
+        yield when, kind, source, text
+
+
+class ConsoleTap(object):
+    '''
+    File like object feeding one console into the recorder.
+    '''
+
+    def __init__(self, recorder, source):
+        self.recorder = recorder
+        self.source = source
+
+    def write(self, data):
+        self.recorder.write(data, self.source)
+
+    def flush(self):
+        pass
+
+
+class OpTestConsoleRecorder(object):
+    '''
+    Writes console records for a run into directory. With a log pipeline
+    (OpTestLogger.OpTestLogPipeline) compression and disk writes happen on
+    the pipeline thread and write() never blocks.
+    '''
+
+    def __init__(self, directory, pipeline=None, block_bytes=BLOCK_BYTES,
+                 block_seconds=BLOCK_SECONDS, segment_bytes=SEGMENT_BYTES):
+        self.directory = directory
+        self.pipeline = pipeline
+        self.block_bytes = block_bytes
+        self.block_seconds = block_seconds
+        self.segment_bytes = segment_bytes
+        self.compression = "zst" if HAS_ZSTD else "gz"
+        self.lock = threading.Lock()
+        self.test = None
+        self.state = None
+        self.block = bytearray()
+        self.block_start = None
+        self.block_end = None
+        self.block_records = 0
+        self.segment = -1
+        self.segment_file = None
+        self.closed = False
+        os.makedirs(directory, exist_ok=True)
+        self.index = open(os.path.join(directory, INDEX_FILE), 'a')
+        self.next_segment()
+
+    def next_segment(self):
+        if self.segment_file is not None:
+            self.segment_file.close()
+        self.segment += 1
+        self.segment_name = "console-{:04d}.rec.{}".format(self.segment, self.compression)
+        self.segment_file = open(os.path.join(self.directory, self.segment_name), 'ab')
+
+    def tap(self, source):
+        return ConsoleTap(self, source)
+
+    def write(self, data, source="console"):
+        self.put((time.time(), CONSOLE, source, data))
+
+    def mark(self, kind, **fields):
+        '''
+        Adds a marker, kind "test" (fields test, event, outcome) or "state"
+        (field state) also switch what the following blocks are indexed as.
+        '''
+        fields["mark"] = kind
+        self.put((time.time(), MARK, kind, fields))
+
+    def put(self, item):
+        if self.closed:
+            return
+        if self.pipeline is not None:
+            self.pipeline.put(logging.INFO, self, item, wait=False)
+        else:
+            self.write_batch([item])
+
+    def write_batch(self, items):
+        with self.lock:
+            if self.closed:
+                return
+            for when, kind, source, data in items:
+                if kind == MARK:
+                    self.add_mark(when, source, data)
+                else:
+                    self.add_record(when, kind, source, data)
+            if self.block and (len(self.block) >= self.block_bytes
+                               or time.time() - self.block_start >= self.block_seconds):
+                self.cut_block()
+
+    def add_record(self, when, kind, source, text):
+        source = source.encode('utf-8', 'replace')[:255]
+        # consoles spawned without an encoding hand over bytes
+        data = text if isinstance(text, bytes) else text.encode('utf-8', 'replace')
+        if not self.block:
+            self.block_start = when
+        self.block += RECORD.pack(when, kind, len(source), len(data))
+        self.block += source
+        self.block += data
+        self.block_end = when
+        self.block_records += 1
+
+    def add_mark(self, when, kind, fields):
+        test, state = self.test, self.state
+        if kind == "test":
+            test = fields["test"] if fields.get("event") == "start" else None
+        elif kind == "state":
+            state = fields.get("state")
+        if (test, state) != (self.test, self.state):
+            self.cut_block()
+        self.add_record(when, MARK, kind, json.dumps(fields))
+        self.test, self.state = test, state
+        self.index.write(json.dumps(dict(fields, time=when)) + "\n")
+        self.index.flush()
+
+    def cut_block(self):
+        if not self.block:
+            return
+        data = compress(bytes(self.block), self.compression)
+        offset = self.segment_file.tell()
+        self.segment_file.write(data)
+        self.segment_file.flush()
+        self.index.write(json.dumps({"segment": self.segment_name,
+                                     "offset": offset,
+                                     "length": len(data),
+                                     "bytes": len(self.block),
+                                     "records": self.block_records,
+                                     "start": self.block_start,
+                                     "end": self.block_end,
+                                     "test": self.test,
+                                     "state": self.state}) + "\n")
+        self.index.flush()
+        self.block = bytearray()
+        self.block_records = 0
+        if offset + len(data) >= self.segment_bytes:
+            self.next_segment()
+
+    def close(self, timeout=10):
+        if self.pipeline is not None:
+            self.pipeline.flush(timeout)
+        # from a signal handler the interrupted thread may hold the lock
+        # half way through a record, leave the open block unwritten then
+        if not self.lock.acquire(timeout=timeout):
+            return
+        try:
+            if self.closed:
+                return
+            self.cut_block()
+            self.closed = True
+            self.segment_file.close()
+            self.index.close()
+        finally:
+            self.lock.release()
+
+
+def recording_result(base):
+    '''
+    unittest result class based on base marking test start, stop and
+    outcome in the console recorder.
+    '''
+    class RecordingResult(base):
+        def startTest(self, test):
+            self.console_outcome = "success"
+            OpTestLogger.optest_logger_glob.console_mark(
+                "test", test=test.id(), event="start")
+            super(RecordingResult, self).startTest(test)
+
+        def stopTest(self, test):
+            super(RecordingResult, self).stopTest(test)
+            OpTestLogger.optest_logger_glob.console_mark(
+                "test", test=test.id(), event="stop", outcome=self.console_outcome)
+
+        def addError(self, test, err):
+            self.console_outcome = "error"
+            super(RecordingResult, self).addError(test, err)
+
+        def addFailure(self, test, err):
+            self.console_outcome = "failure"
+            super(RecordingResult, self).addFailure(test, err)
+
+        def addSkip(self, test, reason):
+            self.console_outcome = "skip"
+            super(RecordingResult, self).addSkip(test, reason)
+
+        def addUnexpectedSuccess(self, test):
+            self.console_outcome = "unexpected success"
+            super(RecordingResult, self).addUnexpectedSuccess(test)
+
+    return RecordingResult
+
+
+class OpTestConsoleIndex(object):
+    '''
+    Reads a console-record directory.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.blocks = []
+        self.marks = []
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line of a run killed mid write
+                    continue
+                if "segment" in entry:
+                    self.blocks.append(entry)
+                else:
+                    self.marks.append(entry)
+        # blocks are written in time order, keep the bisect keys
+        self.ends = [b["end"] for b in self.blocks]
+
+    def tests(self):
+        '''
+        Runs of each test, (test id, start, stop, outcome), in run order.
+        '''
+        runs = []
+        started = {}
+        for mark in self.marks:
+            if mark.get("mark") != "test":
+                continue
+            if mark.get("event") == "start":
+                started[mark["test"]] = mark["time"]
+            elif mark["test"] in started:
+                runs.append((mark["test"], started.pop(mark["test"]), mark["time"],
+                             mark.get("outcome")))
+        for test, start in started.items():
+            # never stopped, the run died during it
+            runs.append((test, start, None, "incomplete"))
+        return runs
+
+    def blocks_between(self, start, end=None):
+        i = bisect.bisect_left(self.ends, start)
+        while i < len(self.blocks):
+            block = self.blocks[i]
+            if end is not None and block["start"] > end:
+                break
+            yield block
+            i += 1
+
+    def read_block(self, block):
+        with open(os.path.join(self.directory, block["segment"]), 'rb') as f:
+            f.seek(block["offset"])
+            data = f.read(block["length"])
+        compression = block["segment"].rsplit(".", 1)[-1]
+        return parse_records(decompress(data, compression))
+
+    def records(self, start, end=None, source=None, state=None):
+        '''
+        Console records (time, source, text) from start to end.
+        '''
+        for block in self.blocks_between(start, end):
+            if state is not None and block["state"] != state:
+                continue
+            for when, kind, src, text in self.read_block(block):
+                if kind != CONSOLE or when < start or (end is not None and when > end):
+                    continue
+                if source is not None and source not in src:
+                    continue
+                yield when, src, text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Extract console output recorded by op-test")
+    parser.add_argument("directory", help="console-record directory, or the test-run directory holding it")
+    parser.add_argument("--list", action='store_true', help="List the recorded tests")
+    parser.add_argument("--test", action='append', help="Console output of a test, id or end of the id")
+    parser.add_argument("--failed", action='store_true', help="Console output of failed tests")
+    parser.add_argument("--state", help="Only blocks recorded in this OpSystemState, e.g. OS")
+    parser.add_argument("--since", type=float, help="Start time, seconds since the epoch")
+    parser.add_argument("--until", type=float, help="End time, seconds since the epoch")
+    parser.add_argument("--source", help="Only consoles whose logger name contains this")
+    parser.add_argument("--raw", action='store_true', help="Don't make control characters visible")
+    args = parser.parse_args(argv)
+
+    directory = args.directory
+    if not os.path.exists(os.path.join(directory, INDEX_FILE)):
+        directory = os.path.join(directory, "console-record")
+    index = OpTestConsoleIndex(directory)
+    runs = index.tests()
+    out = sys.stdout
+
+    def show(start, end):
+        for when, source, text in index.records(start, end, args.source, args.state):
+            out.write(text if args.raw else OpTestLogger.sanitize(text))
+
+    if args.list:
+        for test, start, stop, outcome in runs:
+            out.write("{} {:>9} {:>18} {}\n".format(
+                datetime.fromtimestamp(start).strftime("%Y-%m-%d %H:%M:%S"),
+                "{:.1f}s".format(stop - start) if stop else "-", outcome, test))
+        return 0
+
+    selected = []
+    if args.failed:
+        selected += [r for r in runs if r[3] in outcomes_failed + ["incomplete"]]
+    for name in args.test or []:
+        selected += [r for r in runs if r[0] == name or r[0].endswith(name)]
+    if selected:
+        for test, start, stop, outcome in selected:
+            out.write("=== {} ({}) ===\n".format(test, outcome))
+            show(start, stop)
+            out.write("\n")
+        return 0
+    if args.failed or args.test:
+        sys.stderr.write("No matching tests recorded\n")
+        return 1
+    show(args.since or 0, args.until)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# OpenPOWER Automated Test Project
+#
+# Contributors Listed Below - COPYRIGHT 2026
+# [+] International Business Machines Corp.
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+'''
+Console Watcher
+---------------
+Event driven console reading for the OpTestSystem state machine.
+
+One background reader thread owns the console pty while it runs, feeds the
+line stream to the registered matchers and posts an event the moment one of
+them hits, so the waiter reacts as soon as "Petitboot" or "login:" shows up
+rather than at the next poll tick. The reader then pauses, a watcher lives
+as long as its console connection and is resumed with the matchers of the
+next wait.
+
+The OPexpect error conditions (kernel panic, skiboot assert, ...) are still
+raised, the reader catches them and hands them to the waiter to re-raise.
+'''
+
+import queue
+import threading
+import time
+import pexpect
+
+import OpTestLogger
+log = OpTestLogger.optest_logger_glob.get_logger(__name__)
+
+
+class ConsoleEvent(object):
+    '''
+    What the reader saw, `index` is the matcher index (or -1 for EOF), `when`
+    is the time.time() the reader matched it.
+    '''
+
+    def __init__(self, index, value=None, text=None, exception=None):
+        self.index = index
+        self.value = value
+        self.text = text
+        self.exception = exception
+        self.when = time.time()
+
+
+class OpConsoleWatcher(threading.Thread):
+    '''
+    Background reader for one console pty.
+
+    Register matchers with `register()`, `start()` the thread, then block in
+    `wait()` for the first event. The reader pauses by itself after posting a
+    match, and ends after EOF or an exception, so the caller gets the pty
+    back to act on it (callbacks, sendline, reconnect) without racing the
+    reader. `pause()` takes the pty back without an event, `resume()` goes
+    on reading, with other matchers if given.
+    '''
+
+    def __init__(self, pty, name="console-watcher", poll=1):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.name = name
+        self.pty = pty
+        self.poll = poll
+        self.matchers = []
+        self.callbacks = []
+        self.line_listeners = []
+        self.events = queue.Queue()
+        self.started = None
+        self.last_data = None
+        self.lines = 0
+        self.w_terminate = False
+        self.pause_request = False
+        self.paused = threading.Event()
+        self.resumed = threading.Event()
+
+    def register(self, pattern, callback=None):
+        '''
+        Adds a matcher, `callback(value, text)` is called from the reader
+        thread when it hits, before the event is posted. Returns the matcher
+        index reported back in ConsoleEvent.index.
+        '''
+        self.matchers.append(pattern)
+        self.callbacks.append(callback)
+        return len(self.matchers) - 1
+
+    def add_line_listener(self, listener):
+        '''
+        `listener(line)` is called from the reader thread for every complete
+        console line.
+        '''
+        self.line_listeners.append(listener)
+
+    def run(self):
+        self.started = self.last_data = time.time()
+        try:
+            self.read()
+        finally:
+            self.paused.set()
+
+    def read(self):
+        while not self.w_terminate:
+            if self.pause_request:
+                self.paused.set()
+                self.resumed.wait()
+                self.resumed.clear()
+                continue
+            # the newline alternative comes last so a matcher always wins a tie
+            newline = len(self.matchers) + 2
+            patterns = [pexpect.TIMEOUT, pexpect.EOF] + self.matchers + [r"\r?\n"]
+            try:
+                r = self.pty.expect(patterns, timeout=self.poll)
+            except Exception as e:
+                # OPexpect raised on an error condition, the waiter re-raises
+                self.events.put(ConsoleEvent(-1, exception=e))
+                return
+            if r == 0:
+                continue
+            self.last_data = time.time()
+            if r == 1:
+                self.events.put(ConsoleEvent(-1, value=pexpect.EOF))
+                return
+            text = self.pty.before + self.pty.after
+            if r == newline:
+                self.lines += 1
+                for listener in self.line_listeners:
+                    listener(text)
+                continue
+            index = r - 2
+            if self.callbacks[index]:
+                self.callbacks[index](self.matchers[index], text)
+            self.pause_request = True
+            self.events.put(ConsoleEvent(index, value=self.matchers[index], text=text))
+
+    def pause(self):
+        '''
+        Stops the reader between two reads, the pty is the caller's until
+        resume().
+        '''
+        self.pause_request = True
+        if self.is_alive() and threading.current_thread() is not self:
+            self.paused.wait(self.poll * 2 + 1)
+
+    def resume(self, matchers=None):
+        '''
+        Reads on from where the reader paused, looking for matchers instead
+        when given. Events not collected yet are dropped.
+        '''
+        if matchers is not None:
+            self.matchers = list(matchers)
+            self.callbacks = [None] * len(self.matchers)
+        while not self.events.empty():
+            self.events.get_nowait()
+        waiting = self.paused.is_set()
+        self.paused.clear()
+        # the pause does not count as the console going quiet
+        self.last_data = time.time()
+        self.pause_request = False
+        if waiting:
+            self.resumed.set()
+
+    def wait(self, timeout):
+        '''
+        Blocks for the next event, returns None if nothing matched within
+        `timeout` seconds.
+        '''
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def idle(self):
+        '''
+        Seconds since the console last gave us any data.
+        '''
+        return time.time() - (self.last_data or time.time())
+
+    def console_terminate(self):
+        self.w_terminate = True
+        self.resumed.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(self.poll * 2 + 1)
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+# OpenPOWER Automated Test Project
+#
+# Contributors Listed Below - COPYRIGHT 2026
+# [+] International Business Machines Corp.
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+'''
+Fleet Mode
+----------
+Runs the selected tests on several machines from one op-test invocation.
+
+  ./op-test -c common.conf --fleet m1.conf --fleet m2.conf --run-suite osdumpsanitysuite
+
+Every target runs in an op-test process of its own, so each has its own
+OpTestConfiguration, results directory, loggers and host lock. The target
+config is laid over the -c config (if any) into <target>.conf in the fleet
+directory, the rest of the command line is passed on unchanged.
+
+Targets that need the same lock (the same --hostlocker host, the same --aes
+environment or the same BMC/HMC LPAR, given in the target config or on the
+command line) run one after the other, everything else runs concurrently,
+at most --fleet-jobs at a time.
+
+When all targets are done the JUnit results of every target are merged into
+fleet-<suffix>.xml and a per target summary with timings is written to
+fleet-<suffix>.json.
+
+QEMU Farm
+---------
+The same machinery shards one test selection across N QEMU instances:
+
+  ./op-test --bmc-type qemu ... --run-suite skiroot --qemu-farm 8 \\
+      --qemu-smp 4 --qemu-accel tcg,thread=multi
+
+After building the test suite op-test splits it by testcase class, so a
+class's tests stay together in order, balances the shards by test count and
+starts an op-test per shard with --run for each of its tests and a
+temporary scratch disk of its own. The instances keep the same MAC, so they
+can all restore one --qemu-snapshot-dir snapshot. Results are merged into
+farm-<suffix>.xml/.json the same way.
+Selections with tests that cannot be loaded by name run in one instance as
+usual.
+'''
+
+import argparse
+import configparser
+import glob
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import unittest
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import OpTestLogger
+log = OpTestLogger.optest_logger_glob.get_logger(__name__)
+
+# options owned by the fleet, not passed on to the targets
+fleet_options = ["-c", "--config-file", "-o", "--output", "-l", "--logdir",
+                 "--suffix", "--fleet", "--fleet-jobs"]
+# options a farm sets per shard
+farm_options = fleet_options + ["--run", "--run-suite", "--qemu-farm", "--qemu-scratch-disk"]
+# aes values that query or manage reservations rather than name an environment
+aes_actions = ["q", "l", "u"]
+# options deciding the lock key, given on the command line they override
+# every target's config
+lock_options = ["--hostlocker", "--aes", "--bmc-ip", "--hmc-ip", "--lpar-name"]
+
+
+def target_argv(argv, options=fleet_options):
+    '''
+    argv without the program name and the options the fleet sets itself.
+    '''
+    args = []
+    skip = False
+    for arg in argv[1:]:
+        if skip:
+            skip = False
+            continue
+        if arg in options:
+            skip = True
+            continue
+        if arg.startswith("--") and arg.split("=")[0] in options:
+            continue
+        args.append(arg)
+    return args
+
+
+def command_line_settings(argv, options):
+    '''
+    The options given in argv, as config file settings.
+    '''
+    parser = argparse.ArgumentParser(add_help=False)
+    for option in options:
+        parser.add_argument(option, nargs='+' if option == "--aes" else None)
+    args, unknown = parser.parse_known_args(argv[1:])
+    settings = {}
+    for key, value in vars(args).items():
+        if value is not None:
+            settings[key] = " ".join(value) if isinstance(value, list) else value
+    return settings
+
+
+def flatten(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            for t in flatten(test):
+                yield t
+        else:
+            yield test
+
+
+def shard_tests(suite, count):
+    '''
+    Test ids of suite split in up to count shards, None if a test cannot
+    be loaded back by its id.
+    '''
+    loader = unittest.TestLoader()
+    classes = {}
+    order = []
+    for index, test in enumerate(flatten(suite)):
+        try:
+            loaded = list(flatten(loader.loadTestsFromName(test.id())))
+        except Exception:
+            loaded = []
+        # a testcase with its own __init__ may carry state the id loses
+        if (len(loaded) != 1 or type(loaded[0]) is not type(test)
+                or type(test).__init__ is not unittest.TestCase.__init__):
+            log.warning("Farm: {} cannot be run by name".format(test.id()))
+            return None
+        cls = type(test)
+        if cls not in classes:
+            classes[cls] = []
+            order.append(cls)
+        classes[cls].append((index, test.id()))
+    # biggest classes first onto the least loaded shard
+    shards = [[] for i in range(min(count, len(order)))]
+    for cls in sorted(order, key=lambda c: len(classes[c]), reverse=True):
+        min(shards, key=len).extend(classes[cls])
+    return [[test_id for index, test_id in sorted(shard)] for shard in shards]
+
+
+class FleetTarget(object):
+    '''
+    One machine of the fleet and, once it ran, its results.
+    '''
+
+    def __init__(self, name, config, settings):
+        self.name = name
+        self.config = config
+        self.settings = settings
+        self.lock = self.lock_key()
+        self.output = None
+        self.console_log = None
+        # extra op-test arguments of this target
+        self.args = []
+        self.command = None
+        self.exit_code = None
+        self.start = None
+        self.end = None
+        self.suites = []
+        self.counts = {"tests": 0, "failures": 0, "errors": 0, "skipped": 0}
+
+    def lock_key(self):
+        '''
+        Targets with the same key cannot run at the same time.
+        '''
+        s = self.settings
+        if s.get("hostlocker"):
+            return "hostlocker:" + s["hostlocker"]
+        aes = (s.get("aes") or "").split()
+        if aes and aes[0].lower() not in aes_actions:
+            # a named environment, an AES search is free to pick any match
+            return "aes:" + " ".join(aes)
+        if s.get("hmc_ip") and s.get("lpar_name"):
+            return "lpar:{}:{}".format(s["hmc_ip"], s["lpar_name"])
+        if s.get("bmc_ip"):
+            return "bmc:" + s["bmc_ip"]
+        return "target:" + self.name
+
+    def seconds(self):
+        if self.start is None or self.end is None:
+            return None
+        return round(self.end - self.start, 3)
+
+    def summary(self):
+        return dict(self.counts,
+                    name=self.name,
+                    config=self.config,
+                    lock=self.lock,
+                    command=self.command,
+                    exit_code=self.exit_code,
+                    start=datetime.fromtimestamp(self.start, timezone.utc).isoformat().replace("+00:00", "Z")
+                    if self.start else None,
+                    seconds=self.seconds(),
+                    output=self.output,
+                    console_log=self.console_log)
+
+
+class OpTestFleet(object):
+    '''
+    Runs op-test once per target config and aggregates the results.
+
+    `conf` is the parsed OpTestConfiguration of the fleet op-test, `argv`
+    its command line.
+    '''
+
+    kind = "fleet"
+    options = fleet_options
+
+    def __init__(self, conf, argv):
+        self.conf = conf
+        self.argv = argv
+        self.jobs = conf.args.fleet_jobs
+        self.suffix = conf.get_suffix()
+        if conf.args.output:
+            outdir = conf.args.output
+        elif "OP_TEST_OUTPUT" in os.environ:
+            outdir = os.environ["OP_TEST_OUTPUT"]
+        else:
+            outdir = os.path.join(conf.basedir, "test-reports")
+        self.output = os.path.abspath(os.path.join(outdir, "{}-{}".format(self.kind, self.suffix)))
+        self.common = {}
+        if conf.args.config_file:
+            self.common = conf.parse_config_file(conf.args.config_file)
+        self.targets = self.make_targets()
+        self.procs = {}
+        self.lock = threading.Lock()
+        self.stopping = False
+        self.start = time.time()
+
+    def make_targets(self):
+        targets = []
+        names = set()
+        for config in self.conf.args.fleet:
+            name = os.path.splitext(os.path.basename(config))[0]
+            unique, n = name, 1
+            while unique in names:
+                n += 1
+                unique = "{}-{}".format(name, n)
+            names.add(unique)
+            settings = dict(self.common)
+            settings.update(self.conf.parse_config_file(config))
+            # what the target op-test will actually use, its command line wins
+            settings.update(command_line_settings(self.argv, lock_options))
+            targets.append(FleetTarget(unique, os.path.abspath(config), settings))
+        return targets
+
+    def groups(self):
+        '''
+        Targets grouped by lock key, biggest group first so the longest
+        sequential chain starts straight away.
+        '''
+        groups = {}
+        for target in self.targets:
+            groups.setdefault(target.lock, []).append(target)
+        return sorted(groups.values(), key=len, reverse=True)
+
+    def write_config(self, target):
+        path = os.path.join(self.output, target.name + ".conf")
+        config = configparser.ConfigParser(interpolation=None)
+        config['op-test'] = target.settings
+        with open(path, 'w') as f:
+            config.write(f)
+        return path
+
+    def run_target(self, target):
+        if self.stopping:
+            return
+        target.output = os.path.join(self.output, target.name)
+        os.makedirs(target.output, exist_ok=True)
+        target.console_log = os.path.join(target.output, "op-test.console.log")
+        target.command = ([sys.executable, os.path.join(self.conf.basedir, "op-test")]
+                          + target_argv(self.argv, self.options)
+                          + target.args
+                          + ["-c", self.write_config(target),
+                             "-o", target.output,
+                             "--suffix", self.suffix])
+        log.info("Fleet: starting {} ({})".format(target.name, target.lock))
+        target.start = time.time()
+        with open(target.console_log, 'w') as console:
+            try:
+                proc = subprocess.Popen(target.command, stdout=console,
+                                        stderr=subprocess.STDOUT,
+                                        stdin=subprocess.DEVNULL,
+                                        cwd=self.conf.basedir)
+            except OSError as e:
+                log.error("Fleet: unable to start {}: {}".format(target.name, e))
+                target.exit_code = -1
+                target.end = time.time()
+                return
+            with self.lock:
+                self.procs[target.name] = proc
+            try:
+                target.exit_code = proc.wait()
+                target.end = time.time()
+                self.collect(target)
+            finally:
+                with self.lock:
+                    # collected, terminate() can report it
+                    del self.procs[target.name]
+        log.info("Fleet: {} finished in {:.0f}s exit={} tests={tests} failures={failures}"
+                 " errors={errors} skipped={skipped}".format(
+                     target.name, target.seconds(), target.exit_code, **target.counts))
+
+    def run_group(self, group):
+        for target in group:
+            self.run_target(target)
+
+    def collect(self, target):
+        '''
+        Reads the JUnit files the target wrote.
+        '''
+        for path in sorted(glob.glob(os.path.join(target.output, "**", "*.xml"),
+                                     recursive=True)):
+            try:
+                root = ET.parse(path).getroot()
+            except Exception as e:
+                log.warning("Fleet: unable to parse {}: {}".format(path, e))
+                continue
+            suites = [root] if root.tag == "testsuite" else root.findall("testsuite")
+            for suite in suites:
+                suite.set("name", "{}.{}".format(target.name, suite.get("name", "")))
+                suite.set("hostname", target.name)
+                target.suites.append(suite)
+                for key in target.counts:
+                    target.counts[key] += int(suite.get(key, 0) or 0)
+        if target.exit_code and not target.suites:
+            # op-test died before any test reported, keep that visible
+            suite = ET.Element("testsuite", name=target.name + ".op-test", tests="1",
+                               failures="0", errors="1", skipped="0",
+                               time=str(target.seconds()), hostname=target.name)
+            case = ET.SubElement(suite, "testcase", classname=target.name,
+                                 name="op-test", time=str(target.seconds()))
+            ET.SubElement(case, "error", message="op-test exited with {}, see {}".format(
+                target.exit_code, target.console_log))
+            target.suites.append(suite)
+            target.counts["tests"] += 1
+            target.counts["errors"] += 1
+
+    def report(self, start):
+        totals = {"tests": 0, "failures": 0, "errors": 0, "skipped": 0}
+        root = ET.Element("testsuites", name="op-test " + self.kind)
+        for target in self.targets:
+            for suite in target.suites:
+                root.append(suite)
+            for key in totals:
+                totals[key] += target.counts[key]
+        for key, value in totals.items():
+            root.set(key, str(value))
+        root.set("time", str(round(time.time() - start, 3)))
+        xml_path = os.path.join(self.output, "{}-{}.xml".format(self.kind, self.suffix))
+        ET.ElementTree(root).write(xml_path, encoding="utf-8", xml_declaration=True)
+        json_path = os.path.join(self.output, "{}-{}.json".format(self.kind, self.suffix))
+        with open(json_path, 'w') as f:
+            json.dump(dict(totals,
+                           suffix=self.suffix,
+                           seconds=round(time.time() - start, 3),
+                           jobs=self.jobs or len(self.targets),
+                           targets=[t.summary() for t in self.targets]), f, indent=2)
+        log.info("Fleet: {} targets tests={tests} failures={failures} errors={errors}"
+                 " skipped={skipped}, report in {}".format(len(self.targets), xml_path, **totals))
+        for target in self.targets:
+            log.info("Fleet: {:24} exit={:<4} {:>8}s {}".format(
+                target.name, str(target.exit_code), str(target.seconds()), target.output))
+
+    def terminate(self, signum=None, frame=None):
+        self.stopping = True
+        with self.lock:
+            procs = list(self.procs.items())
+        for name, proc in procs:
+            log.warning("Fleet: stopping {}".format(name))
+            # op-test cleans up (releases locks) on SIGTERM
+            proc.terminate()
+        if signum is not None:
+            for name, proc in procs:
+                try:
+                    proc.wait(60)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+            # let the target threads collect what the stopped targets wrote
+            deadline = time.time() + 30
+            while self.procs and time.time() < deadline:
+                time.sleep(0.1)
+            try:
+                self.report(self.start)
+            except Exception as e:
+                log.error("Fleet: unable to write the report: {}".format(e))
+            os._exit(1)
+
+    def run(self):
+        '''
+        Runs every target, returns the op-test exit code, the number of
+        failed targets.
+        '''
+        os.makedirs(self.output, exist_ok=True)
+        print("Fleet logs in: {}".format(self.output))
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self.terminate)
+        groups = self.groups()
+        jobs = self.jobs or len(groups)
+        log.info("Fleet: {} targets in {} lock groups, {} at a time".format(
+            len(self.targets), len(groups), jobs))
+        self.start = time.time()
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            for future in [pool.submit(self.run_group, group) for group in groups]:
+                future.result()
+        self.report(self.start)
+        return len([t for t in self.targets if t.exit_code])
+
+
+class OpTestQemuFarm(OpTestFleet):
+    '''
+    Runs the tests of suite sharded across --qemu-farm QEMU instances, no
+    targets when the suite cannot be sharded.
+    '''
+    kind = "farm"
+    options = farm_options
+
+    def __init__(self, conf, argv, suite):
+        self.shards = shard_tests(suite, conf.args.qemu_farm) or []
+        super(OpTestQemuFarm, self).__init__(conf, argv)
+        self.jobs = len(self.targets)
+
+    def make_targets(self):
+        targets = []
+        # as the user gave it, OpTestQemu has replaced conf.args' with a file
+        scratch_disk = command_line_settings(self.argv, ["--qemu-scratch-disk"]).get(
+            "qemu_scratch_disk", self.common.get("qemu_scratch_disk"))
+        if self.shards and scratch_disk and scratch_disk.strip():
+            log.warning("Farm: --qemu-scratch-disk {} can't be shared, every instance gets"
+                        " a temporary scratch disk".format(scratch_disk))
+        for i, shard in enumerate(self.shards):
+            target = FleetTarget("qemu-{}".format(i), self.conf.args.config_file,
+                                 dict(self.common))
+            # every instance is a machine of its own, nothing to share; the
+            # same MAC is fine (user networking is per instance) and lets
+            # them share --qemu-snapshot-dir snapshots
+            target.lock = "target:" + target.name
+            target.args = ["--qemu-scratch-disk", ""]
+            for test_id in shard:
+                target.args += ["--run", test_id]
+            targets.append(target)
+        if targets:
+            log.info("Farm: {} tests in {} shards of {}".format(
+                sum(len(shard) for shard in self.shards), len(targets),
+                ", ".join(str(len(shard)) for shard in self.shards)))
+        return targets
@@ -32,11 +32,11 @@ This package encapsulates all HMC functions required to manage/control IBM Power
 server running PowerVM hypervisor.
 '''
 
+import csv
 import os
 import sys
 import time
 import pexpect
-import shlex
 import re
 import string
 import random
@@ -57,6 +57,50 @@ WAITTIME = 25
 SYS_WAITTIME = 200
 BOOTTIME = 500
 STALLTIME = 5
+# seconds HMC query results are reused, configuration and resources change
+# only through HMC commands, LPAR and system state can change by themselves
+QUERY_TTL = 30
+STATE_TTL = 2
+
+
+def hmc_prompt(user, host=None):
+    '''
+    HMC restricted shell prompt of user, e.g. "hscroot@myhmc:~> ", on host
+    when known. Anchored on them so a guest prompt of the same form (SLES)
+    is not taken for the HMC shell.
+    '''
+    host = re.escape(host) if host else r"[\w.\-]+"
+    return r"\b{}@{}:[^\r\n]*> ?".format(re.escape(user), host)
+
+
+# mkvterm refusing because someone (often a previous run) holds the console
+vterm_busy = r"already open|Only one open session"
+# mkvterm escape sequence, ends the terminal session
+VTERM_ESCAPE = "~."
+
+# HMC commands that change what the cached queries return, as a command
+# word anywhere in the line (after ;, &&, |, time, ...)
+mutating_commands = re.compile(r"(?:^|[\s;&|(`])(ch\w+|mk\w+|rm\w+|migrlpar)\b")
+
+
+def parse_hmc_attrs(line):
+    '''
+    Parses an HMC "key=value,key=value" line into a dict, fields holding
+    commas are double quoted whole ("io_pool_ids=1,2") and values may hold
+    spaces (state=Not Activated). Keys without a value map to 'null'.
+    '''
+    attrs = {}
+    fields = next(csv.reader([line.strip()]), [])
+    for values in fields:
+        if not values:
+            continue
+        data = values.split("=", 1)
+        try:
+            attrs[data[0]] = data[1]
+        except IndexError:
+            attrs[data[0]] = 'null'
+    return attrs
+
 
 class OpHmcState():
     '''
@@ -108,6 +152,43 @@ class Spawn(OPexpect.spawn):
         self.send("\r")
 
 
+class HMCSSH(OpTestSSH):
+    '''
+    SSH to the HMC dropping the cached HMC queries after every command
+    changing the HMC configuration or state, however it is run (testcases
+    use cv_HMC.ssh directly).
+    '''
+
+    def __init__(self, hmc, *args, **kwargs):
+        super(HMCSSH, self).__init__(*args, **kwargs)
+        self.hmc = hmc
+
+    def run_command_direct(self, command, *args, **kwargs):
+        try:
+            return super(HMCSSH, self).run_command_direct(command, *args, **kwargs)
+        finally:
+            self.hmc.invalidate_queries(command)
+
+    def run_command(self, command, *args, **kwargs):
+        try:
+            return super(HMCSSH, self).run_command(command, *args, **kwargs)
+        finally:
+            self.hmc.invalidate_queries(command)
+
+    def run_command_ignore_fail(self, command, *args, **kwargs):
+        try:
+            return super(HMCSSH, self).run_command_ignore_fail(command, *args, **kwargs)
+        finally:
+            self.hmc.invalidate_queries(command)
+
+    def run_commands_batch(self, commands, *args, **kwargs):
+        try:
+            return super(HMCSSH, self).run_commands_batch(commands, *args, **kwargs)
+        finally:
+            for command in commands:
+                self.hmc.invalidate_queries(command)
+
+
 class HMCUtil():
     '''
     Utility and functions of HMC object
@@ -136,10 +217,10 @@ class HMCUtil():
         self.util = OpTestUtil()
         self.prompt = prompt
         self.expect_prompt = self.util.build_prompt(prompt) + "$"
-        self.ssh = OpTestSSH(hmc_ip, user_name, password, logfile=self.logfile,
-                             check_ssh_keys=check_ssh_keys,
-                             known_hosts_file=known_hosts_file,
-                             block_setup_term=block_setup_term)
+        self.ssh = HMCSSH(self, hmc_ip, user_name, password, logfile=self.logfile,
+                          check_ssh_keys=check_ssh_keys,
+                          known_hosts_file=known_hosts_file,
+                          block_setup_term=block_setup_term)
         self.scratch_disk = scratch_disk
         self.proxy = proxy
         self.scratch_disk_size = None
@@ -162,6 +243,88 @@ class HMCUtil():
         self.LOGIN_set = -1
         self.SUDO_set = -1
         self.sysinfo = OpTestSysinfo()
+        # HMC query cache, command -> (time, output lines)
+        self.query_cache = {}
+        self.query_ttl = QUERY_TTL
+        self.query_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def query(self, cmd, ttl=None):
+        '''
+        Runs a read only HMC command, reusing its output for `ttl` seconds
+        (default self.query_ttl, 0 to always run it).
+
+        :returns: list of output lines
+        '''
+        ttl = self.query_ttl if ttl is None else ttl
+        cached = self.query_cache.get(cmd)
+        if cached and time.time() - cached[0] < ttl:
+            self.query_stats["hits"] += 1
+            return list(cached[1])
+        self.query_stats["misses"] += 1
+        output = self.ssh.run_command(cmd)
+        self.query_cache[cmd] = (time.time(), output)
+        return list(output)
+
+    def invalidate_queries(self, cmd=None):
+        '''
+        Drops the cached HMC queries, when `cmd` is given only if it is a
+        command changing the HMC configuration or state.
+        '''
+        if cmd is not None and not mutating_commands.search(cmd):
+            return
+        if self.query_cache:
+            self.query_stats["invalidations"] += 1
+        self.query_cache = {}
+
+    def hmc_command(self, cmd, timeout=60):
+        '''
+        Runs a command on the HMC, the cached queries are dropped when it
+        changes the HMC configuration or state.
+        '''
+        return self.ssh.run_command(cmd, timeout=timeout)
+
+    def get_lpar_record(self, mg_system=None, lpar_name=None, ttl=None):
+        '''
+        All lssyscfg attributes of an LPAR plus its reference code, fetched
+        in one HMC command.
+
+        :returns: dict, lssyscfg attributes and 'refcode'
+        '''
+        mg_system = mg_system or self.mg_system
+        lpar_name = lpar_name or self.lpar_name
+        output = self.query("lssyscfg -m %s -r lpar --filter lpar_names=%s; "
+                            "lsrefcode -m %s -r lpar --filter lpar_names=%s" %
+                            (mg_system, lpar_name, mg_system, lpar_name), ttl=ttl)
+        record = {}
+        refcode = ""
+        for line in output:
+            attrs = parse_hmc_attrs(line)
+            if "lpar_name" in attrs and "refcode" in attrs:
+                refcode = attrs["refcode"]
+            elif "name" in attrs:
+                record.update(attrs)
+        record["refcode"] = refcode
+        return record
+
+    def get_sys_hwres(self, resource, ttl=None):
+        '''
+        All system level lshwres attributes of `resource` ('mem' or 'proc')
+        of the managed system, from one HMC command.
+
+        :returns: dict
+        '''
+        output = self.query("lshwres -m %s -r %s --level sys" %
+                            (self.mg_system, resource), ttl=ttl)
+        return parse_hmc_attrs(output[-1]) if output else {}
+
+    def cached_field(self, record, field, cmd):
+        '''
+        `field` of a cached record in the one line list form of `-F field`
+        output, running `cmd` when the record does not have it.
+        '''
+        if field in record:
+            return [record[field]]
+        return self.ssh.run_command(cmd)
 
     def check_lpar_secureboot_state(self, hmc_con):
         '''
@@ -191,7 +354,7 @@ class HMCUtil():
             cmd = '%s2"' % cmd
         else:  # Value '0' to disable Secure Boot
             cmd = '%s0"' % cmd
-        return self.ssh.run_command(cmd, timeout=300)
+        return self.hmc_command(cmd, timeout=300)
 
     def configure_dynamic_secure_boot(self, enable=True, keystore_kbytes=64):
         '''
@@ -226,7 +389,7 @@ class HMCUtil():
             )
 
         cmd = f'chsyscfg -r lpar -m {self.mg_system} -i "name={self.lpar_name}, {config_params}"'
-        return self.ssh.run_command(cmd, timeout=300)
+        return self.hmc_command(cmd, timeout=300)
 
     def deactivate_lpar_console(self):
         '''
@@ -241,7 +404,7 @@ class HMCUtil():
         '''
         if self.get_system_state() != OpManagedState.OPERATING:
             raise OpTestError('Managed Systen not in Operating state')
-        self.ssh.run_command("chsysstate -m %s -r sys -o off" % self.mg_system)
+        self.hmc_command("chsysstate -m %s -r sys -o off" % self.mg_system)
         self.wait_system_state(OpManagedState.OFF)
 
     def poweron_system(self):
@@ -250,7 +413,7 @@ class HMCUtil():
         '''
         if self.get_system_state() != OpManagedState.OFF:
             raise OpTestError('Managed Systen not is Power off state!')
-        self.ssh.run_command("chsysstate -m %s -r sys -o on" % self.mg_system)
+        self.hmc_command("chsysstate -m %s -r sys -o on" % self.mg_system)
         self.wait_system_state()
         if self.lpar_vios:
             log.debug("Starting VIOS %s", self.lpar_vios)
@@ -266,7 +429,7 @@ class HMCUtil():
         if self.get_lpar_state(remote_hmc=remote_hmc) in [OpHmcState.NOT_ACTIVE, OpHmcState.NA]:
             log.info('LPAR Already powered-off!')
             return
-        hmc.ssh.run_command("chsysstate -m %s -r lpar -n %s -o shutdown --immed" %
+        hmc.hmc_command("chsysstate -m %s -r lpar -n %s -o shutdown --immed" %
                             (hmc.mg_system, self.lpar_name))
         self.wait_lpar_state(OpHmcState.NOT_ACTIVE, remote_hmc=remote_hmc)
 
@@ -294,7 +457,7 @@ class HMCUtil():
             log.warning(f"LPAR is in Error state, shutting down first to clear error...")
             try:
                 shutdown_cmd = f"chsysstate -m {hmc.mg_system} -r lpar -n {lpar_name} -o shutdown --immed"
-                hmc.ssh.run_command(shutdown_cmd, timeout=60)
+                hmc.hmc_command(shutdown_cmd, timeout=60)
                 # Wait a bit for shutdown to complete
                 time.sleep(5)
                 # Verify it reached NOT_ACTIVE state
@@ -320,7 +483,7 @@ class HMCUtil():
         if current_state != OpHmcState.NOT_ACTIVE:
             log.warning(f"LPAR not in NOT_ACTIVE state (current: {current_state}), attempting power on anyway...")
         
-        hmc.ssh.run_command(cmd)
+        hmc.hmc_command(cmd)
         self.wait_lpar_state(vios=vios, remote_hmc=remote_hmc)
         time.sleep(STALLTIME)
         return BMC_CONST.FW_SUCCESS
@@ -332,7 +495,7 @@ class HMCUtil():
         if self.get_lpar_state() in [OpHmcState.NOT_ACTIVE, OpHmcState.NA]:
             log.info('LPAR Already powered-off!')
             return
-        self.ssh.run_command("chsysstate -m %s -r lpar -n %s -o dumprestart" %
+        self.hmc_command("chsysstate -m %s -r lpar -n %s -o dumprestart" %
                              (self.mg_system, self.lpar_name))
         self.wait_lpar_state()
 
@@ -343,7 +506,7 @@ class HMCUtil():
         if self.get_lpar_state() in [OpHmcState.NOT_ACTIVE, OpHmcState.NA]:
             log.info('LPAR Already powered-off!')
             return
-        self.ssh.run_command("chsysstate -m %s -r lpar -n %s -o shutdown --immed --restart" %
+        self.hmc_command("chsysstate -m %s -r lpar -n %s -o shutdown --immed --restart" %
                              (self.mg_system, self.lpar_name))
         self.wait_lpar_state()
 
@@ -353,21 +516,9 @@ class HMCUtil():
 
         :returns: LPAR configuration parameters in key, value pair
         '''
-        out = self.ssh.run_command("lssyscfg -r prof -m %s --filter 'lpar_names=%s'" %
-                                   (self.mg_system, self.lpar_name))[-1]
-        cfg_dict = {}
-        splitter = shlex.shlex(out)
-        splitter.whitespace += ','
-        splitter.whitespace_split = True
-        for values in list(splitter):
-            data = values.split("=")
-            key = data[0]
-            try:
-                value = data[1]
-            except IndexError:
-                value = 'null'
-            cfg_dict[key] = value
-        return cfg_dict
+        out = self.query("lssyscfg -r prof -m %s --filter 'lpar_names=%s'" %
+                         (self.mg_system, self.lpar_name))[-1]
+        return parse_hmc_attrs(out)
 
     def set_lpar_cfg(self, arg_str, lpar_profile=None):
         '''
@@ -379,7 +530,7 @@ class HMCUtil():
         lpar_profile = self.lpar_prof if lpar_profile is None else lpar_profile
         if not self.lpar_prof:
             raise OpTestError("Profile needs to be defined to use this method")
-        self.ssh.run_command("chsyscfg -r prof -m %s -i 'lpar_name=%s,name=%s,%s' --force" %
+        self.hmc_command("chsyscfg -r prof -m %s -i 'lpar_name=%s,name=%s,%s' --force" %
                              (self.mg_system, self.lpar_name, lpar_profile, arg_str))
 
     def add_ioslot(self, add_ioslot, lpar_profile=None):
@@ -453,8 +604,8 @@ class HMCUtil():
         :param remove_ioslot: String, accepts drc name
         Returns lpar name if io slot assigned to lpar else returns None
         """
-        lshwres_out = self.ssh.run_command(f"lshwres -r io -m {self.mg_system} --rsubtype "
-                                           f"slot -F drc_index:drc_name:lpar_name")
+        lshwres_out = self.query(f"lshwres -r io -m {self.mg_system} --rsubtype "
+                                 f"slot -F drc_index:drc_name:lpar_name")
         lshwres_out = [line for line in lshwres_out if ioslot+":" in line]
         return lshwres_out[0].split(":")[-1] if lshwres_out is not None else None
 
@@ -463,8 +614,8 @@ class HMCUtil():
         :param remove_ioslot: String, accepts drc name
         returns drc index of io slot if slot is available else returns None
         """
-        drc_index_out = self.ssh.run_command(f"lshwres -r io -m {self.mg_system} --rsubtype "
-                                             f"slot -F drc_index:drc_name:lpar_name")
+        drc_index_out = self.query(f"lshwres -r io -m {self.mg_system} --rsubtype "
+                                   f"slot -F drc_index:drc_name:lpar_name")
         drc_index_out = [line for line in drc_index_out if ioslot+":" in line]
         return drc_index_out[0].split(":")[0] if drc_index_out is not None else None
 
@@ -515,8 +666,8 @@ class HMCUtil():
 
         :returns: "shared" if lpar is in shared mode, "ded" if lpar is in dedicated mode.
         '''
-        return self.run_command("lshwres -r proc -m %s --level lpar --filter lpar_names=%s -F curr_proc_mode" %
-                                (self.mg_system, self.lpar_name))
+        return self.query("lshwres -r proc -m %s --level lpar --filter lpar_names=%s -F curr_proc_mode" %
+                          (self.mg_system, self.lpar_name))
 
     def disable_vtpm(self):
         '''
@@ -547,8 +698,9 @@ class HMCUtil():
 
         :returns: 0 if vtpm is disabled, 1 if vtpm is enabled
         '''
-        return self.run_command("lssyscfg -m %s -r lpar --filter lpar_names=%s -F vtpm_enabled" %
-                                (self.mg_system, self.lpar_name))
+        return self.cached_field(self.get_lpar_record(), "vtpm_enabled",
+                                 "lssyscfg -m %s -r lpar --filter lpar_names=%s -F vtpm_enabled" %
+                                 (self.mg_system, self.lpar_name))
 
     def vpmem_count(self):
         '''
@@ -611,8 +763,9 @@ class HMCUtil():
 
         :returns: current processor compact mode.
         '''
-        return self.run_command("lssyscfg -m %s -r lpar --filter lpar_names=%s -F curr_lpar_proc_compat_mode"
-                                % (self.mg_system, self.lpar_name))
+        return self.cached_field(self.get_lpar_record(), "curr_lpar_proc_compat_mode",
+                                 "lssyscfg -m %s -r lpar --filter lpar_names=%s -F curr_lpar_proc_compat_mode"
+                                 % (self.mg_system, self.lpar_name))
 
     def configure_gzip_qos(self, qos_credits):
         '''
@@ -648,7 +801,8 @@ class HMCUtil():
 
         :returns: current lmb size of managed system
         '''
-        return self.run_command("lshwres -r mem -m %s --level sys -F mem_region_size" % self.mg_system)
+        return self.cached_field(self.get_sys_hwres("mem"), "mem_region_size",
+                                 "lshwres -r mem -m %s --level sys -F mem_region_size" % self.mg_system)
 
     def configure_16gb_hugepage(self, num_hugepages):
         '''
@@ -666,8 +820,9 @@ class HMCUtil():
 
         :returns: current number of 16gb hugepages of managed system
         '''
-        return self.run_command("lshwres -r mem -m %s --level sys -F configurable_num_sys_huge_pages" %
-                                self.mg_system)
+        return self.cached_field(self.get_sys_hwres("mem"), "configurable_num_sys_huge_pages",
+                                 "lshwres -r mem -m %s --level sys -F configurable_num_sys_huge_pages" %
+                                 self.mg_system)
 
     def get_available_mem_resources(self):
         '''
@@ -675,8 +830,9 @@ class HMCUtil():
 
         :returns: Available memory
         '''
-        return self.run_command("lshwres -m %s -r mem --level sys -F curr_avail_sys_mem" %
-                                self.mg_system)
+        return self.cached_field(self.get_sys_hwres("mem"), "curr_avail_sys_mem",
+                                 "lshwres -m %s -r mem --level sys -F curr_avail_sys_mem" %
+                                 self.mg_system)
 
     def get_available_proc_resources(self):
         '''
@@ -684,15 +840,16 @@ class HMCUtil():
 
         :returns: Available CPU count
         '''
-        return self.run_command("lshwres -m %s -r proc --level sys -F curr_avail_sys_proc_units" %
-                                self.mg_system)
+        return self.cached_field(self.get_sys_hwres("proc"), "curr_avail_sys_proc_units",
+                                 "lshwres -m %s -r proc --level sys -F curr_avail_sys_proc_units" %
+                                 self.mg_system)
 
     def get_stealable_resources(self):
         '''
         we are getting the not activated lpars
         list in order to steal the procs and mem resources
         '''
-        output = self.run_command(
+        output = self.query(
             "lssyscfg -r lpar -m %s -F name state" % self.mg_system)
         not_activated_lpars = []
         for line in output:
@@ -742,22 +899,22 @@ class HMCUtil():
         log.info("total stealable memory:%s" % total_stealable_memory)
         return total_stealable_memory
 
-    def get_lpar_state(self, vios=False, remote_hmc=None):
+    def get_lpar_state(self, vios=False, remote_hmc=None, ttl=STATE_TTL):
         '''
         Get current state of LPAR
 
         :param vios: Boolean, to identify VIOS partition
         :param remote_hmc: object, remote HMC instance
+        :param ttl: number, seconds an earlier answer may be reused
         :returns: the current status of the LPAR e.g 'Running' or 'Booting'
         '''
         hmc = remote_hmc if remote_hmc else self
         lpar_name = self.lpar_name
         if vios:
             lpar_name = hmc.lpar_vios
-        state = hmc.ssh.run_command(
-            'lssyscfg -m %s -r lpar --filter lpar_names=%s -F state' % (hmc.mg_system, lpar_name))[-1]
-        ref_code = hmc.ssh.run_command(
-            'lsrefcode -m %s -r lpar --filter lpar_names=%s -F refcode' % (hmc.mg_system, lpar_name))[-1]
+        record = hmc.get_lpar_record(hmc.mg_system, lpar_name, ttl=ttl)
+        state = record.get("state")
+        ref_code = record.get("refcode")
         if state == 'Running':
             if 'Linux' in ref_code or not ref_code:
                 return 'Running'
@@ -771,8 +928,8 @@ class HMCUtil():
 
         :returns: the current status of the managed system
         '''
-        state = self.ssh.run_command(
-            'lssyscfg -m %s -r sys -F state' % self.mg_system)
+        state = self.query(
+            'lssyscfg -m %s -r sys -F state' % self.mg_system, ttl=STATE_TTL)
         return state[-1]
 
     def wait_lpar_state(self, exp_state=OpHmcState.RUNNING, vios=False, timeout=WAITTIME, remote_hmc=None):
@@ -788,7 +945,7 @@ class HMCUtil():
         state = self.get_lpar_state(vios, remote_hmc=remote_hmc)
         count = 0
         while state != exp_state:
-            state = self.get_lpar_state(vios, remote_hmc=remote_hmc)
+            state = self.get_lpar_state(vios, remote_hmc=remote_hmc, ttl=0)
             log.info("Current state: %s", state)
             time.sleep(timeout)
             count += 1
@@ -824,8 +981,8 @@ class HMCUtil():
                   False - when the LPAR is not in managed system
         '''
         hmc = remote_hmc if remote_hmc else self
-        lpar_list = hmc.ssh.run_command(
-            'lssyscfg -r lpar -m %s -F name' % mg_system)
+        lpar_list = hmc.query(
+            'lssyscfg -r lpar -m %s -F name' % mg_system, ttl=STATE_TTL)
         if lpar_name in lpar_list:
             log.info("%s lpar found in managed system %s" %
                      (lpar_name, mg_system))
@@ -856,7 +1013,7 @@ class HMCUtil():
                 mode, src_mg_system, dest_mg_system, self.lpar_name, param)
             if options:
                 cmd = "%s %s" % (cmd, options)
-            self.ssh.run_command(cmd, timeout=timeout)
+            self.hmc_command(cmd, timeout=timeout)
         log.debug("Waiting for %.2f minutes." % (timeout/60))
         time.sleep(timeout)
         if self.is_lpar_in_managed_system(dest_mg_system, self.lpar_name):
@@ -932,7 +1089,8 @@ class HMCUtil():
                                                                          dest_mg_system, self.lpar_name, target_hmc_user, target_hmc_ip, param)
             if options:
                 cmd = "%s %s" % (cmd, options)
-            hmc.ssh.run_command(cmd, timeout=timeout)
+            hmc.hmc_command(cmd, timeout=timeout)
+        self.invalidate_queries()
 
     def recover_lpar(self, src_mg_system, dest_mg_system, stop_lpm=False, timeout=300):
         '''
@@ -946,9 +1104,9 @@ class HMCUtil():
                   False - when LPAR recovery unsuccess
         '''
         if stop_lpm:
-            self.ssh.run_command("migrlpar -o s -m %s -p %s" % (
+            self.hmc_command("migrlpar -o s -m %s -p %s" % (
                 src_mg_system, self.lpar_name), timeout=timeout)
-        self.ssh.run_command("migrlpar -o r -m %s -p %s" % (
+        self.hmc_command("migrlpar -o r -m %s -p %s" % (
             src_mg_system, self.lpar_name), timeout=timeout)
         if not self.is_lpar_in_managed_system(dest_mg_system, self.lpar_name):
             log.info("LPAR recovered at managed system %s" % src_mg_system)
@@ -968,7 +1126,7 @@ class HMCUtil():
         hmc = remote_hmc if remote_hmc else self
         cmd = 'lshwres -m {} -r sriov --rsubtype adapter -F phys_loc:adapter_id'.format(
             mg_system)
-        adapter_id_output = hmc.ssh.run_command(cmd)
+        adapter_id_output = hmc.query(cmd)
         for line in adapter_id_output:
             if str(loc_code) in line:
                 return line.split(':')[1]
@@ -986,7 +1144,8 @@ class HMCUtil():
         hmc = remote_hmc if remote_hmc else self
         cmd = 'lssyscfg -m %s -r lpar --filter lpar_names=%s -F lpar_id' % (
             mg_system, l_lpar_name)
-        lpar_id_output = hmc.ssh.run_command(cmd)
+        lpar_id_output = hmc.cached_field(hmc.get_lpar_record(mg_system, l_lpar_name),
+                                          "lpar_id", cmd)
         for line in lpar_id_output:
             if l_lpar_name in line:
                 return 0
@@ -1006,7 +1165,8 @@ class HMCUtil():
         hmc = remote_hmc if remote_hmc else self
         cmd = "lssyscfg -m %s -r lpar --filter lpar_names=%s -F msp" % (
             mg_system, vios_name)
-        msp_output = hmc.ssh.run_command(cmd)
+        msp_output = hmc.cached_field(hmc.get_lpar_record(mg_system, vios_name),
+                                      "msp", cmd)
         if int(msp_output[0]) != 1:
             return False
         return True
@@ -1254,6 +1414,13 @@ class HMCConsole(HMCUtil):
         
         # Create SSH connection to LPAR for sysinfo collection (instead of using console)
         self.lpar_ssh = None
+
+        # HMC SSH session kept across console closes, reattach runs mkvterm only
+        self.hmc_session = None
+        # pinned to the HMC host name on login
+        self.hmc_prompt = hmc_prompt(self.user)
+        # seconds each connect() took to get the console, for the logs
+        self.attach_times = []
         
         super(HMCConsole, self).__init__(hmc_ip, user_name, password, scratch_disk, proxy,
                                          logfile, managed_system, lpar_name, prompt,
@@ -1454,13 +1621,22 @@ class HMCConsole(HMCUtil):
         self.setup_term_quiet = 0
         self.setup_term_disable = 0
 
-    def close(self):
+    def close(self, keep_session=True):
         '''
         Close HMC console
 
+        Leaves mkvterm with its escape sequence and, when the HMC shell
+        comes back, keeps the SSH session so the next connect only has to
+        run mkvterm again. keep_session=False closes the session as well.
+
         :raises: `pexpect.ExceptionPexpect`
         '''
         self.util.clear_state(self)
+        if keep_session and self.detach():
+            self.state = ConsoleState.DISCONNECTED
+            log.debug("HMC close -> DETACHED")
+            return
+        self.hmc_session = None
         try:
             self.pty.close()
             if self.pty.status != -1:  # leaving for debug
@@ -1476,6 +1652,96 @@ class HMCConsole(HMCUtil):
             self.state = ConsoleState.DISCONNECTED
         log.debug("HMC close -> TERMINATE")
 
+    def detach(self):
+        '''
+        Ends the mkvterm session on the console pty, returns True if the
+        HMC shell prompt is back and the SSH session can be reused.
+        '''
+        if self.pty is None:
+            return False
+        try:
+            if not self.pty.isalive():
+                return False
+            if self.state == ConsoleState.CONNECTED:
+                self.pty.send("\r" + VTERM_ESCAPE)
+            else:
+                self.pty.send("\r")
+            i = self.pty.expect([self.hmc_prompt, pexpect.TIMEOUT, pexpect.EOF],
+                                timeout=10)
+        except Exception as e:
+            log.debug("HMC console detach failed: {}".format(e))
+            return False
+        if i != 0:
+            return False
+        self.hmc_session = self.pty
+        return True
+
+    def deactivate_lpar_console(self):
+        '''
+        Deactivate/disconnect the LPAR Console, our own mkvterm included
+        '''
+        super(HMCConsole, self).deactivate_lpar_console()
+        if self.state == ConsoleState.CONNECTED:
+            # rmvterm ended our mkvterm, the pty is back at the HMC shell
+            self.state = ConsoleState.DISCONNECTED
+            self.hmc_session = self.pty if self.detach() else None
+
+    def hmc_login(self):
+        '''
+        SSH to the HMC and wait for its shell prompt
+        '''
+        command = "sshpass -p %s ssh -p 22 -l %s %s -o PubkeyAuthentication=no"\
+                  " -o afstokenpassing=no -q -o 'UserKnownHostsFile=/dev/null'"\
+                  " -o 'StrictHostKeyChecking=no'"
+        pty = Spawn(command % (self.passwd, self.user, self.hmc_ip))
+        i = pty.expect([hmc_prompt(self.user), pexpect.TIMEOUT, pexpect.EOF], timeout=60)
+        if i != 0:
+            pty.close()
+            raise OpTestError("No HMC shell prompt from %s" % self.hmc_ip)
+        # the host name the HMC shows, which the IP or alias used may not be
+        host = re.search(r"@([\w.\-]+):", pty.after)
+        self.hmc_prompt = hmc_prompt(self.user, host.group(1) if host else None)
+        return pty
+
+    def hmc_session_ready(self):
+        '''
+        True if the kept HMC SSH session answers with its prompt
+        '''
+        pty = self.hmc_session
+        if pty is None:
+            return False
+        try:
+            if not pty.isalive():
+                return False
+            pty.send("\r")
+            return pty.expect([self.hmc_prompt, pexpect.TIMEOUT, pexpect.EOF],
+                              timeout=10) == 0
+        except Exception:
+            return False
+
+    def mkvterm(self):
+        '''
+        Runs mkvterm on the HMC session, removing a stale terminal session
+        with rmvterm only when mkvterm says there is one.
+        '''
+        mkvterm = "mkvterm -m %s -p %s" % (self.mg_system, self.lpar_name)
+        for attempt in range(2):
+            self.pty.send(mkvterm + "\r")
+            i = self.pty.expect(["Open Completed.", vterm_busy, self.hmc_prompt,
+                                 pexpect.TIMEOUT, pexpect.EOF], timeout=60)
+            if i == 0:
+                # an idle console prints nothing until poked
+                self.pty.send("\r")
+                return
+            if i == 1 and attempt == 0:
+                log.info("LPAR console already open, removing it")
+                self.pty.expect([self.hmc_prompt, pexpect.TIMEOUT], timeout=10)
+                self.pty.send("rmvterm -m %s -p %s\r" % (self.mg_system, self.lpar_name))
+                self.pty.expect([self.hmc_prompt, pexpect.TIMEOUT], timeout=30)
+                continue
+            break
+        raise OpTestError("Check the lpar activate command")
+
     def connect(self, logger=None):
         '''
         Gets LPAR console using mkvterm
@@ -1500,50 +1766,50 @@ class HMCConsole(HMCUtil):
                     except:
                         pass
                     self.pty = None
+                    self.hmc_session = None
                     self.state = ConsoleState.DISCONNECTED
             except Exception as e:
                 log.warning(f"Error checking cached console: {e} - forcing reconnection")
                 self.pty = None
+                self.hmc_session = None
                 self.state = ConsoleState.DISCONNECTED
         
         self.util.clear_state(self)  # clear when coming in DISCONNECTED
 
-        log.info("De-activating the console")
-        self.deactivate_lpar_console()
-
         log.debug("#HMC Console CONNECT")
 
-        command = "sshpass -p %s ssh -p 22 -l %s %s -o PubkeyAuthentication=no"\
-                  " -o afstokenpassing=no -q -o 'UserKnownHostsFile=/dev/null'"\
-                  " -o 'StrictHostKeyChecking=no'"
+        start = time.time()
         try:
-            self.pty = Spawn(
-                command % (self.passwd, self.user, self.hmc_ip))
+            reused = self.hmc_session_ready()
+            if reused:
+                self.pty = self.hmc_session
+            else:
+                if self.hmc_session is not None:
+                    try:
+                        self.hmc_session.close()
+                    except Exception:
+                        pass
+                self.pty = self.hmc_login()
+            logged_in = time.time()
             log.info("Opening the LPAR console")
-            time.sleep(STALLTIME)
-            self.pty.send('\r')
-            self.pty.sendline("mkvterm -m %s -p %s" %
-                              (self.mg_system, self.lpar_name))
-            self.pty.send('\r')
-            time.sleep(STALLTIME)
-            i = self.pty.expect(
-                ["Open Completed.", pexpect.TIMEOUT], timeout=60)
+            self.mkvterm()
             self.pty.logfile = sys.stdout
             if logger:
                 self.pty.logfile_read = OpTestLogger.FileLikeLogger(logger)
             else:
                 self.pty.logfile_read = OpTestLogger.FileLikeLogger(log)
-
-            if i == 0:
-                time.sleep(STALLTIME)
-                self.state = ConsoleState.CONNECTED
-                self.pty.setwinsize(1000, 1000)
-            else:
-                raise OpTestError("Check the lpar activate command")
+            self.hmc_session = self.pty
+            self.state = ConsoleState.CONNECTED
+            self.pty.setwinsize(1000, 1000)
         except Exception as exp:
             self.state = ConsoleState.DISCONNECTED
+            self.hmc_session = None
             raise CommandFailed('OPexpect.spawn',
                                 'OPexpect.spawn encountered a problem: ' + str(exp), -1)
+        now = time.time()
+        self.attach_times.append(now - start)
+        log.info("LPAR console attached in {:.2f}s ({} SSH {:.2f}s, mkvterm {:.2f}s)".format(
+            now - start, "reused" if reused else "new", logged_in - start, now - logged_in))
 
         if self.delaybeforesend:
             self.pty.delaybeforesend = self.delaybeforesend
@@ -1573,9 +1839,11 @@ class HMCConsole(HMCUtil):
             log.info("Console needed - establishing connection now")
             self.util.clear_state(self)
             self.connect(logger=logger)
-            time.sleep(STALLTIME)
-            l_rc = self.pty.expect(["login:", pexpect.TIMEOUT], timeout=80)
-            if l_rc == 0:
+            l_rc = self.pty.expect(["login:", self.expect_prompt, pexpect.TIMEOUT],
+                                   timeout=80)
+            if l_rc == 1:
+                log.debug("Console already logged in")
+            elif l_rc == 0:
                 self.pty.send('\r')
                 # In case when OS reboot/multireboot test and we lose prompt, reset prompt
                 self.system.LOGIN_set = -1
@@ -1632,4 +1900,10 @@ class HMCConsole(HMCUtil):
         '''
         Wrapper command for run_command from util
         '''
-        return self.util.run_command(self, i_cmd, timeout)
\ No newline at end of file
+        return self.util.run_command(self, i_cmd, timeout)
+
+    def run_commands_batch(self, commands, timeout=600):
+        '''
+        Wrapper command for run_commands_batch from util
+        '''
+        return self.util.run_commands_batch(self, commands, timeout)
\ No newline at end of file
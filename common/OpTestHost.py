@@ -115,6 +115,15 @@ class OpTestHost():
     def hostname(self):
         return self.ip
 
+    def export_command_history(self):
+        '''
+        Writes the SSH command history and statistics of this host to the
+        results directory.
+        '''
+        if self.executor is None or not self.results_dir:
+            return None
+        return self.executor.export_command_history(self.results_dir)
+
     def username(self):
         return self.user
 
@@ -165,19 +174,7 @@ class OpTestHost():
         filename = "%s-%s.log" % (outsuffix, name)
         logfile = os.path.join(self.results_dir, filename)
         print(("Log file: %s" % logfile))
-        logcmd = "tee %s" % (logfile)
-        logcmd = logcmd + "| sed -u -e 's/\\r$//g'|cat -v"
-        print(("logcmd: %s" % logcmd))
-        logfile_proc = subprocess.Popen(logcmd,
-                                        stdin=subprocess.PIPE,
-                                        stderr=subprocess.PIPE,
-                                        stdout=subprocess.PIPE,
-                                        shell=True,
-                                        universal_newlines=True,
-                                        encoding='utf-8')
-        print((repr(logfile_proc)))
-        logfile = logfile_proc.stdin
-        print(("Log file: %s" % logfile))
+        logfile = OpTestLogger.optest_logger_glob.console_stream(logfile)
         OpTestLogger.optest_logger_glob.setUpCustomLoggerDebugFile(
             name, filename)
         ssh = OpTestSSH(self.ip, self.user, self.passwd,
@@ -41,6 +41,8 @@ import os
 import pexpect
 import sys
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from .OpTestConstants import OpTestConstants as BMC_CONST
 from .OpTestError import OpTestError
@@ -57,22 +59,113 @@ import OpTestLogger
 log = OpTestLogger.optest_logger_glob.get_logger(__name__)
 
 
+class IPMIShell():
+    '''
+    One long lived `ipmitool ... shell` session.
+
+    The RMCP+ session is set up once when the shell starts, commands are then
+    sent one at a time and their output read up to the next prompt.
+    '''
+    prompt = "ipmitool> "
+
+    def __init__(self, command, timeout=600, idle_restart=45):
+        self.command = command
+        self.timeout = timeout
+        # BMCs drop idle sessions, start a fresh one rather than find out
+        self.idle_restart = idle_restart
+        self.pty = None
+        self.last_used = 0
+        self.commands = 0
+
+    def start(self):
+        self.close()
+        log.debug("Starting ipmitool shell session")
+        try:
+            self.pty = pexpect.spawn(self.command, encoding='utf-8',
+                                     codec_errors='ignore')
+            self.pty.expect_exact(self.prompt, timeout=60)
+        except (pexpect.EOF, pexpect.TIMEOUT, pexpect.ExceptionPexpect) as e:
+            before = self.pty.before if self.pty else None
+            self.close()
+            raise CommandFailed(self.command,
+                                "ipmitool shell did not start: {}".format(before or e), -1)
+        self.last_used = time.time()
+
+    def alive(self):
+        return (self.pty is not None and self.pty.isalive()
+                and time.time() - self.last_used < self.idle_restart)
+
+    def run(self, cmd, timeout=None):
+        if not self.alive():
+            self.start()
+        self.pty.sendline(cmd)
+        r = self.pty.expect_exact([self.prompt, pexpect.EOF, pexpect.TIMEOUT],
+                                  timeout=timeout or self.timeout)
+        output = self.pty.before
+        if r != 0:
+            self.close()
+            raise CommandFailed(cmd, "ipmitool shell {}: {}".format(
+                "exited" if r == 1 else "timed out", output), -1)
+        self.last_used = time.time()
+        self.commands += 1
+        lines = output.replace('\r\n', '\n').replace('\r', '').split('\n')
+        # drop the echoed command line
+        if lines and lines[0].strip() == cmd.strip():
+            lines = lines[1:]
+        return '\n'.join(lines)
+
+    def close(self):
+        if self.pty is None:
+            return
+        try:
+            self.pty.sendline("exit")
+            self.pty.expect(pexpect.EOF, timeout=5)
+        except Exception:
+            pass
+        try:
+            self.pty.close(force=True)
+        except Exception:
+            pass
+        self.pty = None
+
+
 class IPMITool():
     '''
     Run (locally) some command using ipmitool.
 
     This wrapper class takes care of all the login/method details for
     the caller.
+
+    With `shell_sessions` (--ipmi-shell-sessions, off by default as every
+    session holds one of the few the BMC allows) commands are multiplexed
+    over up to that many persistent `ipmitool shell` sessions so each call
+    does not pay for a process spawn and a new RMCP+ session. Anything the shell cannot run (shell syntax
+    other than one trailing pipe, SOL activate, firmware updates, background
+    runs) is run with a subprocess as before.
     '''
 
+    # commands that must not go through the shell session
+    no_shell = re.compile(r"^\s*(sol\s+activate|shell|exec|hpm|fwum|session)\b")
+    # shell syntax the ipmitool shell does not understand
+    shell_syntax = re.compile(r"[;&<>`$\\'\"|(){}]")
+    # output meaning the shell session is no longer usable
+    session_lost = re.compile(r"Unable to establish|session.*(timed out|invalid)|"
+                              r"Insufficient resources for session", re.IGNORECASE)
+
     def __init__(self, method='lanplus', binary='ipmitool',
-                 ip=None, username=None, password=None, logfile=sys.stdout):
+                 ip=None, username=None, password=None, logfile=sys.stdout,
+                 shell_sessions=0):
         self.method = 'lanplus'
         self.ip = ip
         self.username = username
         self.password = password
         self.binary = binary
         self.logfile = logfile
+        self.shell_sessions = shell_sessions
+        self.shells = []
+        self.shells_open = 0
+        self.shell_cond = threading.Condition()
+        self.async_pool = None
 
     def binary_name(self):
         return self.binary
@@ -86,12 +179,91 @@ class IPMITool():
         s += ' '
         return s
 
+    def split_shell_command(self, cmd):
+        '''
+        Returns (ipmitool command, local filter) when cmd can run in an
+        ipmitool shell, e.g. "sdr elist |grep 'Host Status'" is
+        ("sdr elist", "grep 'Host Status'"), or None when it cannot.
+        '''
+        ipmi, sep, local = cmd.partition('|')
+        if not ipmi.strip() or self.shell_syntax.search(ipmi) or self.no_shell.match(ipmi):
+            return None
+        return ipmi.strip(), local.strip() if sep else None
+
+    def get_shell(self):
+        with self.shell_cond:
+            while not self.shells and self.shells_open >= self.shell_sessions:
+                self.shell_cond.wait()
+            if self.shells:
+                return self.shells.pop()
+            self.shells_open += 1
+        return IPMIShell(self.binary + self.arguments() + 'shell')
+
+    def put_shell(self, shell, broken=False):
+        with self.shell_cond:
+            if broken:
+                shell.close()
+                self.shells_open -= 1
+            else:
+                self.shells.append(shell)
+            self.shell_cond.notify()
+
+    def run_in_shell(self, cmd):
+        '''
+        Runs an ipmitool command in a shell session, retrying once on a new
+        session if the BMC dropped the old one.
+        '''
+        for attempt in range(2):
+            shell = self.get_shell()
+            try:
+                output = shell.run(cmd)
+            except CommandFailed:
+                self.put_shell(shell, broken=True)
+                raise
+            lost = self.session_lost.search(output) is not None
+            # a BMC reset ends the session, start afresh next time
+            self.put_shell(shell, broken=lost or cmd.startswith("mc reset"))
+            if not lost:
+                return output
+            log.debug("ipmitool shell session lost, retrying on a new one")
+        return output
+
+    def close_shells(self):
+        with self.shell_cond:
+            shells, self.shells = self.shells, []
+            self.shells_open -= len(shells)
+        for shell in shells:
+            shell.close()
+
     def run(self, cmd, background=False, cmdprefix=None):
         '''
         Run a ipmitool cmd.
 
         :throws: :class:`common.Execptions.CommandFailed`
         '''
+        split = None
+        if not background and not cmdprefix and self.shell_sessions:
+            split = self.split_shell_command(cmd)
+        if split:
+            ipmi_cmd, local = split
+            log.debug("ipmitool shell: {}".format(cmd))
+            try:
+                output = self.run_in_shell(ipmi_cmd)
+            except CommandFailed as e:
+                if "did not start" not in str(e.output):
+                    raise
+                log.warning("ipmitool shell unavailable, running ipmitool "
+                            "commands one at a time: {}".format(e.output))
+                self.shell_sessions = 0
+            else:
+                if local:
+                    output = subprocess.run(local, input=output, shell=True,
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.STDOUT,
+                                            universal_newlines=True,
+                                            encoding='utf-8').stdout
+                log.debug("ipmitool output={}".format(output))
+                return output
         if cmdprefix:
             cmd = cmdprefix + self.binary + self.arguments() + cmd
         else:
@@ -118,6 +290,26 @@ class IPMITool():
             log.debug("pUpdate output={}".format(output))
             return output
 
+    def run_async(self, cmd):
+        '''
+        Run a ipmitool cmd without waiting for it.
+
+        :returns: a concurrent.futures.Future for the output of `run`
+        '''
+        with self.shell_cond:
+            if self.async_pool is None:
+                self.async_pool = ThreadPoolExecutor(
+                    max_workers=max(self.shell_sessions, 1) * 2,
+                    thread_name_prefix="ipmitool")
+        return self.async_pool.submit(self.run, cmd)
+
+    def run_many(self, cmds):
+        '''
+        Run independent ipmitool cmds (sensors, SEL, power status, ...)
+        concurrently, returns their outputs in order.
+        '''
+        return [f.result() for f in [self.run_async(cmd) for cmd in cmds]]
+
 
 class pUpdate():
     def __init__(self, method='lan', binary='pUpdate',
@@ -344,10 +536,14 @@ class IPMIConsole():
     def run_command_ignore_fail(self, command, timeout=60, retry=0):
         return self.util.run_command_ignore_fail(self, command, timeout, retry)
 
+    def run_commands_batch(self, commands, timeout=600):
+        return self.util.run_commands_batch(self, commands, timeout)
+
 
 class OpTestIPMI():
     def __init__(self, i_bmcIP, i_bmcUser, i_bmcPwd, logfile=sys.stdout,
-                 host=None, delaybeforesend=None, host_console_command=None):
+                 host=None, delaybeforesend=None, host_console_command=None,
+                 shell_sessions=0):
         self.cv_bmcIP = i_bmcIP
         self.cv_bmcUser = i_bmcUser
         self.cv_bmcPwd = i_bmcPwd
@@ -356,7 +552,8 @@ class OpTestIPMI():
                                  ip=i_bmcIP,
                                  username=i_bmcUser,
                                  password=i_bmcPwd,
-                                 logfile=logfile)
+                                 logfile=logfile,
+                                 shell_sessions=shell_sessions)
         self.pUpdate = pUpdate(method='lan',
                                ip=i_bmcIP,
                                username=i_bmcUser,
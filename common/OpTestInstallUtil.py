@@ -27,11 +27,12 @@ import os
 import threading
 import socketserver
 import http.server
-import http.server
-import cgi
+import errno
 import subprocess
+import tempfile
 import time
 from .Exceptions import CommandFailed, UnexpectedCase
+from .OpTestArtifactCache import OpTestArtifactCache
 import OpTestConfiguration
 
 from common.OpTestSystem import OpSystemState
@@ -50,8 +51,13 @@ PASSWORD = ""
 REPO = ""
 BOOTPATH = ""
 
+# name -> path of the files hosts uploaded
 uploaded_files = {}
 
+# largest single os.sendfile() call and buffered copy chunk
+SENDFILE_BYTES = 64 * 1024 * 1024
+COPY_BYTES = 1024 * 1024
+
 
 class InstallUtil():
     def __init__(self, base_path="", initrd="", vmlinux="",
@@ -81,6 +87,16 @@ class InstallUtil():
         VMLINUX = vmlinux
         PROXY = self.cv_HOST.get_proxy()
         KS = ks
+        self.cdrom_path = None
+        self.cache = None
+        if self.conf.args.artifact_cache:
+            try:
+                self.cache = OpTestArtifactCache(
+                    self.conf.args.artifact_cache,
+                    int(self.conf.args.artifact_cache_size * 1024 ** 3))
+            except OSError as e:
+                log.warning("Artifact cache {} unusable, not caching: {}".format(
+                    self.conf.args.artifact_cache, e))
 
     def wait_for_network(self):
         retry = 6
@@ -228,6 +244,13 @@ class InstallUtil():
         return my_ip
 
     def get_uploaded_file(self, name):
+        path = uploaded_files.get(name)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def get_uploaded_path(self, name):
         return uploaded_files.get(name)
 
     def start_server(self, server_ip):
@@ -236,7 +259,8 @@ class InstallUtil():
         """
         HOST, PORT = "0.0.0.0", 0
         global REPO
-        self.server = ThreadedHTTPServer((HOST, PORT), ThreadedHTTPHandler)
+        self.server = ThreadedHTTPServer((HOST, PORT), ThreadedHTTPHandler,
+                                         upload_dir=os.path.join(self.conf.output, "uploads"))
         ip, port = self.server.server_address
         if not REPO:
             REPO = "http://%s:%s/repo" % (server_ip, port)
@@ -253,6 +277,7 @@ class InstallUtil():
         """
         self.server.shutdown()
         self.server.server_close()
+        self.server.report()
         return
 
     def setup_repo(self, cdrom):
@@ -266,6 +291,38 @@ class InstallUtil():
         """
         repo_path = os.path.join(BASE_PATH, 'repo')
         abs_repo_path = os.path.abspath(repo_path)
+        # the repo mounted last time, kept mounted across runs
+        source_file = os.path.join(BASE_PATH, ".repo-source")
+
+        if os.path.isfile(cdrom):
+            cdrom_path = cdrom
+        elif self.cache:
+            try:
+                # held while it stays loop mounted
+                cdrom_path = self.cache.fetch(cdrom, hold=True)
+            except (urllib.error.URLError, OSError) as e:
+                print(("Unknown cdrom path %s: %s" % (cdrom, e)))
+                return ""
+        else:
+            cdrom_url = urllib.request.urlopen(cdrom)
+            if not cdrom_url:
+                print(("Unknown cdrom path %s" % cdrom))
+                return ""
+            with open(os.path.join(BASE_PATH, "iso"), 'wb') as f:
+                shutil.copyfileobj(cdrom_url, f, COPY_BYTES)
+            cdrom_path = os.path.join(BASE_PATH, "iso")
+        self.cdrom_path = os.path.abspath(cdrom_path)
+
+        if os.path.ismount(repo_path):
+            try:
+                with open(source_file) as f:
+                    source = f.read().strip()
+            except OSError:
+                source = None
+            # a cached ISO is content addressed, same path is same content
+            if source == self.cdrom_path and self.is_cached(self.cdrom_path):
+                log.info("Reusing repo {} mounted from {}".format(abs_repo_path, source))
+                return abs_repo_path
         # Clear already mount repo
         if os.path.ismount(repo_path):
             status, output = subprocess.getstatusoutput(
@@ -277,27 +334,42 @@ class InstallUtil():
             shutil.rmtree(repo_path)
         else:
             pass
+        if os.path.isfile(source_file):
+            os.remove(source_file)
         if not os.path.isdir(repo_path):
             os.makedirs(abs_repo_path)
 
-        if os.path.isfile(cdrom):
-            cdrom_path = cdrom
-        else:
-            cdrom_url = urllib.request.urlopen(cdrom)
-            if not cdrom_url:
-                print(("Unknown cdrom path %s" % cdrom))
-                return ""
-            with open(os.path.join(BASE_PATH, "iso"), 'wb') as f:
-                f.write(cdrom_url.read())
-            cdrom_path = os.path.join(BASE_PATH, "iso")
         cmd = "mount -t iso9660 -o loop %s %s" % (cdrom_path, abs_repo_path)
         status, output = subprocess.getstatusoutput(cmd)
         if status != 0:
             print(("Failed to mount iso %s on %s\n %s", (cdrom, abs_repo_path,
                                                          output)))
             return ""
+        with open(source_file, 'w') as f:
+            f.write(self.cdrom_path + "\n")
         return abs_repo_path
 
+    def is_cached(self, path):
+        return bool(self.cache) and os.path.dirname(path) == self.cache.objects
+
+    def install_file(self, src, dst, member=None):
+        """
+        Puts src, a URL or with member (its path in the ISO) a file of the
+        mounted ISO, at dst through the artifact cache when there is one.
+        """
+        if member is not None:
+            if self.cache:
+                src = self.cache.derived(self.cdrom_path, member,
+                                         lambda tmp: shutil.copyfile(src, tmp))
+        elif self.cache:
+            src = self.cache.fetch(src)
+        else:
+            response = urllib.request.urlopen(src)
+            with open(dst, 'wb') as f:
+                shutil.copyfileobj(response, f, COPY_BYTES)
+            return
+        shutil.copyfile(src, dst)
+
     def extract_install_files(self, repo_path):
         """
         extract the install file from given repo path
@@ -315,23 +387,26 @@ class InstallUtil():
             os.remove(initrd_dst)
 
         if os.path.isdir(repo_path):
+            # files of an ISO we got from the cache are cached by its digest
+            from_iso = (self.cdrom_path is not None and self.is_cached(self.cdrom_path)
+                        and os.path.abspath(repo_path) == os.path.abspath(os.path.join(BASE_PATH, 'repo')))
             try:
-                shutil.copyfile(vmlinux_src, vmlinux_dst)
-                shutil.copyfile(initrd_src, initrd_dst)
+                if from_iso:
+                    self.install_file(vmlinux_src, vmlinux_dst,
+                                      os.path.join(BOOTPATH, VMLINUX))
+                    self.install_file(initrd_src, initrd_dst,
+                                      os.path.join(BOOTPATH, INITRD))
+                else:
+                    shutil.copyfile(vmlinux_src, vmlinux_dst)
+                    shutil.copyfile(initrd_src, initrd_dst)
             except Exception:
                 return False
         else:
-            vmlinux_file = urllib.request.urlopen(vmlinux_src)
-            initrd_file = urllib.request.urlopen(initrd_src)
-            if not (vmlinux_file and initrd_file):
-                print(("Unknown repo path %s, %s" % (vmlinux_src, initrd_src)))
-                return False
             try:
-                with open(vmlinux_dst, 'wb') as f:
-                    f.write(vmlinux_file.read())
-                with open(initrd_dst, 'wb') as f:
-                    f.write(initrd_file.read())
-            except Exception:
+                self.install_file(vmlinux_src, vmlinux_dst)
+                self.install_file(initrd_src, initrd_dst)
+            except Exception as e:
+                print(("Unknown repo path %s, %s: %s" % (vmlinux_src, initrd_src, e)))
                 return False
         return True
 
@@ -535,101 +610,365 @@ class InstallUtil():
 
 
 class ThreadedHTTPHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    Serves the installer files (vmlinux, initrd, kickstart and the repo)
+    and takes uploads.
+
+    Files are sent with os.sendfile() (a plain chunked copy where that is
+    not available), honouring single byte Range requests, If-Range and
+    If-None-Match against a size/mtime ETag. Uploads are streamed to the
+    server's upload directory.
+    """
+
+    def log_message(self, format, *args):
+        log.debug("Install server: {} {}".format(self.address_string(), format % args))
+
     def do_HEAD(self):
+        self.handle_request(head=True)
+
+    def do_GET(self):
+        self.handle_request(head=False)
+
+    def handle_request(self, head):
         # FIXME: Local repo unable to handle http request while installation
         # Avoid using cdrom if your kickstart file needs repo, if installation
         # just needs vmlinx and initrd from cdrom, cdrom still can be used.
         if "repo" in self.path:
             self.path = BASE_PATH + self.path
-            f = self.send_head()
-            if f:
-                f.close()
-        else:
-            self.send_response(200)
-            self.send_header("Content-type", "text/plain")
-            self.end_headers()
-
-    def do_GET(self):
-        if "repo" in self.path:
-            self.path = BASE_PATH + self.path
+            path = self.translate_path(self.path)
+            if os.path.isfile(path):
+                self.serve_file(path, head)
+                return
+            # directory listings and redirects
             f = self.send_head()
             if f:
                 try:
-                    self.copyfile(f, self.wfile)
+                    if not head:
+                        self.copyfile(f, self.wfile)
                 finally:
                     f.close()
-        else:
+            return
+        log.debug("Install server: {} asked for {}".format(
+            self.address_string(), self.path))
+        if self.path in ("/%s" % VMLINUX, "/%s" % INITRD):
+            self.serve_file("%s%s" % (BASE_PATH, self.path), head,
+                            ctype="application/octet-stream")
+        elif self.path == "/%s" % KS:
+            body = self.kickstart()
             self.send_response(200)
             self.send_header("Content-type", "text/plain")
+            self.send_header("Content-Length", str(len(body)))
             self.end_headers()
-            print(("# Webserver was asked for: ", self.path))
-            if self.path == "/%s" % VMLINUX:
-                f = open("%s/%s" % (BASE_PATH, VMLINUX), "rb")
-                d = f.read()
-                self.wfile.write(d)
-                f.close()
-                return
-            elif self.path == "/%s" % INITRD:
-                f = open("%s/%s" % (BASE_PATH, INITRD), "rb")
-                d = f.read()
-                self.wfile.write(d)
-                f.close()
+            if not head:
+                self.wfile.write(body)
+        else:
+            self.send_error(404)
+
+    def kickstart(self):
+        """
+        The kickstart (or preseed) file filled in for this host.
+        """
+        f = open("%s/%s" % (BASE_PATH, KS), "rb")
+        d = f.read().decode()
+        f.close()
+        ps = ""
+        if "hostos" in BASE_PATH:
+            ps = d.format(REPO, PROXY, PASSWORD, DISK, DISK, DISK)
+        elif "rhel" in BASE_PATH:
+            ps = d.format(REPO, PROXY, PASSWORD, DISK, DISK, DISK)
+        elif "ubuntu" in BASE_PATH:
+            user = USERNAME
+            if user == 'root':
+                user = 'ubuntu'
+
+            packages = "openssh-server build-essential lvm2 ethtool "
+            packages += "nfs-common ssh ksh lsvpd nfs-kernel-server iprutils procinfo "
+            packages += "sg3-utils lsscsi libaio-dev libtime-hires-perl "
+            packages += "acpid tgt openjdk-8* zip git automake python "
+            packages += "expect gcc g++ gdb "
+            packages += "python-dev p7zip python-stevedore python-setuptools "
+            packages += "libvirt-dev numactl libosinfo-1.0-0 python-pip "
+            packages += "linux-tools-common linux-tools-generic lm-sensors "
+            packages += "ipmitool i2c-tools pciutils opal-prd opal-utils "
+            packages += "device-tree-compiler fwts stress"
+
+            ps = d.format("openpower", "example.com",
+                          PROXY, PASSWORD, PASSWORD, user, PASSWORD, PASSWORD, DISK, packages)
+        else:
+            log.warning("Install server: unknown distro for {}".format(BASE_PATH))
+        return ps.encode()
+
+    def byte_range(self, size, etag):
+        """
+        (start, end) of the Range request, None for the whole file, or
+        raises ValueError if it cannot be satisfied.
+        """
+        value = self.headers.get("Range")
+        if not value or not value.startswith("bytes="):
+            return None
+        if_range = self.headers.get("If-Range")
+        if if_range and if_range != etag:
+            # the file changed since the client got its first part
+            return None
+        spec = value[len("bytes="):].strip()
+        if "," in spec:
+            # multiple ranges, answering with the whole file is allowed
+            return None
+        first, sep, last = spec.partition("-")
+        try:
+            if not first:
+                # suffix range, the last N bytes
+                length = int(last)
+                if length <= 0:
+                    raise ValueError(value)
+                return max(0, size - length), size - 1
+            start = int(first)
+            end = int(last) if last else size - 1
+        except ValueError:
+            # malformed, ignore it
+            return None
+        if start >= size or end < start:
+            raise ValueError(value)
+        return start, min(end, size - 1)
+
+    def serve_file(self, path, head=False, ctype=None):
+        try:
+            f = open(path, "rb")
+        except OSError:
+            self.send_error(404)
+            return
+        try:
+            st = os.fstat(f.fileno())
+            size = st.st_size
+            etag = '"%x-%x"' % (st.st_mtime_ns, size)
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
                 return
-            elif self.path == "/%s" % KS:
-                f = open("%s/%s" % (BASE_PATH, KS), "rb")
-                d = f.read().decode()
-                if "hostos" in BASE_PATH:
-                    ps = d.format(REPO, PROXY, PASSWORD, DISK, DISK, DISK)
-                elif "rhel" in BASE_PATH:
-                    ps = d.format(REPO, PROXY, PASSWORD, DISK, DISK, DISK)
-                elif "ubuntu" in BASE_PATH:
-                    user = USERNAME
-                    if user == 'root':
-                        user = 'ubuntu'
-
-                    packages = "openssh-server build-essential lvm2 ethtool "
-                    packages += "nfs-common ssh ksh lsvpd nfs-kernel-server iprutils procinfo "
-                    packages += "sg3-utils lsscsi libaio-dev libtime-hires-perl "
-                    packages += "acpid tgt openjdk-8* zip git automake python "
-                    packages += "expect gcc g++ gdb "
-                    packages += "python-dev p7zip python-stevedore python-setuptools "
-                    packages += "libvirt-dev numactl libosinfo-1.0-0 python-pip "
-                    packages += "linux-tools-common linux-tools-generic lm-sensors "
-                    packages += "ipmitool i2c-tools pciutils opal-prd opal-utils "
-                    packages += "device-tree-compiler fwts stress"
-
-                    ps = d.format("openpower", "example.com",
-                                  PROXY, PASSWORD, PASSWORD, user, PASSWORD, PASSWORD, DISK, packages)
-                else:
-                    print("unknown distro")
-                self.wfile.write(ps.encode())
+            try:
+                byte_range = self.byte_range(size, etag)
+            except ValueError:
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */%d" % size)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
                 return
+            if byte_range is None:
+                start, end = 0, size - 1
+                self.send_response(200)
             else:
-                self.send_response(404)
+                start, end = byte_range
+                self.send_response(206)
+                self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end, size))
+            count = end - start + 1
+            self.send_header("Content-type", ctype or self.guess_type(path))
+            self.send_header("Content-Length", str(count))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", self.date_time_string(st.st_mtime))
+            self.end_headers()
+            if head or count <= 0:
                 return
+            began = time.time()
+            sent = self.send_range(f, start, count)
+            self.server.record(self.client_address[0], sent, time.time() - began)
+            log.debug("Install server: sent {} bytes {}-{} of {} to {} in {:.1f}s".format(
+                os.path.basename(path), start, end, size, self.client_address[0],
+                time.time() - began))
+        finally:
+            f.close()
+
+    def send_range(self, f, offset, count):
+        """
+        Sends count bytes of f from offset, returns the bytes sent.
+        """
+        self.wfile.flush()
+        sent = 0
+        if hasattr(os, "sendfile"):
+            try:
+                out = self.connection.fileno()
+                while sent < count:
+                    n = os.sendfile(out, f.fileno(), offset + sent,
+                                    min(count - sent, SENDFILE_BYTES))
+                    if n == 0:
+                        # file shrank under us
+                        return sent
+                    sent += n
+                return sent
+            except (ConnectionError, BrokenPipeError):
+                return sent
+            except OSError as e:
+                if sent or e.errno not in (errno.EINVAL, errno.ENOSYS,
+                                           errno.EOPNOTSUPP, errno.ENOTSOCK):
+                    raise
+        f.seek(offset + sent)
+        try:
+            while sent < count:
+                data = f.read(min(count - sent, COPY_BYTES))
+                if not data:
+                    break
+                self.wfile.write(data)
+                sent += len(data)
+        except (ConnectionError, BrokenPipeError):
+            pass
+        return sent
 
     def do_POST(self):
         path = os.path.normpath(self.path)
         path = path[1:]
         path_elements = path.split('/')
 
-        print("INCOMING")
-        print((repr(path)))
-        print((repr(path_elements)))
+        log.debug("Install server: POST {} from {}".format(
+            repr(path_elements), self.address_string()))
 
         if path_elements[0] != "upload":
+            self.send_error(404)
             return
 
-        form = cgi.FieldStorage(
-            fp=self.rfile,
-            headers=self.headers,
-            environ={"REQUEST_METHOD": "POST",
-                     "CONTENT_TYPE": self.headers['Content-Type']})
+        try:
+            length = int(self.headers.get("Content-Length"))
+        except (TypeError, ValueError):
+            self.send_error(411)
+            return
 
-        uploaded_files[form["file"].filename] = form["file"].value
+        began = time.time()
+        ctype = self.headers.get("Content-Type", "")
+        try:
+            if ctype.startswith("multipart/form-data"):
+                name = self.receive_multipart(ctype, length)
+            else:
+                # raw body, POST /upload/<name>
+                name = path_elements[-1] if len(path_elements) > 1 else None
+                if name:
+                    self.receive_file(name, self.rfile, length)
+        except (ValueError, OSError) as e:
+            log.warning("Install server: upload from {} failed: {}".format(
+                self.address_string(), e))
+            self.send_error(400)
+            return
+        if not name:
+            self.send_error(400, "No file in upload")
+            return
+        self.server.record(self.client_address[0], length, time.time() - began)
+        log.debug("Install server: received {} ({} bytes) from {}".format(
+            name, length, self.address_string()))
 
-        self.wfile.write("Success")
+        self.send_response(200)
+        self.send_header("Content-type", "text/plain")
+        self.send_header("Content-Length", "7")
+        self.end_headers()
+        self.wfile.write(b"Success")
+
+    def receive_file(self, name, stream, length):
+        """
+        Streams length bytes of stream into the upload directory as name.
+        """
+        name = os.path.basename(name)
+        path = os.path.join(self.server.upload_dir, name)
+        with open(path, "wb") as out:
+            while length > 0:
+                data = stream.read(min(length, COPY_BYTES))
+                if not data:
+                    raise ValueError("upload of {} truncated".format(name))
+                out.write(data)
+                length -= len(data)
+        with self.server.lock:
+            uploaded_files[name] = path
+        return name
+
+    def receive_multipart(self, ctype, length):
+        """
+        Streams the first file of a multipart/form-data body (the "file"
+        field the installers post) to disk, returns its name.
+        """
+        boundary = None
+        for param in ctype.split(";")[1:]:
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "boundary":
+                boundary = value.strip('"').encode()
+        if not boundary:
+            raise ValueError("multipart upload without a boundary")
+        delimiter = b"\r\n--" + boundary
+        remaining = [length]
+
+        def read(n):
+            data = self.rfile.read(min(n, remaining[0])) if remaining[0] > 0 else b""
+            remaining[0] -= len(data)
+            return data
+
+        # the body starts with the delimiter without its leading CRLF
+        buf = b"\r\n"
+        name = None
+        while name is None:
+            # find the next part and its headers
+            while delimiter not in buf or b"\r\n\r\n" not in buf[buf.find(delimiter):]:
+                data = read(COPY_BYTES)
+                if not data:
+                    return None
+                buf += data
+            buf = buf[buf.find(delimiter) + len(delimiter):]
+            if buf.startswith(b"--"):
+                # closing delimiter
+                return None
+            part, _, buf = buf.partition(b"\r\n\r\n")
+            disposition = ""
+            for line in part.decode("utf-8", "replace").split("\r\n"):
+                if line.lower().startswith("content-disposition:"):
+                    disposition = line
+            for param in disposition.split(";")[1:]:
+                key, _, value = param.strip().partition("=")
+                if key.lower() == "filename":
+                    name = os.path.basename(value.strip('"'))
+        path = os.path.join(self.server.upload_dir, name)
+        with open(path, "wb") as out:
+            while True:
+                end = buf.find(delimiter)
+                if end >= 0:
+                    out.write(buf[:end])
+                    break
+                # keep what could be the start of the delimiter
+                keep = len(delimiter) - 1
+                if len(buf) > keep:
+                    out.write(buf[:-keep])
+                    buf = buf[-keep:]
+                data = read(COPY_BYTES)
+                if not data:
+                    raise ValueError("upload of {} truncated".format(name))
+                buf += data
+        # drain the rest of the body
+        while read(COPY_BYTES):
+            pass
+        with self.server.lock:
+            uploaded_files[name] = path
+        return name
 
 
 class ThreadedHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
-    pass
+    daemon_threads = True
+
+    def __init__(self, server_address, handler, upload_dir=None):
+        http.server.HTTPServer.__init__(self, server_address, handler)
+        self.lock = threading.Lock()
+        if upload_dir:
+            os.makedirs(upload_dir, exist_ok=True)
+        else:
+            upload_dir = tempfile.mkdtemp(prefix="op-test-upload-")
+        self.upload_dir = upload_dir
+        # client ip -> [bytes, seconds, transfers]
+        self.clients = {}
+
+    def record(self, client, count, seconds):
+        with self.lock:
+            stats = self.clients.setdefault(client, [0, 0.0, 0])
+            stats[0] += count
+            stats[1] += seconds
+            stats[2] += 1
+
+    def report(self):
+        with self.lock:
+            clients = sorted(self.clients.items())
+        for client, (count, seconds, transfers) in clients:
+            log.info("Install server: {} {} transfers {:.1f} MiB in {:.1f}s ({:.1f} MiB/s)".format(
+                client, transfers, count / 1048576.0, seconds,
+                count / 1048576.0 / seconds if seconds else 0))
@@ -20,16 +20,40 @@
 
 '''
 Support testing against Mambo simulator
+
+Mambo boots skiboot and the kernel instruction by instruction, so getting to
+Petitboot takes a long time. Two things cut that down:
+
+--mambo-boot-mode picks the simulator mode skiboot.tcl boots in (MAMBO_SIM_MODE,
+fastest by default), --mambo-test-mode switches to another one (e.g. a cycle
+accurate one) once Petitboot is reached, so only the tests pay for it.
+
+With --mambo-checkpoint-dir the simulator is checkpointed the first time it
+gets to the Petitboot shell after a full boot, in a directory keyed on the
+skiboot, kernel and initramfs hashes, the Mambo binary and the run script
+with the environment it reads. Later power ons that are going to Petitboot
+start Mambo without SKIBOOT_AUTORUN, restore the checkpoint at the systemsim
+prompt and carry on from there. A checkpoint that fails to restore or does
+not come back to a Petitboot shell is removed and the system boots normally.
+
+Every boot logs the wall time it took next to the simulated time (from the
+timebase of CPU 0), so the speedup of the modes and checkpoints shows up in
+the log.
 '''
 
+import hashlib
+import json
+import re
+import shutil
 import sys
 import time
 import pexpect
 import subprocess
 import os
 
-from common.Exceptions import CommandFailed, ParameterCheck
+from common.Exceptions import CommandFailed, ParameterCheck, UnexpectedCase
 from . import OPexpect
+from .OpTestQemu import file_digest, file_identity
 from .OpTestUtil import OpTestUtil
 
 import logging
@@ -37,6 +61,20 @@ import OpTestLogger
 log = OpTestLogger.optest_logger_glob.get_logger(__name__)
 
 
+CHECKPOINT_FORMAT = 1
+# systemsim commands, {} is the checkpoint file
+CHECKPOINT_SAVE = "mysim checkpoint save {}"
+CHECKPOINT_RESTORE = "mysim checkpoint restore {}"
+SIM_MODE = "mysim mode {}"
+# the simulated time is read from the timebase
+SIM_TIMEBASE = "mysim cpu 0 display spr tb"
+TIMEBASE_HZ = 512000000
+# skiboot.tcl environment set by MamboConsole, not part of the checkpoint key
+spawn_variables = ["SKIBOOT", "SKIBOOT_ZIMAGE", "SKIBOOT_INITRD", "SKIBOOT_AUTORUN", "MAMBO_SIM_MODE"]
+script_variables = re.compile(r"env\((\w+)\)|\bmconfig\s+\S+\s+(\w+)")
+systemsim_error = re.compile(r"error|invalid|unknown|not supported|can't|cannot", re.IGNORECASE)
+
+
 class ConsoleState():
     DISCONNECTED = 0
     CONNECTED = 1
@@ -58,6 +96,9 @@ class MamboConsole():
                  block_setup_term=None,
                  delaybeforesend=None,
                  timeout_factor=1,
+                 checkpoint_dir=None,
+                 boot_mode="fastest",
+                 test_mode=None,
                  logfile=sys.stdout):
         self.mambo_binary = mambo_binary
         self.mambo_initial_run_script = mambo_initial_run_script
@@ -82,6 +123,17 @@ class MamboConsole():
         self.setup_term_disable = 0
         # functional simulators are notoriously slow, so multiply all default timeouts by this factor
         self.timeout_factor = timeout_factor
+        self.checkpoint_dir = os.path.abspath(checkpoint_dir) if checkpoint_dir else None
+        self.boot_mode = boot_mode
+        self.test_mode = test_mode
+        # checkpoint connect() restores instead of booting
+        self.restoring = None
+        # connect() booted from scratch, the boot can be checkpointed
+        self.booted_pristine = False
+        self.checkpoint_failed = False
+        # wall clock and simulated seconds at power on, None once reported
+        self.boot_start = None
+        self.sim_start = 0
 
         # state tracking, reset on boot and state changes
         # console tracking done on System object for the system console
@@ -149,7 +201,9 @@ class MamboConsole():
                + " -f {}".format(self.mambo_initial_run_script)
                )
 
-        spawn_env = os.environ
+        spawn_env = dict(os.environ)
+        if self.boot_mode:
+            spawn_env['MAMBO_SIM_MODE'] = self.boot_mode
         if self.skiboot:
             spawn_env['SKIBOOT'] = self.skiboot
         if self.kernel:
@@ -160,7 +214,7 @@ class MamboConsole():
                                      " R/W permissions flash-initramfs={}"
                                      .format(self.initramfs))
             spawn_env['SKIBOOT_INITRD'] = self.initramfs
-        if self.mambo_autorun:
+        if self.mambo_autorun and not self.restoring:
             spawn_env['SKIBOOT_AUTORUN'] = str(self.mambo_autorun)
         log.debug("OpTestMambo cmd={} mambo spawn_env={}".format(cmd, spawn_env))
         try:
@@ -174,10 +228,16 @@ class MamboConsole():
 
         self.state = ConsoleState.CONNECTED
         self.pty.setwinsize(1000, 1000)
+        OpTestLogger.optest_logger_glob.record_console(self.pty, log.name)
         if self.delaybeforesend:
             self.pty.delaybeforesend = self.delaybeforesend
+        self.boot_start = time.time()
+        self.sim_start = 0
+        self.booted_pristine = self.restoring is None
 
-        if self.system.SUDO_set != 1 or self.system.LOGIN_set != 1 or self.system.PS1_set != 1:
+        if self.restoring:
+            self.resume_checkpoint(self.restoring)
+        elif self.system.SUDO_set != 1 or self.system.LOGIN_set != 1 or self.system.PS1_set != 1:
             self.util.setup_term(self.system, self.pty,
                                  None, self.system.block_setup_term)
 
@@ -203,6 +263,9 @@ class MamboConsole():
     def run_command_ignore_fail(self, command, timeout=60, retry=0):
         return self.util.run_command_ignore_fail(self, command, timeout*self.timeout_factor, retry)
 
+    def run_commands_batch(self, commands, timeout=600):
+        return self.util.run_commands_batch(self, commands, timeout*self.timeout_factor)
+
     def mambo_run_command(self, command, timeout=60, retry=0):
         return self.util.mambo_run_command(self, command, timeout*self.timeout_factor, retry)
 
@@ -212,6 +275,193 @@ class MamboConsole():
     def mambo_enter(self):
         return self.util.mambo_enter(self)
 
+    def systemsim_command(self, command, timeout=60):
+        '''
+        Runs command at the systemsim prompt, raising CommandFailed when
+        systemsim complains.
+        '''
+        output = self.mambo_run_command(command, timeout=timeout)
+        if any(systemsim_error.search(line) for line in output):
+            raise CommandFailed(command, output, -1)
+        return output
+
+    def set_mode(self, mode):
+        '''
+        Switches the simulator mode, at the systemsim prompt.
+        '''
+        self.systemsim_command(SIM_MODE.format(mode))
+        log.info("Mambo simulating in {} mode".format(mode))
+
+    def sim_seconds(self):
+        '''
+        Simulated seconds since power on, from the timebase of CPU 0, None
+        when it can't be read. At the systemsim prompt.
+        '''
+        try:
+            output = self.systemsim_command(SIM_TIMEBASE)
+        except CommandFailed as e:
+            log.debug("Mambo unable to read the timebase: {}".format(e))
+            return None
+        for line in reversed(output):
+            value = re.search(r"\b(0x[0-9a-fA-F]+|[0-9]+)\b", line)
+            if value:
+                return int(value.group(1), 0) / float(TIMEBASE_HZ)
+        return None
+
+    def checkpoint_key(self):
+        '''
+        Hash of everything a checkpoint depends on.
+        '''
+        with open(self.mambo_initial_run_script) as f:
+            script = f.read()
+        variables = set(a or b for a, b in script_variables.findall(script))
+        environment = {name: os.environ.get(name) for name in sorted(variables)
+                       if name not in spawn_variables}
+        parts = {"format": CHECKPOINT_FORMAT,
+                 "mambo": file_identity(self.mambo_binary),
+                 "script": hashlib.sha256(script.encode()).hexdigest(),
+                 "environment": environment,
+                 "skiboot": file_digest(self.skiboot),
+                 "kernel": file_digest(self.kernel),
+                 "initramfs": file_digest(self.initramfs)}
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def checkpoint_path(self):
+        return os.path.join(self.checkpoint_dir, self.checkpoint_key())
+
+    def checkpoint_wanted(self):
+        return (self.checkpoint_dir is not None and self.booted_pristine
+                and not self.checkpoint_failed
+                and not os.path.isdir(self.checkpoint_path()))
+
+    def reached(self, state_name):
+        '''
+        Called when a boot or restore first gets to Petitboot (state_name
+        PETITBOOT or PETITBOOT_SHELL), before any test runs: logs the boot
+        time, checkpoints a full boot at the shell when --mambo-checkpoint-dir
+        wants one and switches to --mambo-test-mode.
+        '''
+        if self.state != ConsoleState.CONNECTED or self.boot_start is None:
+            return
+        wall = time.time() - self.boot_start
+        self.boot_start = None
+        try:
+            self.mambo_enter()
+        except UnexpectedCase as e:
+            log.warning("Mambo unable to stop the simulator at {}: {}".format(state_name, e))
+            return
+        try:
+            sim = self.sim_seconds()
+            how = "booted" if self.booted_pristine else "restored"
+            if sim is None:
+                log.info("Mambo {} to {} in {:.0f}s wall time".format(how, state_name, wall))
+            else:
+                sim -= self.sim_start
+                log.info("Mambo {} to {} in {:.0f}s wall time, {:.2f}s simulated ({:.0f}x slower than"
+                         " real time, {} mode)".format(how, state_name, wall, sim,
+                                                       wall / sim if sim > 0 else 0, self.boot_mode))
+            if state_name == "PETITBOOT_SHELL" and self.checkpoint_wanted():
+                self.save_checkpoint(state_name, wall, sim)
+            self.booted_pristine = False
+            if self.test_mode and self.test_mode != self.boot_mode:
+                self.set_mode(self.test_mode)
+        except CommandFailed as e:
+            log.warning("Mambo systemsim command failed at {}: {}".format(state_name, e))
+        finally:
+            self.mambo_exit()
+
+    def save_checkpoint(self, state_name, wall, sim):
+        '''
+        Checkpoints the simulator, stopped at the systemsim prompt, which got
+        to state_name by a full boot.
+        '''
+        path = self.checkpoint_path()
+        tmp = "{}.tmp-{}".format(path, os.getpid())
+        start = time.time()
+        os.makedirs(tmp, exist_ok=True)
+        try:
+            self.systemsim_command(CHECKPOINT_SAVE.format(os.path.join(tmp, "checkpoint")),
+                                   timeout=600)
+            if not os.path.exists(os.path.join(tmp, "checkpoint")):
+                raise OSError("systemsim wrote no checkpoint")
+            with open(os.path.join(tmp, "checkpoint.json"), 'w') as f:
+                json.dump({"state": state_name,
+                           "boot_seconds": round(wall, 1),
+                           "sim_seconds": sim,
+                           "created": time.time()}, f, indent=2)
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                if not os.path.isdir(path):
+                    raise
+                # another op-test sharing the directory saved it first
+                shutil.rmtree(tmp, ignore_errors=True)
+                return False
+        except (CommandFailed, OSError) as e:
+            shutil.rmtree(tmp, ignore_errors=True)
+            self.checkpoint_failed = True
+            log.warning("Mambo checkpoint not saved, booting normally from now on: {}".format(e))
+            return False
+        log.info("Mambo checkpoint of {} saved in {:.1f}s to {}".format(
+            state_name, time.time() - start, path))
+        return True
+
+    def restore_checkpoint(self, state_name):
+        '''
+        Starts Mambo from the state_name checkpoint, returns False (nothing
+        started) when there is none that can be used.
+        '''
+        if self.checkpoint_dir is None or self.checkpoint_failed:
+            return False
+        try:
+            path = self.checkpoint_path()
+            with open(os.path.join(path, "checkpoint.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if meta.get("state") != state_name:
+            return False
+        if self.state == ConsoleState.CONNECTED:
+            self.close()
+        self.restoring = path
+        try:
+            self.connect()
+        except CommandFailed as e:
+            log.warning("Mambo checkpoint {} failed to restore, removing it: {}".format(path, e))
+            self.close()
+            self.invalidate_checkpoint(path)
+            return False
+        finally:
+            self.restoring = None
+        self.sim_start = meta.get("sim_seconds") or 0
+        log.info("Mambo restored {} from checkpoint in {:.1f}s (the boot took {}s)".format(
+            state_name, time.time() - self.boot_start, meta.get("boot_seconds")))
+        return True
+
+    def resume_checkpoint(self, path):
+        '''
+        Restores the checkpoint in path at the systemsim prompt skiboot.tcl
+        leaves us at without SKIBOOT_AUTORUN, then lets it run.
+        '''
+        rc = self.pty.expect(["systemsim %", pexpect.TIMEOUT, pexpect.EOF],
+                             timeout=60 * self.timeout_factor)
+        if rc != 0:
+            raise CommandFailed("mambo", "no systemsim prompt to restore {} at".format(path), -1)
+        command = CHECKPOINT_RESTORE.format(os.path.join(path, "checkpoint"))
+        self.pty.sendline(command)
+        rc = self.pty.expect(["systemsim %", pexpect.TIMEOUT, pexpect.EOF],
+                             timeout=600 * self.timeout_factor)
+        output = self.pty.before.replace("\r\r\n", "\n").splitlines()[1:]
+        if rc != 0 or any(systemsim_error.search(line) for line in output):
+            raise CommandFailed(command, output, rc)
+        if self.boot_mode:
+            self.pty.sendline(SIM_MODE.format(self.boot_mode))
+            self.pty.expect(["systemsim %", pexpect.TIMEOUT, pexpect.EOF], timeout=60)
+        self.mambo_exit()
+
+    def invalidate_checkpoint(self, path=None):
+        shutil.rmtree(path or self.checkpoint_path(), ignore_errors=True)
+
 
 class MamboIPMI():
     '''
@@ -256,6 +506,9 @@ class OpTestMambo():
                  block_setup_term=None,
                  delaybeforesend=None,
                  timeout_factor=None,
+                 checkpoint_dir=None,
+                 boot_mode="fastest",
+                 test_mode=None,
                  logfile=sys.stdout):
         self.console = MamboConsole(mambo_binary=mambo_binary,
                                     mambo_initial_run_script=mambo_initial_run_script,
@@ -264,6 +517,9 @@ class OpTestMambo():
                                     kernel=kernel,
                                     initramfs=initramfs,
                                     timeout_factor=timeout_factor,
+                                    checkpoint_dir=checkpoint_dir,
+                                    boot_mode=boot_mode,
+                                    test_mode=test_mode,
                                     logfile=logfile)
         self.ipmi = MamboIPMI(self.console)
         self.system = None
@@ -287,6 +543,12 @@ class OpTestMambo():
     def power_on(self):
         self.console.connect()
 
+    def restore_checkpoint(self, state_name):
+        return self.console.restore_checkpoint(state_name)
+
+    def reached(self, state_name):
+        self.console.reached(state_name)
+
     def get_rest_api(self):
         return None
 
@@ -26,19 +26,88 @@ import subprocess
 import json
 import requests
 import cgi
+import hashlib
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 from .OpTestSSH import OpTestSSH
 from .OpTestBMC import OpTestBMC
 from .Exceptions import HTTPCheck
 from .Exceptions import CommandFailed
 from .OpTestConstants import OpTestConstants as BMC_CONST
+from .OpTestBMCWatcher import OpBMCStateWatcher
 from . import OpTestSystem
 
 import logging
 import OpTestLogger
 log = OpTestLogger.optest_logger_glob.get_logger(__name__)
 
+# dumps and images are moved in chunks of this size, never whole in memory
+TRANSFER_CHUNK_SIZE = 1024 * 1024
+# seconds between progress reports of a transfer
+TRANSFER_REPORT_INTERVAL = 10
+
+
+class TransferProgress():
+    '''
+    Byte count, SHA-256 and throughput of one dump or image transfer.
+    '''
+
+    def __init__(self, name, total=None):
+        self.name = name
+        self.total = total
+        self.done = 0
+        self.sha256 = hashlib.sha256()
+        self.start = time.time()
+        self.last_report = self.start
+
+    def update(self, chunk):
+        self.done += len(chunk)
+        self.sha256.update(chunk)
+        now = time.time()
+        if now - self.last_report >= TRANSFER_REPORT_INTERVAL:
+            self.last_report = now
+            log.info("{}: {}".format(self.name, self.report()))
+
+    def reset(self):
+        self.done = 0
+        self.sha256 = hashlib.sha256()
+
+    def rate(self):
+        return self.done / max(time.time() - self.start, 0.001)
+
+    def report(self):
+        if self.total:
+            done = "{:.1f}/{:.1f} MiB ({:.0%})".format(
+                self.done / 1048576.0, self.total / 1048576.0,
+                self.done / float(self.total))
+        else:
+            done = "{:.1f} MiB".format(self.done / 1048576.0)
+        return "{} at {:.2f} MiB/s".format(done, self.rate() / 1048576.0)
+
+
+class ProgressReader():
+    '''
+    File wrapper handed to requests as an upload body, requests sends
+    Content-Length from __len__ and reads the file in blocks.
+    '''
+
+    def __init__(self, fileobj, progress):
+        self.fileobj = fileobj
+        self.progress = progress
+
+    def __len__(self):
+        return self.progress.total
+
+    def read(self, size=-1):
+        chunk = self.fileobj.read(size)
+        self.progress.update(chunk)
+        return chunk
+
+    def rewind(self):
+        self.fileobj.seek(0)
+        self.progress.reset()
+
 
 class HostManagement():
     '''
@@ -60,8 +129,16 @@ class HostManagement():
         if self.conf.util_bmc_server is None:
             self.conf.util.setup(config='REST')
         r = self.conf.util_bmc_server.login()
+        self.watcher = OpBMCStateWatcher(self.conf.util_bmc_server)
         self.wait_for_bmc_runtime()
 
+    def get_many(self, uris, minutes=BMC_CONST.HTTP_RETRY):
+        '''
+        GET several uris concurrently, returns the 'data' of each in order
+        '''
+        return [r.json().get('data')
+                for r in self.conf.util_bmc_server.get_many(uris, minutes=minutes)]
+
     def get_inventory(self, minutes=BMC_CONST.HTTP_RETRY):
         '''
         Inventory Enumerate
@@ -477,26 +554,15 @@ class HostManagement():
         Given a token, target, key wait for a match
         '''
         # handles data as a dictionary or string
-        timeout = time.time() + 60*minutes
-        while True:
-            r = self.conf.util_bmc_server.get(uri=token, minutes=minutes)
-            if type(r.json().get('data')) == type(dict()):
+        def match(data):
+            if isinstance(data, dict):
                 if key is None:
-                    for key, value in r.json().get('data'):
-                        if r.json().get('data').get(key) == value_target:
-                            break
-                else:
-                    if r.json().get('data').get(key) == value_target:
-                        break
-            else:
-                if value_target in r.json().get('data'):
-                    break
-            if time.time() > timeout:
-                log.warning("We timed out waiting for \"{}\", we waited {} minutes for \"{}\"".format(
-                    token, minutes, value_target))
-                raise HTTPCheck(message="HTTP problem getting \"{}\", we waited {} minutes for \"{}\"".format(
-                    token, minutes, value_target))
-            time.sleep(5)
+                    return value_target in list(data.values())
+                return data.get(key) == value_target
+            return data is not None and value_target in data
+
+        self.watcher.wait(token, match, minutes=minutes,
+                          description=value_target)
         return True
 
     def wait_for_bmc_runtime(self, timeout=10):
@@ -517,7 +583,7 @@ class HostManagement():
         uri = "/xyz/openbmc_project/software/"
         r = self.conf.util_bmc_server.get(uri=uri, minutes=minutes)
         log.debug("Image IDs={}".format(r.json()))
-        ids = []
+        candidates = []
         for k in r.json().get('data'):
             log.debug("Image Data Info k={}".format(k))
             m = re.match(r'/xyz/openbmc_project/software/(.*)', k)
@@ -537,10 +603,12 @@ class HostManagement():
             # Adriana has promised me that this is safe into the future.
             if m:
                 log.debug("Image Data Info ID={}: {}".format(m.group(1), k))
-                i = self.image_data(m.group(1))
-                if i['data'].get('Purpose') is not None:
-                    ids.append(m.group(1))
+                candidates.append(m.group(1))
 
+        images = self.get_many(["/xyz/openbmc_project/software/{}".format(id)
+                                for id in candidates], minutes=minutes)
+        ids = [id for id, data in zip(candidates, images)
+               if data.get('Purpose') is not None]
         log.debug("List of images id's: {}".format(ids))
         return ids
 
@@ -555,19 +623,37 @@ class HostManagement():
         log.debug("Image ID={} Data={}".format(id, r.json()))
         return r.json()
 
-    def upload_image(self, image, minutes=BMC_CONST.HTTP_RETRY):
+    def upload_image(self, image, minutes=BMC_CONST.HTTP_RETRY, retries=3):
         '''
         Upload an image, OpenBMC imposes validation on files uploaded
         POST
         https://bmcip/upload/image
         "file" : file-like-object
+
+        The image is streamed from disk, a dropped connection restarts the
+        upload (the BMC has no partial upload) up to `retries` times.
         '''
         with open(image, 'rb') as fileload:
             uri = "/upload/image"
             octet_hdr = {'Content-Type': 'application/octet-stream'}
-            r = self.conf.util_bmc_server.post(uri=uri,
-                                               headers=octet_hdr,
-                                               data=fileload)
+            progress = TransferProgress("Upload {}".format(os.path.basename(image)),
+                                        total=os.fstat(fileload.fileno()).st_size)
+            body = ProgressReader(fileload, progress)
+            for attempt in range(retries + 1):
+                body.rewind()
+                try:
+                    r = self.conf.util_bmc_server.post(uri=uri,
+                                                       headers=octet_hdr,
+                                                       data=body)
+                    break
+                except (requests.exceptions.ConnectionError,
+                        requests.exceptions.Timeout) as e:
+                    if attempt == retries:
+                        raise
+                    log.warning("Upload of {} dropped after {}, restarting: {}"
+                                .format(image, progress.report(), e))
+            log.info("Uploaded {} {} sha256={}".format(
+                image, progress.report(), progress.sha256.hexdigest()))
             if r.status_code != 200:
                 print((r.headers))
                 print((r.text))
@@ -604,18 +690,16 @@ class HostManagement():
         Image Activation Ready
         IS THIS USED ?  CAN IT BE REMOVED ?
         '''
-        timeout = time.time() + 60*timeout
-        while True:
-            json_data = self.image_data(id, minutes=BMC_CONST.HTTP_RETRY)
-            log.debug("Image JSON : {}".format(json_data))
-            if json_data.get('data').get('Activation') \
-                    == "xyz.openbmc_project.Software.Activation.Activations.Ready":
-                log.debug("Image upload is successful & Ready for activation")
-                break
-            if time.time() > timeout:
-                raise HTTPCheck(
-                    message="Image is not ready for activation/Timeout happened")
-            time.sleep(5)
+        uri = "/xyz/openbmc_project/software/{}".format(id)
+        try:
+            self.watcher.wait(uri,
+                              lambda data: data.get('Activation')
+                              == "xyz.openbmc_project.Software.Activation.Activations.Ready",
+                              minutes=timeout, description="Activation Ready")
+        except HTTPCheck:
+            raise HTTPCheck(
+                message="Image is not ready for activation/Timeout happened")
+        log.debug("Image upload is successful & Ready for activation")
         return True
 
     def activate_image(self, id, minutes=BMC_CONST.HTTP_RETRY):
@@ -656,28 +740,33 @@ class HostManagement():
         '''
         Wait For Image Active Complete
         '''
-        timeout = time.time() + 60*timeout
-        while True:
-            json_data = self.image_data(id, minutes=BMC_CONST.HTTP_RETRY)
-            if json_data.get('data').get('Activation') \
-                    == "xyz.openbmc_project.Software.Activation.Activations.Activating":
+        uri = "/xyz/openbmc_project/software/{}".format(id)
+        activating = []
+
+        def done(data):
+            activation = data.get('Activation')
+            if activation == "xyz.openbmc_project.Software.Activation.Activations.Activating" \
+                    and not activating:
+                activating.append(True)
                 log.info("Image activation is in progress")
-            if json_data.get('data').get('Activation') \
-                    == "xyz.openbmc_project.Software.Activation.Activations.Active":
-                log.info(
-                    "Image activated successfully, Good to go for power on....")
-                break
-            if json_data.get('data').get('Activation') \
-                    == "xyz.openbmc_project.Software.Activation.Activations.Failed":
-                log.error("Image activation failed. Try --run testcases.testRestAPI.HostOff.test_field_mode_enable_disable, which leaves field mode disabled.")
-                log.warning("Bug reported SW461922 : OP930:FVT: Software Field mode disable operation does not throw error or warning, future this will not work")
-                log.warning("You need to factory reset the BMC which requires re-setting BMC IP's (BMC serial connection needed due to loss of networking")
-                log.warning("Alternate methods are via BMC busctl commands")
-                return False
-            if time.time() > timeout:
-                raise HTTPCheck(
-                    message="Image is failed to activate/Timeout happened")
-            time.sleep(5)
+            return activation in ["xyz.openbmc_project.Software.Activation.Activations.Active",
+                                  "xyz.openbmc_project.Software.Activation.Activations.Failed"]
+
+        try:
+            data = self.watcher.wait(uri, done, minutes=timeout,
+                                     description="Activation Active")
+        except HTTPCheck:
+            raise HTTPCheck(
+                message="Image is failed to activate/Timeout happened")
+        if data.get('Activation') \
+                == "xyz.openbmc_project.Software.Activation.Activations.Failed":
+            log.error("Image activation failed. Try --run testcases.testRestAPI.HostOff.test_field_mode_enable_disable, which leaves field mode disabled.")
+            log.warning("Bug reported SW461922 : OP930:FVT: Software Field mode disable operation does not throw error or warning, future this will not work")
+            log.warning("You need to factory reset the BMC which requires re-setting BMC IP's (BMC serial connection needed due to loss of networking")
+            log.warning("Alternate methods are via BMC busctl commands")
+            return False
+        log.info(
+            "Image activated successfully, Good to go for power on....")
         return True
 
     def host_image_ids(self):
@@ -736,18 +825,73 @@ class HostManagement():
         log.debug("Dump IDs: {}".format(dump_ids))
         return dump_ids
 
-    def download_dump(self, dump_id, minutes=BMC_CONST.HTTP_RETRY):
+    def download_dump(self, dump_id, minutes=BMC_CONST.HTTP_RETRY, retries=5):
         '''
         Download Dump
         GET
         https://bmcip/download/dump/<id>
+
+        The dump is streamed to the log directory in chunks, a dropped
+        connection resumes with an HTTP Range request from the last byte
+        written, up to `retries` times. Returns the path of the dump.
         '''
         uri = "/download/dump/{}".format(dump_id)
-        r = self.conf.util_bmc_server.get(
-            uri=uri, stream=True, minutes=minutes)
-        value, params = cgi.parse_header(r.headers.get('Content-Disposition'))
-        with open(os.path.join(self.conf.logdir, params.get('filename')), 'wb') as f:
-            f.write(r.content)
+        progress = TransferProgress("Dump {}".format(dump_id))
+        path = None
+        f = None
+        try:
+            for attempt in range(retries + 1):
+                headers = None
+                if progress.done:
+                    headers = {'Range': 'bytes={}-'.format(progress.done)}
+                try:
+                    r = self.conf.util_bmc_server.get(
+                        uri=uri, stream=True, headers=headers, minutes=minutes)
+                    if path is None:
+                        value, params = cgi.parse_header(
+                            r.headers.get('Content-Disposition'))
+                        path = os.path.join(self.conf.logdir, params.get('filename'))
+                        f = open(path + ".part", 'wb')
+                    if r.status_code != requests.codes.partial_content and progress.done:
+                        # the BMC ignored the Range, start over
+                        log.debug("Dump {} resume not supported, restarting".format(dump_id))
+                        f.seek(0)
+                        f.truncate()
+                        progress.reset()
+                    if progress.total is None and r.headers.get('Content-Length'):
+                        progress.total = progress.done + int(r.headers['Content-Length'])
+                    for chunk in r.iter_content(chunk_size=TRANSFER_CHUNK_SIZE):
+                        f.write(chunk)
+                        progress.update(chunk)
+                    r.close()
+                    break
+                except (requests.exceptions.ConnectionError,
+                        requests.exceptions.ChunkedEncodingError,
+                        requests.exceptions.Timeout) as e:
+                    if attempt == retries:
+                        raise
+                    log.warning("Dump {} download dropped at {}, resuming: {}"
+                                .format(dump_id, progress.report(), e))
+        finally:
+            if f:
+                f.close()
+        os.rename(path + ".part", path)
+        log.info("Downloaded dump {} to {} {} sha256={}".format(
+            dump_id, path, progress.report(), progress.sha256.hexdigest()))
+        return path
+
+    def download_all_dumps(self, ids=None, max_workers=4,
+                           minutes=BMC_CONST.HTTP_RETRY):
+        '''
+        Download several dumps concurrently (all available by default),
+        returns the paths.
+        '''
+        if ids is None:
+            ids = self.get_dump_ids(minutes=minutes)
+        if not ids:
+            return []
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(lambda id: self.download_dump(id, minutes=minutes), ids))
 
     def delete_dump(self, dump_id, minutes=BMC_CONST.HTTP_RETRY):
         '''
@@ -767,9 +911,11 @@ class HostManagement():
         Delete all Dumps
         '''
         ids = self.get_dump_ids()
-        for id in ids:
-            self.delete_dump(id, minutes=BMC_CONST.HTTP_RETRY)
-            log.debug("Deleting Dump ID={}".format(id))
+        if not ids:
+            return
+        log.debug("Deleting Dump IDs={}".format(ids))
+        with ThreadPoolExecutor(max_workers=min(len(ids), 4)) as pool:
+            list(pool.map(lambda id: self.delete_dump(id, minutes=BMC_CONST.HTTP_RETRY), ids))
 
     def create_new_dump(self, minutes=None):
         '''
@@ -20,10 +20,32 @@
 
 """
 Support testing against Qemu simulator
+
+Every QEMU gets a QMP socket (QemuQMP) used to power off, power down and
+reset the machine, query its run state, follow its events and hotplug
+disks and NICs into the running VM.
+
+With --qemu-snapshot-dir the VM state is saved the first time a run gets to
+the Petitboot shell, and later power ons restore it instead of IPLing:
+
+- The PNOR is used through a qcow2 overlay, so the image on disk is never
+  written and what the firmware changed can be told apart.
+- A snapshot is the migration stream of the VM plus a copy of that PNOR
+  overlay, in a directory named after a hash of the QEMU binary, skiboot,
+  kernel, initramfs, PNOR, cdrom and disk layout, so changing any of them
+  simply misses the cache.
+- It is only taken or restored while the PNOR is unchanged since it was
+  pristine (or restored) and the disks are empty, as the saved Petitboot
+  has seen neither.
 """
 
 import atexit
+import hashlib
+import json
+import shutil
+import socket
 import sys
+import threading
 import time
 import pexpect
 import subprocess
@@ -31,7 +53,9 @@ import tempfile
 import os
 
 from common.Exceptions import CommandFailed
+from common.OpTestError import OpTestError
 from . import OPexpect
+from . import OpTestSystem
 from .OpTestUtil import OpTestUtil
 import OpTestConfiguration
 
@@ -45,6 +69,163 @@ class ConsoleState():
     CONNECTED = 1
 
 
+# bump when the QEMU command line changes in a way snapshots depend on
+SNAPSHOT_FORMAT = 1
+# (path, size, mtime) -> sha256, images are hashed once per run
+file_hashes = {}
+
+
+def file_digest(path):
+    '''
+    sha256 of a file, None for no file.
+    '''
+    if not path:
+        return None
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime)
+    if key not in file_hashes:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(block)
+        file_hashes[key] = sha.hexdigest()
+    return file_hashes[key]
+
+
+def file_identity(path):
+    '''
+    Cheap identity for files too big to hash on every run (the cdrom ISO,
+    the QEMU binary).
+    '''
+    if not path:
+        return None
+    st = os.stat(path)
+    return [os.path.abspath(path), st.st_size, int(st.st_mtime)]
+
+
+def qemu_img_json(command, *args):
+    # -U as the images may be open in a running QEMU, which locks them
+    return json.loads(subprocess.check_output(
+        ["qemu-img", command, "-U"] + list(args) + ["--output=json"]).decode())
+
+
+class QemuQMP(object):
+    '''
+    QMP connection to a running QEMU: commands, and the events QEMU sends
+    (SHUTDOWN, RESET, POWERDOWN, GUEST_PANICKED, DEVICE_DELETED...) kept in
+    order for wait_event().
+    '''
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.replies = {}
+        self.events = []
+        self.next_id = 0
+        self.closed = False
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        deadline = time.time() + timeout
+        while True:
+            try:
+                self.sock.connect(path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                # QEMU is still starting
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+        self.rfile = self.sock.makefile('rb')
+        greeting = json.loads(self.rfile.readline().decode())
+        log.debug("QMP connected: {}".format(greeting.get("QMP", {}).get("version")))
+        self.thread = threading.Thread(target=self.reader, name="qemu-qmp")
+        self.thread.daemon = True
+        self.thread.start()
+        self.command("qmp_capabilities")
+
+    def reader(self):
+        try:
+            for line in self.rfile:
+                try:
+                    message = json.loads(line.decode())
+                except ValueError:
+                    continue
+                with self.changed:
+                    if "event" in message:
+                        self.events.append(message)
+                        self.changed.notify_all()
+                    elif "id" in message:
+                        self.replies[message["id"]] = message
+                        self.changed.notify_all()
+                if "event" in message:
+                    log.debug("QMP event {} {}".format(message["event"],
+                                                       message.get("data", "")))
+                    if message["event"] == "GUEST_PANICKED":
+                        log.warning("QMP guest panicked: {}".format(message.get("data")))
+        except (OSError, ValueError):
+            pass
+        with self.changed:
+            self.closed = True
+            self.changed.notify_all()
+
+    def command(self, name, timeout=60, **arguments):
+        '''
+        Runs a QMP command, returns its "return" value, raises
+        CommandFailed on an error reply or when QEMU went away.
+        '''
+        with self.changed:
+            self.next_id += 1
+            cid = self.next_id
+        request = {"execute": name, "id": cid}
+        if arguments:
+            request["arguments"] = arguments
+        try:
+            self.sock.sendall(json.dumps(request).encode() + b"\n")
+        except OSError as e:
+            raise CommandFailed("qmp " + name, str(e), -1)
+        deadline = time.time() + timeout
+        with self.changed:
+            while cid not in self.replies:
+                if self.closed or time.time() > deadline:
+                    raise CommandFailed("qmp " + name, "no reply from QEMU", -1)
+                self.changed.wait(deadline - time.time())
+            reply = self.replies.pop(cid)
+        if "error" in reply:
+            raise CommandFailed("qmp " + name, reply["error"].get("desc"), -1)
+        return reply.get("return")
+
+    def wait_event(self, names, timeout=60, since=0):
+        '''
+        Waits for one of the events names after the first `since` events,
+        returns it, or None on timeout or when QEMU went away.
+        '''
+        if isinstance(names, str):
+            names = [names]
+        deadline = time.time() + timeout
+        with self.changed:
+            while True:
+                for event in self.events[since:]:
+                    if event["event"] in names:
+                        return event
+                if self.closed or time.time() > deadline:
+                    return None
+                self.changed.wait(deadline - time.time())
+
+    def status(self):
+        '''
+        Run state, e.g. "running", "paused", "shutdown", "inmigrate".
+        '''
+        return self.command("query-status", timeout=10).get("status")
+
+    def close(self):
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
 class QemuConsole():
     """
     A 'connection' to the Qemu Console involves *launching* qemu.
@@ -54,8 +235,13 @@ class QemuConsole():
     def __init__(self, qemu_binary=None, pnor=None, skiboot=None,
                  prompt=None, kernel=None, initramfs=None,
                  block_setup_term=None, delaybeforesend=None,
-                 logfile=sys.stdout, disks=None, cdrom=None):
+                 logfile=sys.stdout, disks=None, cdrom=None,
+                 snapshot_dir=None, memory="4G", smp=None, accel=None,
+                 mac='52:54:00:22:34:56'):
         self.qemu_binary = qemu_binary
+        self.memory = memory
+        self.smp = smp
+        self.accel = accel
         self.pnor = pnor
         self.skiboot = skiboot
         self.kernel = kernel
@@ -77,7 +263,23 @@ class QemuConsole():
         self.setup_term_quiet = 0
         # flags the object to abandon setup_term operations, like when system off
         self.setup_term_disable = 0
-        self.mac_str = '52:54:00:22:34:56'
+        self.mac_str = mac
+
+        # snapshot mode, see the module docstring
+        self.snapshot_dir = snapshot_dir
+        self.workdir = None
+        self.qmp_path = None
+        self.qmp = None
+        self.hotplugged = []
+        # disk name -> size it was created with, for the snapshot key
+        self.disk_sizes = {}
+        self.pnor_overlay = None
+        # what the overlay held when it was pristine, the PNOR or a snapshot
+        self.pnor_base = None
+        self.incoming = None
+        self.booted_pristine = False
+        self.boot_start = None
+        self.snapshot_failed = False
 
         # state tracking, reset on boot and state changes
         # console tracking done on System object for the system console
@@ -114,6 +316,15 @@ class QemuConsole():
 
     def close(self):
         self.util.clear_state(self)
+        if self.qmp is not None:
+            # let QEMU exit by itself rather than be killed
+            try:
+                self.qmp.command("quit", timeout=10)
+                self.pty.expect(pexpect.EOF, timeout=10)
+            except Exception as e:
+                log.debug("Qemu quit over QMP failed: {}".format(e))
+            self.qmp.close()
+            self.qmp = None
         try:
             rc_child = self.pty.close()
             exitCode = signalstatus = None
@@ -140,10 +351,16 @@ class QemuConsole():
         log.debug("#Qemu Console CONNECT")
 
         cmd = ("%s" % (self.qemu_binary)
-               + " -machine powernv -m 4G"
+               + " -machine powernv -m %s" % (self.memory)
                + " -nographic -nodefaults"
                )
-        if self.pnor:
+        if self.smp:
+            cmd = cmd + " -smp %d" % (self.smp)
+        if self.accel:
+            cmd = cmd + " -accel %s" % (self.accel)
+        if self.pnor and self.snapshot_dir:
+            cmd = cmd + " -drive file={},format=qcow2,if=mtd".format(self.prepare_pnor())
+        elif self.pnor:
             cmd = cmd + " -drive file={},format=raw,if=mtd".format(self.pnor)
         if self.skiboot:
             skibootdir = os.path.dirname(self.skiboot)
@@ -246,6 +463,9 @@ class QemuConsole():
                 diskid += 1
                 bridge['n_devices'] += 1
 
+        # free slots for hotplug
+        self.bridges = bridges
+
         # typical host ip=10.0.2.2 and typical skiroot 10.0.2.15
         # use skiroot as the source, no sshd in skiroot
 
@@ -254,6 +474,17 @@ class QemuConsole():
         cmd = cmd + " -device ipmi-bmc-sim,id=bmc0,frudatafile=" + \
             fru_path + " -device isa-ipmi-bt,bmc=bmc0,irq=10"
         cmd = cmd + " -serial none -device isa-serial,chardev=s1 -chardev stdio,id=s1,signal=off"
+        self.make_workdir()
+        if os.path.exists(self.qmp_path):
+            os.remove(self.qmp_path)
+        cmd = cmd + " -qmp unix:{},server=on,wait=off".format(self.qmp_path)
+        if self.snapshot_dir:
+            if self.incoming:
+                cmd = cmd + " -incoming 'exec:cat {}'".format(
+                    os.path.join(self.incoming, "state"))
+            else:
+                self.booted_pristine = self.pnor_pristine(original=True) and self.disks_empty()
+            self.boot_start = time.time()
         print(cmd)
         try:
             self.pty = OPexpect.spawn(cmd, logfile=self.logfile)
@@ -264,6 +495,7 @@ class QemuConsole():
 
         self.state = ConsoleState.CONNECTED
         self.pty.setwinsize(1000, 1000)
+        OpTestLogger.optest_logger_glob.record_console(self.pty, log.name)
         if self.delaybeforesend:
             self.pty.delaybeforesend = self.delaybeforesend
 
@@ -277,6 +509,13 @@ class QemuConsole():
         time.sleep(0.2)
         if not self.pty.isalive():
             raise CommandFailed(cmd, self.pty.read(), self.pty.status)
+        try:
+            self.qmp = QemuQMP(self.qmp_path)
+        except (OSError, ValueError) as e:
+            # everything but hotplug and the snapshots works without it
+            log.warning("Qemu QMP connection failed: {}".format(e))
+            self.qmp = None
+        self.hotplugged = []
         return self.pty
 
     def get_console(self):
@@ -296,6 +535,342 @@ class QemuConsole():
     def run_command_ignore_fail(self, command, timeout=60, retry=0):
         return self.util.run_command_ignore_fail(self, command, timeout, retry)
 
+    def run_commands_batch(self, commands, timeout=600):
+        return self.util.run_commands_batch(self, commands, timeout)
+
+    def run_state(self):
+        '''
+        QEMU run state from QMP ("running", "paused", "shutdown"...), "off"
+        when QEMU is not running.
+        '''
+        if self.state == ConsoleState.DISCONNECTED or not self.pty.isalive():
+            return "off"
+        if self.qmp is None:
+            return "unknown"
+        return self.qmp.status()
+
+    def powerdown(self, timeout=120):
+        '''
+        Asks the firmware to power off (an IPMI soft off to OPAL) and waits
+        for it, then ends QEMU.
+        '''
+        if self.qmp is not None and self.state == ConsoleState.CONNECTED:
+            since = len(self.qmp.events)
+            try:
+                self.qmp.command("system_powerdown")
+                if self.qmp.wait_event("SHUTDOWN", timeout, since) is None:
+                    log.warning("Qemu did not power down within {}s, stopping it".format(timeout))
+            except CommandFailed as e:
+                log.warning("Qemu powerdown failed: {}".format(e))
+        self.close()
+
+    def reset(self):
+        '''
+        Resets the machine in place, QEMU keeps running.
+        '''
+        if self.qmp is None or self.state != ConsoleState.CONNECTED:
+            self.close()
+            self.connect()
+            return
+        since = len(self.qmp.events)
+        self.qmp.command("system_reset")
+        self.qmp.wait_event("RESET", 10, since)
+        self.util.clear_state(self)
+
+    def free_slot(self):
+        for bridge in getattr(self, 'bridges', []):
+            if bridge['n_devices'] < 30:
+                bridge['n_devices'] += 1
+                return bridge['bus'], 1 + bridge['n_devices']
+        return None
+
+    def release_slot(self, slot):
+        # only the slot free_slot() just gave out, so the last on its bridge
+        for bridge in getattr(self, 'bridges', []):
+            if bridge['bus'] == slot[0] and 1 + bridge['n_devices'] == slot[1]:
+                bridge['n_devices'] -= 1
+
+    def hotplug_disk(self, path, fmt="raw"):
+        '''
+        Adds the disk image at path to the running VM, returns False when
+        that is not possible (QEMU not running, no QMP, no free slot).
+        '''
+        if self.qmp is None or self.state != ConsoleState.CONNECTED:
+            return False
+        slot = self.free_slot()
+        if slot is None:
+            return False
+        name = "hotdisk{}".format(len(self.hotplugged))
+        try:
+            self.qmp.command("blockdev-add", driver=fmt, **{
+                "node-name": name,
+                "file": {"driver": "file", "filename": path}})
+        except CommandFailed as e:
+            log.warning("Qemu disk hotplug failed: {}".format(e))
+            self.release_slot(slot)
+            return False
+        try:
+            self.qmp.command("device_add", driver="virtio-blk-pci", drive=name,
+                             id="virtio-" + name, bus="pcie.{}".format(slot[0]),
+                             addr=hex(slot[1]))
+        except CommandFailed as e:
+            log.warning("Qemu disk hotplug failed: {}".format(e))
+            self.release_slot(slot)
+            try:
+                self.qmp.command("blockdev-del", **{"node-name": name})
+            except CommandFailed:
+                pass
+            return False
+        self.hotplugged.append(name)
+        log.debug("Qemu hotplugged disk {} on bus {} at address {}".format(path, slot[0], slot[1]))
+        return True
+
+    def hotplug_nic(self, mac):
+        '''
+        Adds an e1000e NIC with user networking to the running VM, returns
+        False when that is not possible.
+        '''
+        if self.qmp is None or self.state != ConsoleState.CONNECTED:
+            return False
+        slot = self.free_slot()
+        if slot is None:
+            return False
+        name = "hotnic{}".format(len(self.hotplugged))
+        try:
+            self.qmp.command("netdev_add", type="user", id=name)
+        except CommandFailed as e:
+            log.warning("Qemu NIC hotplug failed: {}".format(e))
+            self.release_slot(slot)
+            return False
+        try:
+            self.qmp.command("device_add", driver="e1000e", netdev=name,
+                             id="dev-" + name, mac=mac,
+                             bus="pcie.{}".format(slot[0]), addr=hex(slot[1]))
+        except CommandFailed as e:
+            log.warning("Qemu NIC hotplug failed: {}".format(e))
+            self.release_slot(slot)
+            try:
+                self.qmp.command("netdev_del", id=name)
+            except CommandFailed:
+                pass
+            return False
+        self.hotplugged.append(name)
+        return True
+
+    def guest_disks(self):
+        '''
+        Number of virtio disk nodes the guest has, None when it can't be
+        asked.
+        '''
+        try:
+            return int(self.run_command("ls /dev/vd* 2>/dev/null | wc -l", timeout=30)[-1])
+        except (CommandFailed, ValueError, IndexError):
+            return None
+
+    def wait_guest_disks(self, count, timeout=30):
+        '''
+        Rescans the guest's PCI buses until it has more than count virtio disk
+        nodes, Petitboot's udev discovery picks the new disk up from there.
+        '''
+        deadline = time.time() + timeout
+        while True:
+            self.run_command_ignore_fail("echo 1 > /sys/bus/pci/rescan", timeout=30)
+            disks = self.guest_disks()
+            if disks is not None and disks > count:
+                return True
+            if time.time() > deadline:
+                return False
+            time.sleep(2)
+
+    def make_workdir(self):
+        if self.workdir is None:
+            self.workdir = tempfile.mkdtemp(prefix="op-test-qemu-")
+            self.qmp_path = os.path.join(self.workdir, "qmp.sock")
+
+    def prepare_pnor(self, base=None):
+        '''
+        Path of the qcow2 overlay QEMU uses as PNOR, a new one on top of
+        base (a snapshot's PNOR) when given.
+        '''
+        self.make_workdir()
+        if base is None and self.pnor_overlay is not None:
+            return self.pnor_overlay
+        self.pnor_base = base or os.path.abspath(self.pnor)
+        self.pnor_overlay = os.path.join(self.workdir, "pnor.qcow2")
+        if os.path.exists(self.pnor_overlay):
+            os.remove(self.pnor_overlay)
+        subprocess.check_call(["qemu-img", "create", "-q", "-f", "qcow2",
+                               "-b", self.pnor_base,
+                               "-F", "qcow2" if base else "raw",
+                               self.pnor_overlay])
+        return self.pnor_overlay
+
+    def pnor_pristine(self, original=False):
+        '''
+        True when the PNOR overlay has the content it started with (with
+        original, only if that was the PNOR image itself).
+        '''
+        if not self.pnor:
+            return True
+        if self.pnor_overlay is None:
+            self.prepare_pnor()
+        if original and self.pnor_base != os.path.abspath(self.pnor):
+            return False
+        return subprocess.call(["qemu-img", "compare", "-q", "-U",
+                                self.pnor_overlay, self.pnor_base]) == 0
+
+    def disks_empty(self):
+        '''
+        True when nothing was written to the disks (they start empty).
+        '''
+        try:
+            for disk in self.disks or []:
+                if any(extent.get("data") for extent in qemu_img_json("map", disk.name)):
+                    return False
+        except (subprocess.CalledProcessError, OSError, ValueError) as e:
+            log.debug("Qemu snapshot, unable to check the disks: {}".format(e))
+            return False
+        return True
+
+    def snapshot_key(self):
+        '''
+        Hash of everything a saved VM state depends on.
+        '''
+        disks = [self.disk_sizes.get(disk.name) for disk in self.disks or []]
+        parts = {"format": SNAPSHOT_FORMAT,
+                 "qemu": file_identity(shutil.which(self.qemu_binary) or self.qemu_binary),
+                 "skiboot": file_digest(self.skiboot),
+                 "kernel": file_digest(self.kernel),
+                 "initramfs": file_digest(self.initramfs),
+                 "pnor": file_digest(self.pnor),
+                 "cdrom": file_identity(self.cdrom),
+                 "disks": disks,
+                 "mac": self.mac_str,
+                 "memory": self.memory,
+                 "smp": self.smp,
+                 "accel": self.accel}
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def snapshot_path(self):
+        return os.path.join(self.snapshot_dir, self.snapshot_key())
+
+    def snapshot_wanted(self):
+        if (self.snapshot_dir is None or self.state != ConsoleState.CONNECTED
+                or not self.booted_pristine or self.snapshot_failed):
+            return False
+        try:
+            return not os.path.isdir(self.snapshot_path())
+        except (OSError, ValueError, subprocess.CalledProcessError) as e:
+            log.warning("Qemu snapshot not saved, booting normally from now on: {}".format(e))
+            self.snapshot_failed = True
+            return False
+
+    def save_snapshot(self, state_name):
+        '''
+        Saves the running VM, which got to state_name by a full IPL from a
+        pristine PNOR and empty disks.
+        '''
+        path = self.snapshot_path()
+        tmp = "{}.tmp-{}".format(path, os.getpid())
+        boot_seconds = time.time() - self.boot_start
+        start = time.time()
+        os.makedirs(tmp, exist_ok=True)
+        try:
+            # what the IPL wrote to the PNOR is part of the snapshot, the
+            # disks are not
+            if not self.disks_empty():
+                raise OpTestError("the disks were written since power on")
+            if self.qmp is None:
+                raise OpTestError("no QMP connection")
+            self.qmp.command("stop")
+            try:
+                self.qmp.command("migrate", uri="exec:cat > {}".format(os.path.join(tmp, "state")))
+                timeout = time.time() + 600
+                while True:
+                    status = self.qmp.command("query-migrate").get("status")
+                    if status == "completed":
+                        break
+                    if status in ["failed", "cancelled"] or time.time() > timeout:
+                        raise OpTestError("migration to file {}".format(status))
+                    time.sleep(0.5)
+                if self.pnor:
+                    subprocess.check_call(["qemu-img", "convert", "-U", "-O", "qcow2",
+                                           self.pnor_overlay, os.path.join(tmp, "pnor.qcow2")])
+            finally:
+                self.qmp.command("cont")
+            with open(os.path.join(tmp, "snapshot.json"), 'w') as f:
+                json.dump({"state": state_name,
+                           "boot_seconds": round(boot_seconds, 1),
+                           "created": time.time()}, f, indent=2)
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                if not os.path.isdir(path):
+                    raise
+                # another op-test sharing the directory saved it first
+                shutil.rmtree(tmp, ignore_errors=True)
+                self.booted_pristine = False
+                return False
+        except (OpTestError, CommandFailed, OSError, subprocess.CalledProcessError) as e:
+            shutil.rmtree(tmp, ignore_errors=True)
+            self.snapshot_failed = True
+            log.warning("Qemu snapshot not saved, booting normally from now on: {}".format(e))
+            return False
+        if self.pnor:
+            # the overlay now matches the snapshot's PNOR
+            self.pnor_base = os.path.join(path, "pnor.qcow2")
+        log.info("Qemu snapshot of {} saved in {:.1f}s to {} (IPL took {:.0f}s)".format(
+            state_name, time.time() - start, path, boot_seconds))
+        return True
+
+    def restore_snapshot(self, state_name):
+        '''
+        Starts QEMU from the saved state_name snapshot, returns False
+        (nothing started) when there is none that can be used.
+        '''
+        if self.snapshot_dir is None or self.snapshot_failed:
+            return False
+        try:
+            path = self.snapshot_path()
+            with open(os.path.join(path, "snapshot.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError, subprocess.CalledProcessError):
+            return False
+        if meta.get("state") != state_name:
+            return False
+        if not self.pnor_pristine() or not self.disks_empty():
+            log.info("Qemu snapshot not used, the PNOR or disks changed since power on")
+            return False
+        if self.state == ConsoleState.CONNECTED:
+            self.close()
+        start = time.time()
+        if self.pnor:
+            self.prepare_pnor(base=os.path.join(path, "pnor.qcow2"))
+        self.incoming = path
+        try:
+            self.connect()
+        except CommandFailed as e:
+            log.warning("Qemu snapshot {} failed to restore, removing it: {}".format(path, e))
+            self.close()
+            self.invalidate_snapshot(path)
+            return False
+        finally:
+            self.incoming = None
+        self.booted_pristine = False
+        log.info("Qemu restored {} from snapshot in {:.1f}s (IPL took {}s)".format(
+            state_name, time.time() - start, meta.get("boot_seconds")))
+        return True
+
+    def invalidate_snapshot(self, path=None):
+        shutil.rmtree(path or self.snapshot_path(), ignore_errors=True)
+        # start over from the PNOR image on the next power on
+        self.pnor_overlay = None
+
+    def cleanup(self):
+        if self.workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+            self.workdir = None
+
 
 class QemuIPMI():
     """
@@ -309,11 +884,19 @@ class QemuIPMI():
         self.console = console
 
     def ipmi_power_off(self):
-        """For Qemu, this just kills the simulator"""
+        """For Qemu, this just ends the simulator"""
         self.console.close()
 
+    def ipmi_power_soft(self):
+        """Firmware power off, ends the simulator once it is off"""
+        self.console.powerdown()
+
+    def ipmi_power_reset(self):
+        """Resets the machine without restarting the simulator"""
+        self.console.reset()
+
     def ipmi_wait_for_standby_state(self, i_timeout=10):
-        """For Qemu, we just kill the simulator"""
+        """For Qemu, we just end the simulator"""
         self.console.close()
 
     def ipmi_set_boot_to_petitboot(self):
@@ -335,8 +918,10 @@ class QemuIPMI():
 class OpTestQemu():
     def __init__(self, conf=None, qemu_binary=None, pnor=None, skiboot=None,
                  kernel=None, initramfs=None, cdrom=None,
-                 logfile=sys.stdout):
+                 logfile=sys.stdout, snapshot_dir=None, memory="4G",
+                 smp=None, accel=None, mac='52:54:00:22:34:56'):
         self.disks = []
+        disk_sizes = {}
         # need the conf object to properly bind opened object
         # we need to be able to cleanup/close the temp file in signal handler
         self.conf = conf
@@ -348,6 +933,8 @@ class OpTestQemu():
                 self.conf.args.qemu_scratch_disk = \
                     open(self.conf.args.qemu_scratch_disk, 'wb')
                 # now is a file-like object
+                disk_sizes[self.conf.args.qemu_scratch_disk.name] = \
+                    os.path.getsize(self.conf.args.qemu_scratch_disk.name)
             except Exception as e:
                 log.error("OpTestQemu encountered a problem "
                           "opening file={} Exception={}"
@@ -362,6 +949,7 @@ class OpTestQemu():
                                                     "-fqcow2",
                                                     self.conf.args.qemu_scratch_disk.name,
                                                     "10G"])
+                disk_sizes[self.conf.args.qemu_scratch_disk.name] = "10G"
             except Exception as e:
                 log.error("OpTestQemu encountered a problem with qemu-img,"
                           " check that you have qemu-utils installed first"
@@ -376,7 +964,11 @@ class OpTestQemu():
                                    kernel=kernel,
                                    initramfs=initramfs,
                                    logfile=logfile,
-                                   disks=self.disks, cdrom=cdrom)
+                                   disks=self.disks, cdrom=cdrom,
+                                   snapshot_dir=snapshot_dir,
+                                   memory=memory, smp=smp, accel=accel,
+                                   mac=mac)
+        self.console.disk_sizes = disk_sizes
         self.ipmi = QemuIPMI(self.console)
         self.system = None
 
@@ -390,6 +982,7 @@ class OpTestQemu():
                 log.error("OpTestQemu cleanup, ignoring Exception={}"
                           .format(e))
         self.disks = []
+        self.console.cleanup()
 
     def set_system(self, system):
         self.console.system = system
@@ -410,6 +1003,13 @@ class OpTestQemu():
     def power_on(self):
         self.console.connect()
 
+    def restore_snapshot(self, state_name):
+        return self.console.restore_snapshot(state_name)
+
+    def save_snapshot(self, state_name):
+        if self.console.snapshot_wanted():
+            self.console.save_snapshot(state_name)
+
     def get_rest_api(self):
         return None
 
@@ -431,11 +1031,31 @@ class OpTestQemu():
     def has_ipmi_sel(self):
         return False
 
-    def add_temporary_disk(self, size):
-        self.console.close()
+    def run_state(self):
+        return self.console.run_state()
+
+    def add_nic(self, mac):
+        """
+        Hotplugs a NIC, returns False if QEMU is not running
+        """
+        return self.console.hotplug_nic(mac)
 
+    def add_temporary_disk(self, size):
         fd = tempfile.NamedTemporaryFile(delete=True)
         self.disks.append(fd)
         create_hda = subprocess.check_call(["qemu-img", "create",
                                             "-fqcow2", fd.name, size])
+        self.console.disk_sizes[fd.name] = size
+        # hotplug into a running QEMU at a shell where the guest can be seen
+        # to find it, otherwise it is there on the next launch
+        system = self.console.system
+        before = None
+        if system is not None and system.state in [OpTestSystem.OpSystemState.PETITBOOT_SHELL,
+                                                   OpTestSystem.OpSystemState.OS]:
+            before = self.console.guest_disks()
+        if before is None or not self.console.hotplug_disk(fd.name, "qcow2"):
+            self.console.close()
+        elif not self.console.wait_guest_disks(before):
+            log.warning("Qemu hotplugged disk {} not found by the guest, relaunching".format(fd.name))
+            self.console.close()
         self.console.update_disks(self.disks)
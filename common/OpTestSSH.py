@@ -24,6 +24,8 @@ import re
 import sys
 import os
 import time
+import socket
+import threading
 import pexpect
 
 import logging
@@ -32,6 +34,7 @@ log = OpTestLogger.optest_logger_glob.get_logger(__name__)
 
 try:
     import paramiko
+    from .OpTestSSHConnection import drain_channel
     HAS_PARAMIKO = True
 except ImportError:
     HAS_PARAMIKO = False
@@ -51,6 +54,200 @@ class ConsoleState():
     CONNECTED = 1
 
 
+# extra transports opened to one host when sshd refuses more sessions on
+# the ones there are (MaxSessions, 10 by default)
+MAX_DIRECT_TRANSPORTS = 4
+
+
+class DirectTransport():
+    '''
+    Long lived paramiko transports shared by every run_command_direct to the
+    same (host, username, port). Each command gets its own channel, so several
+    threads can run commands over one handshake at the same time. When sshd
+    refuses another session on a transport (MaxSessions) an extra one is
+    opened, up to MAX_DIRECT_TRANSPORTS, then callers wait for a free channel.
+    Dead transports are replaced transparently on the next command, a live
+    one is never closed under the channels other threads have on it.
+    '''
+
+    def __init__(self, host, username, password, port=22, timeout=30):
+        self.host = host
+        self.username = username
+        self.password = password
+        self.port = port
+        self.timeout = timeout
+        self.transports = []
+        # handshakes in progress, they count towards MAX_DIRECT_TRANSPORTS
+        self.connecting = 0
+        # transports that refused a session, until one of their channels ends
+        self.full = set()
+        # channels of background commands, closed once the command exits
+        self.background = []
+        self.lock = threading.Lock()
+        self.stats = {'handshakes': 0,
+                      'handshake_seconds': 0.0,
+                      'reconnects': 0,
+                      'commands': 0,
+                      'command_seconds': 0.0,
+                      'channels_open': 0,
+                      'session_limit_waits': 0}
+
+    def handshake(self):
+        start = time.time()
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        transport = paramiko.Transport(sock)
+        try:
+            transport.start_client(timeout=self.timeout)
+            transport.auth_password(self.username, self.password)
+        except Exception:
+            transport.close()
+            raise
+        transport.set_keepalive(30)
+        self.stats['handshakes'] += 1
+        self.stats['handshake_seconds'] += time.time() - start
+        log.debug("Direct SSH transport to {}@{}:{} up in {:.3f}s".format(
+            self.username, self.host, self.port, time.time() - start))
+        return transport
+
+    def connect(self):
+        '''
+        A live transport with room for another session, None when all of
+        them are full and no more may be opened. The handshake is done
+        without the lock, commands on the other transports go on meanwhile.
+        '''
+        with self.lock:
+            for transport in [t for t in self.transports if not t.is_active()]:
+                # the far end went away (reboot, idle drop)
+                self.stats['reconnects'] += 1
+                self.forget(transport)
+            for transport in self.transports:
+                if transport not in self.full:
+                    return transport
+            if len(self.transports) + self.connecting >= MAX_DIRECT_TRANSPORTS:
+                return None
+            self.connecting += 1
+        try:
+            transport = self.handshake()
+        finally:
+            with self.lock:
+                self.connecting -= 1
+        with self.lock:
+            self.transports.append(transport)
+        return transport
+
+    def forget(self, transport):
+        try:
+            transport.close()
+        except Exception:
+            pass
+        if transport in self.transports:
+            self.transports.remove(transport)
+        self.full.discard(transport)
+
+    def open_session(self):
+        self.reap()
+        deadline = time.time() + self.timeout
+        retried = False
+        while True:
+            transport = self.connect()
+            if transport is None:
+                if time.time() > deadline:
+                    raise paramiko.SSHException("no SSH session free on {} after {}s".format(
+                        self.host, self.timeout))
+                self.stats['session_limit_waits'] += 1
+                time.sleep(0.5)
+                self.reap()
+                continue
+            try:
+                channel = transport.open_session(timeout=self.timeout)
+                break
+            except (paramiko.SSHException, EOFError, socket.error):
+                if transport.is_active():
+                    # sshd refused the session (MaxSessions), paramiko only
+                    # says ChannelException to one of the threads opening
+                    # channels at the time, use another transport or wait
+                    with self.lock:
+                        self.full.add(transport)
+                elif retried:
+                    raise
+                else:
+                    # it died under us, connect() replaces it, one fresh try
+                    retried = True
+        with self.lock:
+            self.stats['channels_open'] += 1
+        return channel
+
+    def done(self, channel, started, close=True):
+        with self.lock:
+            if not close:
+                # closing it would hang up the job, reap() does once it exits
+                self.background.append(channel)
+                return
+            self.stats['channels_open'] -= 1
+            self.stats['commands'] += 1
+            self.stats['command_seconds'] += time.time() - started
+            self.full.discard(channel.get_transport())
+        try:
+            channel.close()
+        except Exception:
+            pass
+
+    def reap(self):
+        '''
+        Closes the channels of background commands that exited.
+        '''
+        with self.lock:
+            finished = [c for c in self.background if c.exit_status_ready() or c.closed]
+            for channel in finished:
+                self.background.remove(channel)
+                self.stats['channels_open'] -= 1
+                self.stats['commands'] += 1
+                self.full.discard(channel.get_transport())
+        for channel in finished:
+            try:
+                channel.close()
+            except Exception:
+                pass
+
+    def close(self):
+        with self.lock:
+            for transport in list(self.transports):
+                self.forget(transport)
+            self.background = []
+
+
+def read_channel(channel, timeout):
+    '''
+    Output of an exec channel once the command exits, as (stdout lines,
+    stderr lines, exit status), raises socket.timeout after timeout seconds.
+    '''
+    output = {'stdout': [], 'stderr': []}
+    drain = drain_channel(channel, timeout)
+    while True:
+        try:
+            stream, text = next(drain)
+        except StopIteration as done:
+            exit_status = done.value
+            break
+        output[stream].append(text)
+    return (''.join(output['stdout']).splitlines(),
+            ''.join(output['stderr']).splitlines(),
+            exit_status)
+
+
+direct_transports = {}
+direct_transports_lock = threading.Lock()
+
+
+def get_direct_transport(host, username, password, port=22):
+    with direct_transports_lock:
+        key = (host, username, port)
+        if key not in direct_transports:
+            direct_transports[key] = DirectTransport(host, username, password, port)
+        direct_transports[key].password = password
+        return direct_transports[key]
+
+
 def set_system_to_UNKNOWN_BAD(system):
     s = system.get_state()
     system.set_state(OpTestSystem.OpSystemState.UNKNOWN_BAD)
@@ -113,32 +310,26 @@ class OpTestSSH():
             log.warning("paramiko not available, falling back to console execution")
             return self.run_command(command, timeout)
         
+        direct = get_direct_transport(self.host, self.username, self.password, self.port)
+        channel = None
         try:
-            # Create SSH client
-            client = paramiko.SSHClient()
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            
-            # Connect
-            client.connect(
-                hostname=self.host,
-                port=self.port,
-                username=self.username,
-                password=self.password,
-                timeout=30,
-                allow_agent=False,
-                look_for_keys=False
-            )
+            # One channel on the shared transport, no new TCP/KEX/auth
+            channel = direct.open_session()
+            started = time.time()
             
             # Execute command
             log.info(f"Executing direct SSH command: {command}")
             # For commands that reboot the system, use a short exec timeout so
             # paramiko doesn't block indefinitely waiting for data on a dead channel.
             exec_timeout = 5 if expect_disconnect else timeout
-            stdin, stdout, stderr = client.exec_command(command, timeout=exec_timeout)
+            channel.settimeout(exec_timeout)
+            channel.exec_command(command)
             background = command.strip().endswith("&")
             if background:
                 log.info("Background command - not waiting")
                 time.sleep(0.5)
+                # leave the channel open, closing it would hang up the job
+                direct.done(channel, started, close=False)
                 return []
             # Get output
             if expect_disconnect:
@@ -146,18 +337,16 @@ class OpTestSSH():
                 # the connection is torn down, then return without waiting.
                 log.info("Command expected to disconnect - not waiting for exit status")
                 time.sleep(1)
-                try:
-                    client.close()
-                except Exception:
-                    pass
+                # only this channel, other threads may be using the transport
+                direct.done(channel, started)
+                channel = None
                 return []
             else:
-                exit_status = stdout.channel.recv_exit_status()
-                output_lines = stdout.read().decode('utf-8', errors='ignore').splitlines()
-                error_lines = stderr.read().decode('utf-8', errors='ignore').splitlines()
+                output_lines, error_lines, exit_status = read_channel(channel, timeout)
             
-            # Close connection
-            client.close()
+            # Hand the channel back, the transport stays up
+            direct.done(channel, started)
+            channel = None
             
             # Log output consolidated for readability
             if output_lines:
@@ -178,12 +367,26 @@ class OpTestSSH():
         except CommandFailed:
             raise
         except Exception as e:
+            if channel is not None:
+                direct.done(channel, started)
             if expect_disconnect:
                 log.info(f"Expected disconnect for '{command}': {e}")
                 return []
             log.error(f"Direct SSH command failed: {e}")
             raise CommandFailed(command, str(e), -1)
 
+    def get_direct_stats(self):
+        '''
+        Handshake and command latency counters of the shared transport used
+        by run_command_direct.
+        '''
+        stats = dict(get_direct_transport(self.host, self.username, self.password, self.port).stats)
+        if stats['handshakes']:
+            stats['handshake_avg'] = stats['handshake_seconds'] / stats['handshakes']
+        if stats['commands']:
+            stats['command_avg'] = stats['command_seconds'] / stats['commands']
+        return stats
+
     def set_system_setup_term(self, flag):
         self.system.block_setup_term = flag
 
@@ -349,3 +552,48 @@ class OpTestSSH():
 
     def run_command_ignore_fail(self, command, timeout=60, retry=0):
         return self.util.run_command_ignore_fail(self, command, timeout, retry)
+
+    def run_commands_batch(self, commands, timeout=600, use_direct_ssh=True):
+        """
+        Execute a list of commands in one round trip.
+
+        While the console shell is not connected there is no sudo, cwd or
+        environment state to keep, so with paramiko the framed script is sent
+        as a single exec_command, stderr merged into the output as on the
+        console. Otherwise it goes over the console like the other console
+        classes.
+
+        Args:
+            commands: List of command strings to execute
+            timeout: Timeout in seconds for the whole batch
+            use_direct_ssh: If False, skip direct SSH and use the console
+
+        Returns:
+            List of (output_lines, exit_code) tuples, one per command
+        """
+        if (use_direct_ssh and HAS_PARAMIKO and commands
+                and self.state == ConsoleState.DISCONNECTED):
+            tags = self.util.batch_tags(commands)
+            script = "{{ {}; }} 2>&1".format(self.util.frame_batch(commands, tags))
+            direct = get_direct_transport(self.host, self.username, self.password, self.port)
+            channel = None
+            try:
+                channel = direct.open_session()
+                started = time.time()
+                channel.exec_command(script)
+            except Exception as e:
+                if channel is not None:
+                    direct.done(channel, started)
+                # nothing ran yet, the console can do it
+                log.warning(f"Direct SSH batch could not start, using the console: {e}")
+                return self.util.run_commands_batch(self, commands, timeout)
+            try:
+                output, errors, exit_status = read_channel(channel, timeout)
+            except Exception as e:
+                # some commands may have run, don't run them again
+                raise CommandFailed("; ".join(commands),
+                                    "direct SSH batch failed: {}".format(e), -1)
+            finally:
+                direct.done(channel, started)
+            return self.util.split_batch_output(commands, '\n'.join(output), tags)
+        return self.util.run_commands_batch(self, commands, timeout)
@@ -24,11 +24,13 @@ Pure SSH connection implementation using paramiko - replaces pexpect-based conne
 This module provides reliable SSH connectivity without the issues of expect patterns.
 """
 
+import codecs
 import paramiko
+import select
 import time
 import socket
 import threading
-from typing import Optional, Tuple, List
+from typing import Optional, Tuple, List, Callable, Iterator
 from datetime import datetime
 
 from .Exceptions import SSHConnectionFailed, SSHCommandFailed, SSHSessionDisconnected
@@ -38,6 +40,61 @@ import logging
 import OpTestLogger
 log = OpTestLogger.optest_logger_glob.get_logger(__name__)
 
+# bytes read from a channel at a time when draining command output
+STREAM_CHUNK_SIZE = 32768
+# default cap on output kept in memory by execute_command_streaming
+STREAM_MAX_BUFFER = 16 * 1024 * 1024
+
+
+def drain_channel(channel: paramiko.Channel, timeout: int,
+                  chunk_size: int = STREAM_CHUNK_SIZE,
+                  idle_timeout: Optional[int] = None) -> Iterator[Tuple[str, str]]:
+    """
+    Read stdout and stderr of an exec channel as they arrive, so neither
+    fills the channel window and stalls the command.
+    
+    Yields ('stdout' | 'stderr', text) and returns the exit code.
+    
+    Raises:
+        socket.timeout: If the command runs longer than timeout seconds,
+            or gives no output for idle_timeout seconds
+    """
+    decoders = {'stdout': codecs.getincrementaldecoder('utf-8')(errors='replace'),
+                'stderr': codecs.getincrementaldecoder('utf-8')(errors='replace')}
+    deadline = time.time() + timeout
+    last_data = time.time()
+    while True:
+        got = False
+        if channel.recv_ready():
+            data = channel.recv(chunk_size)
+            if data:
+                got = True
+                yield 'stdout', decoders['stdout'].decode(data)
+        if channel.recv_stderr_ready():
+            data = channel.recv_stderr(chunk_size)
+            if data:
+                got = True
+                yield 'stderr', decoders['stderr'].decode(data)
+        if got:
+            last_data = time.time()
+            continue
+        if (channel.exit_status_ready() and not channel.recv_ready()
+                and not channel.recv_stderr_ready()):
+            break
+        if channel.eof_received and channel.closed:
+            break
+        if time.time() > deadline:
+            raise socket.timeout()
+        if idle_timeout is not None and time.time() - last_data > idle_timeout:
+            raise socket.timeout()
+        # the channel pipe is signalled by stdout and stderr data and EOF
+        select.select([channel], [], [], 0.1)
+    for name, decoder in decoders.items():
+        tail = decoder.decode(b'', final=True)
+        if tail:
+            yield name, tail
+    return channel.recv_exit_status()
+
 
 class OpTestCommandResult:
     """
@@ -52,10 +109,15 @@ class OpTestCommandResult:
         timestamp (datetime): When the command was executed
         success (bool): True if exit_code == 0
         host (str): Host where command was executed
+        stdout_file (str): File the full stdout was spilled to, if any
+        dropped_bytes (int): Bytes of stdout/stderr not kept in memory
     """
+    __slots__ = ('command', 'exit_code', 'stdout', 'stderr', 'duration',
+                 'timestamp', 'success', 'host', 'stdout_file', 'dropped_bytes')
     
     def __init__(self, command: str, exit_code: int, stdout: str, 
-                 stderr: str, duration: float, host: str):
+                 stderr: str, duration: float, host: str,
+                 stdout_file: Optional[str] = None, dropped_bytes: int = 0):
         self.command = command
         self.exit_code = exit_code
         self.stdout = stdout
@@ -64,6 +126,8 @@ class OpTestCommandResult:
         self.timestamp = datetime.now()
         self.success = (exit_code == 0)
         self.host = host
+        self.stdout_file = stdout_file
+        self.dropped_bytes = dropped_bytes
         
     def __str__(self):
         return (f"CommandResult(cmd='{self.command[:50]}...', "
@@ -275,6 +339,164 @@ class OpTestSSHConnection:
         self.disconnect()
         return self.connect(retry=retry)
     
+    def _open_exec_channel(self, command: str, timeout: int) -> paramiko.Channel:
+        """Open a session channel and start command on it."""
+        with self.lock:
+            if not self.is_alive():
+                log.warning(f"Connection to {self.host} is dead, reconnecting...")
+                self.reconnect()
+            log.debug(f"Executing on {self.host}: {command}")
+            channel = self.transport.open_session(timeout=timeout)
+        channel.settimeout(timeout)
+        # Don't allocate PTY to avoid terminal issues
+        channel.exec_command(command)
+        return channel
+    
+    def iter_command_output(self, command: str, timeout: int = 60,
+                            chunk_size: int = STREAM_CHUNK_SIZE,
+                            idle_timeout: Optional[int] = None) -> Iterator[Tuple[str, object]]:
+        """
+        Execute command and yield its output as it arrives.
+        
+        The connection lock is only held to open the channel, the command
+        runs on a channel of its own, so abandoning the generator (or closing
+        it from another thread) just closes that channel.
+        
+        Args:
+            command: Command to execute
+            timeout: Command timeout in seconds
+            chunk_size: Bytes read from the channel at a time
+            idle_timeout: Also give up after this many seconds without output
+            
+        Yields:
+            ('stdout', text) and ('stderr', text) chunks, then ('exit', exit_code)
+            
+        Raises:
+            SSHSessionDisconnected: If connection is lost
+            SSHCommandFailed: If the command times out
+        
+        Example:
+            >>> for stream, data in conn.iter_command_output('dmesg'):
+            ...     if stream == 'exit':
+            ...         print(f"exit code {data}")
+            ...     else:
+            ...         print(data, end='')
+        """
+        start_time = time.time()
+        channel = None
+        try:
+            channel = self._open_exec_channel(command, timeout)
+            exit_code = yield from drain_channel(channel, timeout, chunk_size,
+                                                  idle_timeout)
+            with self.lock:
+                self.last_activity = datetime.now()
+                self.command_count += 1
+            yield 'exit', exit_code
+        except socket.timeout:
+            duration = time.time() - start_time
+            error_msg = f"Command timeout after {duration:.1f}s: {command}"
+            log.error(error_msg)
+            raise SSHCommandFailed(command, error_msg, -1)
+        except paramiko.SSHException as e:
+            error_msg = f"SSH error executing command: {e}"
+            log.error(error_msg)
+            self.connected = False
+            raise SSHSessionDisconnected(error_msg, e)
+        finally:
+            if channel is not None:
+                channel.close()
+    
+    def execute_command_streaming(self, command: str, timeout: int = 60,
+                                  output_callback: Optional[Callable[[str, str], None]] = None,
+                                  spill_file: Optional[str] = None,
+                                  max_buffer_bytes: Optional[int] = STREAM_MAX_BUFFER,
+                                  check_exit_code: bool = True,
+                                  idle_timeout: Optional[int] = None) -> OpTestCommandResult:
+        """
+        Execute command, draining stdout and stderr as they arrive.
+        
+        Args:
+            command: Command to execute
+            timeout: Command timeout in seconds
+            output_callback: Called with (stream, text) for every chunk,
+                stream being 'stdout' or 'stderr'
+            spill_file: Write all of stdout to this file
+            max_buffer_bytes: Keep at most this much of the end of stdout and
+                of stderr in the result (None keeps everything)
+            check_exit_code: Raise exception if exit code != 0 (default: True)
+            idle_timeout: Also give up after this many seconds without output
+            
+        Returns:
+            OpTestCommandResult: Command execution result, result.dropped_bytes
+            counts what did not fit in max_buffer_bytes
+            
+        Raises:
+            SSHSessionDisconnected: If connection is lost
+            SSHCommandFailed: If command fails and check_exit_code is True
+        """
+        start_time = time.time()
+        buffers = {'stdout': [], 'stderr': []}
+        buffered = {'stdout': 0, 'stderr': 0}
+        dropped = 0
+        exit_code = -1
+        spill = open(spill_file, 'w') if spill_file else None
+        try:
+            for stream, data in self.iter_command_output(command, timeout,
+                                                         idle_timeout=idle_timeout):
+                if stream == 'exit':
+                    exit_code = data
+                    break
+                if output_callback:
+                    output_callback(stream, data)
+                if spill and stream == 'stdout':
+                    spill.write(data)
+                buffers[stream].append(data)
+                buffered[stream] += len(data)
+                # drop whole chunks from the front, keep the most recent output
+                while (max_buffer_bytes is not None and buffered[stream] > max_buffer_bytes
+                       and len(buffers[stream]) > 1):
+                    old = buffers[stream].pop(0)
+                    buffered[stream] -= len(old)
+                    dropped += len(old)
+        finally:
+            if spill:
+                spill.close()
+        
+        stdout_data = ''.join(buffers['stdout'])
+        stderr_data = ''.join(buffers['stderr'])
+        if max_buffer_bytes is not None:
+            dropped += max(0, len(stdout_data) - max_buffer_bytes)
+            dropped += max(0, len(stderr_data) - max_buffer_bytes)
+            stdout_data = stdout_data[max(0, len(stdout_data) - max_buffer_bytes):]
+            stderr_data = stderr_data[max(0, len(stderr_data) - max_buffer_bytes):]
+        
+        if dropped:
+            log.debug(f"Kept the last {max_buffer_bytes} bytes of output, dropped {dropped}"
+                      + (f", full stdout in {spill_file}" if spill_file else ""))
+        
+        result = OpTestCommandResult(
+            command=command,
+            exit_code=exit_code,
+            stdout=stdout_data,
+            stderr=stderr_data,
+            duration=time.time() - start_time,
+            host=self.host,
+            stdout_file=spill_file,
+            dropped_bytes=dropped
+        )
+        
+        log.debug(f"Command completed: {result}")
+        
+        # Check exit code if requested
+        if check_exit_code and exit_code != 0:
+            error_msg = (f"Command failed on {self.host}: {command}\n"
+                        f"Exit code: {exit_code}\n"
+                        f"Stderr: {stderr_data}")
+            log.error(error_msg)
+            raise SSHCommandFailed(command, stderr_data, exit_code)
+        
+        return result
+    
     def execute_command(self, command: str, timeout: int = 60, 
                        check_exit_code: bool = True) -> OpTestCommandResult:
         """
@@ -292,75 +514,16 @@ class OpTestSSHConnection:
             SSHSessionDisconnected: If connection is lost
             SSHCommandFailed: If command fails and check_exit_code is True
         """
-        with self.lock:
-            # Ensure connection is alive
-            if not self.is_alive():
-                log.warning(f"Connection to {self.host} is dead, reconnecting...")
-                self.reconnect()
-            
-            start_time = time.time()
-            
-            try:
-                log.debug(f"Executing on {self.host}: {command}")
-                
-                # Execute command
-                stdin, stdout, stderr = self.client.exec_command(
-                    command,
-                    timeout=timeout,
-                    get_pty=False  # Don't allocate PTY to avoid terminal issues
-                )
-                
-                # Wait for command completion and get exit code
-                exit_code = stdout.channel.recv_exit_status()
-                
-                # Read output
-                stdout_data = stdout.read().decode('utf-8', errors='replace')
-                stderr_data = stderr.read().decode('utf-8', errors='replace')
-                
-                duration = time.time() - start_time
-                
-                # Update stats
-                self.last_activity = datetime.now()
-                self.command_count += 1
-                
-                # Create result object
-                result = OpTestCommandResult(
-                    command=command,
-                    exit_code=exit_code,
-                    stdout=stdout_data,
-                    stderr=stderr_data,
-                    duration=duration,
-                    host=self.host
-                )
-                
-                log.debug(f"Command completed: {result}")
-                
-                # Check exit code if requested
-                if check_exit_code and exit_code != 0:
-                    error_msg = (f"Command failed on {self.host}: {command}\n"
-                                f"Exit code: {exit_code}\n"
-                                f"Stderr: {stderr_data}")
-                    log.error(error_msg)
-                    raise SSHCommandFailed(command, stderr_data, exit_code)
-                
-                return result
-                
-            except socket.timeout:
-                duration = time.time() - start_time
-                error_msg = f"Command timeout after {duration:.1f}s: {command}"
-                log.error(error_msg)
-                raise SSHCommandFailed(command, error_msg, -1)
-                
-            except paramiko.SSHException as e:
-                error_msg = f"SSH error executing command: {e}"
-                log.error(error_msg)
-                self.connected = False
-                raise SSHSessionDisconnected(error_msg, e)
-                
-            except Exception as e:
-                error_msg = f"Unexpected error executing command: {e}"
-                log.error(error_msg)
-                raise SSHCommandFailed(command, str(e), -1)
+        try:
+            return self.execute_command_streaming(command, timeout,
+                                                  max_buffer_bytes=None,
+                                                  check_exit_code=check_exit_code)
+        except (SSHCommandFailed, SSHSessionDisconnected):
+            raise
+        except Exception as e:
+            error_msg = f"Unexpected error executing command: {e}"
+            log.error(error_msg)
+            raise SSHCommandFailed(command, str(e), -1)
     
     def execute_command_ignore_fail(self, command: str, 
                                    timeout: int = 60) -> OpTestCommandResult:
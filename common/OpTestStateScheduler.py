@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# OpenPOWER Automated Test Project
+#
+# Contributors Listed Below - COPYRIGHT 2026
+# [+] International Business Machines Corp.
+#
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+'''
+Boot State Scheduler
+--------------------
+Reorders a test suite so tests that need the same OpSystemState run
+together, keeping the number of IPLs and reboots down (--schedule-by-state).
+
+A testcase declares what it needs with class attributes:
+
+  class MyTest(unittest.TestCase):
+      required_state = OpSystemState.PETITBOOT_SHELL
+      leaves_dirty = True   # e.g. changes NVRAM, next test wants a fresh IPL
+
+Without `required_state` the state is read from the goto_state() calls in
+the testcase source, when they all go to the same state. Without
+`leaves_dirty` a test is taken to leave the system dirty when its source
+powers off, resets or crashes the system (set_state(), sys_power_*,
+ipmi_power_*, sysrq-trigger).
+`required_state = None`, or a testcase moving between states by itself, pins
+the test where it is: tests are only reordered between such pinned tests, so
+installs, flashing and boot torture tests still happen in suite order.
+
+Within a group, clean tests go before the ones leaving the system dirty.
+The estimated transition time of the original and the new order and the
+transitions that actually happened are logged and written to
+state-schedule.json in the output directory.
+'''
+
+import inspect
+import itertools
+import json
+import os
+import re
+import unittest
+
+from common.OpTestSystem import OpSystemState, state_names
+
+import OpTestLogger
+log = OpTestLogger.optest_logger_glob.get_logger(__name__)
+
+# pseudo state after a test that leaves the system dirty
+DIRTY = -1
+
+# estimated seconds of the state machine steps
+POWER_OFF_SECONDS = 60
+IPL_SECONDS = 600
+OS_BOOT_SECONDS = 300
+SHELL_SECONDS = 5
+
+# most groups in a segment ordered exhaustively, larger ones greedily
+EXHAUSTIVE_GROUPS = 6
+
+skiroot_states = [OpSystemState.PETITBOOT, OpSystemState.PETITBOOT_SHELL]
+goto_state_call = re.compile(r"goto_state\(\s*OpSystemState\.(\w+)\s*\)")
+# subclasses of the shared skiroot/host testcases pick their state with
+# self.test = "skiroot", cls.desired = OpSystemState.X or desired=OpSystemState.X
+desired_state = re.compile(r"\bdesired\s*=\s*OpSystemState\.(\w+)")
+test_flavour = re.compile(r"\.test\s*=\s*[\"'](skiroot|host)[\"']")
+flavour_states = {"skiroot": "PETITBOOT_SHELL", "host": "OS"}
+# power off, reset or crash the system behind the state machine's back
+dirtying_calls = re.compile(r"set_state\(|sys_power_|ipmi_power_|sysrq-trigger")
+
+
+def transition_seconds(current, target):
+    '''
+    Estimated seconds to get from state current to state target.
+    '''
+    if current == target:
+        return 0
+    if target == OpSystemState.OFF:
+        return POWER_OFF_SECONDS
+    if current in skiroot_states and target in skiroot_states:
+        return SHELL_SECONDS
+    if current in skiroot_states and target == OpSystemState.OS:
+        return OS_BOOT_SECONDS
+    # anything else goes through an IPL, powering off first unless off
+    seconds = IPL_SECONDS
+    if current != OpSystemState.OFF:
+        seconds += POWER_OFF_SECONDS
+    if target == OpSystemState.OS:
+        seconds += OS_BOOT_SECONDS
+    return seconds
+
+
+def flatten(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            for t in flatten(test):
+                yield t
+        else:
+            yield test
+
+
+def source_states(cls):
+    '''
+    States the testcase class goes to, from the goto_state() calls (or the
+    skiroot/host choice) in the source of the most derived class that has
+    any.
+    '''
+    for klass in inspect.getmro(cls):
+        if klass in (unittest.TestCase, object):
+            continue
+        try:
+            source = inspect.getsource(klass)
+        except (OSError, TypeError):
+            continue
+        states = set(desired_state.findall(source))
+        states.update(flavour_states[f] for f in test_flavour.findall(source))
+        if not states:
+            states = set(goto_state_call.findall(source))
+        if states:
+            return states
+    return set()
+
+
+def source_dirties(cls):
+    '''
+    True when the source of the testcase class, or a class it derives
+    from, powers off, resets or crashes the system.
+    '''
+    for klass in inspect.getmro(cls):
+        if klass in (unittest.TestCase, object):
+            continue
+        try:
+            if dirtying_calls.search(inspect.getsource(klass)):
+                return True
+        except (OSError, TypeError):
+            continue
+    return False
+
+
+def test_requirements(test):
+    '''
+    (state, leaves dirty) of a test, state None for tests that must not
+    be moved.
+    '''
+    if not isinstance(test, unittest.TestCase):
+        return None, True
+    cls = type(test)
+    if hasattr(cls, 'leaves_dirty'):
+        dirty = cls.leaves_dirty
+    else:
+        dirty = source_dirties(cls)
+    if hasattr(cls, 'required_state'):
+        return cls.required_state, dirty
+    states = source_states(cls)
+    if len(states) == 1:
+        return getattr(OpSystemState, states.pop(), None), dirty
+    return None, True
+
+
+def sequence_seconds(start, steps):
+    '''
+    Estimated transition seconds for running steps, (state, dirty) pairs,
+    from state start.
+    '''
+    seconds = 0
+    current = start
+    for state, dirty in steps:
+        if state is None:
+            current = DIRTY
+            continue
+        seconds += transition_seconds(current, state)
+        current = DIRTY if dirty else state
+    return seconds
+
+
+class OpTestStateScheduler(object):
+    '''
+    Reorders suites by required state and reports the time saved.
+    '''
+
+    def __init__(self, start_state=OpSystemState.UNKNOWN, output=None):
+        self.start_state = start_state
+        self.output = output
+        self.original = []
+        self.scheduled = []
+        self.estimate_original = 0
+        self.estimate_scheduled = 0
+
+    def order_groups(self, current, groups):
+        '''
+        Group order with the least estimated transition time, ties go to
+        the order the groups first appeared in.
+        '''
+        def cost(order):
+            steps = []
+            for state in order:
+                clean, dirty = groups[state]
+                steps += [(state, False)] * len(clean) + [(state, True)] * len(dirty)
+            return sequence_seconds(current, steps)
+
+        states = list(groups)
+        if len(states) <= EXHAUSTIVE_GROUPS:
+            return min(itertools.permutations(states), key=cost)
+        order = []
+        while states:
+            state = min(states, key=lambda s: transition_seconds(current, s))
+            states.remove(state)
+            order.append(state)
+            current = DIRTY if groups[state][1] else state
+        return order
+
+    def schedule_segment(self, current, segment):
+        groups = {}
+        for test, state, dirty in segment:
+            groups.setdefault(state, ([], []))[1 if dirty else 0].append((test, state, dirty))
+        ordered = []
+        for state in self.order_groups(current, groups):
+            clean, dirty = groups[state]
+            ordered += clean + dirty
+        return ordered
+
+    def schedule(self, suite):
+        '''
+        Returns a new flat TestSuite with the tests of suite reordered.
+        '''
+        tests = [(test,) + test_requirements(test) for test in flatten(suite)]
+        self.original = tests
+        scheduled = []
+        segment = []
+        current = self.start_state
+        for entry in tests:
+            if entry[1] is None:
+                scheduled += self.schedule_segment(current, segment)
+                scheduled.append(entry)
+                segment = []
+                current = DIRTY
+            else:
+                segment.append(entry)
+        scheduled += self.schedule_segment(current, segment)
+        self.scheduled = scheduled
+
+        self.estimate_original = sequence_seconds(
+            self.start_state, [(state, dirty) for test, state, dirty in tests])
+        self.estimate_scheduled = sequence_seconds(
+            self.start_state, [(state, dirty) for test, state, dirty in scheduled])
+        moved = len([1 for a, b in zip(tests, scheduled) if a[0] is not b[0]])
+        log.info("State scheduler: {} tests, {} pinned, {} moved, estimated transitions"
+                 " {:.0f}s -> {:.0f}s (saves ~{:.0f} minutes)".format(
+                     len(tests), len([1 for t in tests if t[1] is None]), moved,
+                     self.estimate_original, self.estimate_scheduled,
+                     (self.estimate_original - self.estimate_scheduled) / 60))
+        for test, state, dirty in scheduled:
+            log.debug("State scheduler: {:16} {:5} {}".format(
+                state_names.get(state, "pinned"), "dirty" if dirty else "", test.id()))
+        return unittest.TestSuite([test for test, state, dirty in scheduled])
+
+    def report(self, system):
+        '''
+        Logs the transitions the run actually made next to the estimates,
+        system is the OpTestSystem the tests ran on.
+        '''
+        transitions = list(getattr(system, 'transitions', []))
+        actual = sum(seconds for a, b, seconds in transitions)
+        log.info("State scheduler: {} transitions took {:.0f}s, estimated {:.0f}s for this order"
+                 " and {:.0f}s for the original order (saved ~{:.0f} minutes)".format(
+                     len(transitions), actual, self.estimate_scheduled,
+                     self.estimate_original, (self.estimate_original - actual) / 60))
+        if not self.output:
+            return
+        try:
+            with open(os.path.join(self.output, "state-schedule.json"), 'w') as f:
+                json.dump({"estimate_original": self.estimate_original,
+                           "estimate_scheduled": self.estimate_scheduled,
+                           "actual": round(actual, 3),
+                           "transitions": [{"from": state_names.get(a, a),
+                                            "to": state_names.get(b, b),
+                                            "seconds": round(seconds, 3)}
+                                           for a, b, seconds in transitions],
+                           "order": [{"test": test.id(),
+                                      "state": state_names.get(state, None),
+                                      "dirty": dirty}
+                                     for test, state, dirty in self.scheduled]},
+                          f, indent=2)
+        except Exception as e:
+            log.warning("Unable to write the state schedule to {}: {}".format(self.output, e))
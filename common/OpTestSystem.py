@@ -50,6 +50,8 @@ from .OpTestSSH import ConsoleState as SSHConnectionState
 from .Exceptions import HostbootShutdown, WaitForIt, RecoverFailed, UnknownStateTransition
 from .Exceptions import ConsoleSettings, UnexpectedCase, StoppingSystem, HTTPCheck
 from .OpTestSSH import OpTestSSH
+from .OpTestConsoleWatcher import OpConsoleWatcher
+from .OpTestBootTimeline import OpBootTimeline
 
 import logging
 import OpTestLogger
@@ -72,6 +74,10 @@ class OpSystemState():
     UNKNOWN_BAD = 8  # special case, use set_state to place system in hold for later goto
 
 
+# OpSystemState value to name, for logging and the boot timeline
+state_names = {v: k for k, v in vars(OpSystemState).items() if not k.startswith('_')}
+
+
 class OpTestSystem(object):
 
     # Initialize this object
@@ -113,6 +119,12 @@ class OpTestSystem(object):
         self.block_setup_term = 0
         self.stop = 0
         self.ignore = 0
+        # per run timeline of state transitions and boot milestones
+        self.boot_timeline = OpBootTimeline(getattr(conf, 'output', None))
+        # reader of the current console connection, see watch_console()
+        self.console_watcher = None
+        # (from state, to state, seconds) of every goto_state that moved
+        self.transitions = []
 
         # string to define petitboot kernel cat /proc/version column 3, change if using debug petitboot kernel
         self.openpower = 'openpower'
@@ -212,6 +224,7 @@ class OpTestSystem(object):
         for key in default_vals:
             if key not in list(kwargs.keys()):
                 kwargs[key] = default_vals[key]
+        self.boot_timeline.milestone('login_callback', kwargs['value'])
         log.warning(
             "\n\n *** OpTestSystem found the login prompt \"{}\" but this is unexpected, we will retry\n\n".format(kwargs['value']))
         # raise the WaitForIt exception to be bubbled back to recycle early rather than having to wait the full loop_max
@@ -223,6 +236,7 @@ class OpTestSystem(object):
         for key in default_vals:
             if key not in list(kwargs.keys()):
                 kwargs[key] = default_vals[key]
+        self.boot_timeline.milestone('petitboot_callback', kwargs['value'])
         log.warning(
             "\n\n *** OpTestSystem found the petitboot prompt \"{}\" but this is unexpected, we will retry\n\n".format(kwargs['value']))
         # raise the WaitForIt exception to be bubbled back to recycle early rather than having to wait the full loop_max
@@ -307,6 +321,7 @@ class OpTestSystem(object):
         for key in default_vals:
             if key not in list(kwargs.keys()):
                 kwargs[key] = default_vals[key]
+        self.boot_timeline.milestone('skiboot_callback', kwargs['value'])
         self.sys_sel_elist(dump=True)
         skiboot_exception = UnexpectedCase(
             state=self.state, message="We hit the skiboot_callback value={}, manually restart the system".format(kwargs['value']))
@@ -370,6 +385,7 @@ class OpTestSystem(object):
                 and state in [OpSystemState.IPLing, OpSystemState.PETITBOOT, OpSystemState.PETITBOOT_SHELL]:
             raise unittest.SkipTest(
                 "OpTestSystem running HMC so skipping OpSystemState.[IPLing|PETITBOOT|PETITBOOT_SHELL] test")
+        goto_start = time.time()
         if (self.state == OpSystemState.UNKNOWN):
             log.debug(
                 "OpTestSystem CHECKING CURRENT STATE and TRANSITIONING for TARGET STATE: %s" % (state))
@@ -378,6 +394,23 @@ class OpTestSystem(object):
 
         log.debug("OpTestSystem START STATE: %s (target %s)" %
                   (self.state, state))
+        self.boot_timeline.state(state_names.get(self.state, self.state),
+                                 detail="goto_state target {}".format(state_names.get(state, state)))
+        goto_from = self.state
+        try:
+            self.run_state_handlers(state)
+        finally:
+            self.boot_timeline.write()
+        if goto_from != state:
+            self.transitions.append((goto_from, state, time.time() - goto_start))
+
+        # If we haven't checked for dangerous NVRAM options yet and
+        # checking won't disrupt the test, do so now.
+        if self.conf.nvram_debug_opts is None and state in [OpSystemState.PETITBOOT_SHELL, OpSystemState.OS]:
+            if not isinstance(self.console, OpTestHMC.HMCConsole):
+                self.util.check_nvram_options(self.console)
+
+    def run_state_handlers(self, state):
         never_unknown = False
         while 1:
             if self.stop == 1:
@@ -386,9 +419,15 @@ class OpTestSystem(object):
             self.block_setup_term = 1
             if self.state != OpSystemState.UNKNOWN:
                 never_unknown = True
-            self.state = self.stateHandlers[self.state](state)
+            handler = self.stateHandlers[self.state]
+            handler_start = time.time()
+            self.state = handler(state)
+            self.boot_timeline.state(state_names.get(self.state, self.state),
+                                     detail=handler.__name__, seconds=time.time() - handler_start)
             # transition from states invalidate the previous PS1 setting, so clear it
             if self.previous_state != self.state:
+                OpTestLogger.optest_logger_glob.console_mark(
+                    "state", state=state_names.get(self.state, self.state))
                 self.util.clear_system_state(self)
                 self.util.clear_state(self)
                 self.previous_state = self.state
@@ -401,12 +440,6 @@ class OpTestSystem(object):
                                              message=("OpTestSystem something set the system to UNKNOWN,"
                                                       " check the logs for details, we will be stopping the system"))
 
-        # If we haven't checked for dangerous NVRAM options yet and
-        # checking won't disrupt the test, do so now.
-        if self.conf.nvram_debug_opts is None and state in [OpSystemState.PETITBOOT_SHELL, OpSystemState.OS]:
-            if not isinstance(self.console, OpTestHMC.HMCConsole):
-                self.util.check_nvram_options(self.console)
-
     def run_DETECT(self, target_state):
         self.detect_counter += 1
         detect_state = OpSystemState.UNKNOWN
@@ -630,6 +663,26 @@ class OpTestSystem(object):
         else:  # TIMEOUT EOF from cat
             return OpSystemState.UNKNOWN
 
+    def watch_console(self, sys_pty, matchers):
+        '''
+        The console watcher of the sys_pty connection, reading on for
+        matchers. One watcher is kept per console connection and reused by
+        every wait on it, a new connection gets a new one.
+        '''
+        watcher = self.console_watcher
+        if watcher is not None and watcher.pty is sys_pty and watcher.is_alive():
+            watcher.resume(matchers)
+            return watcher
+        if watcher is not None:
+            watcher.console_terminate()
+        watcher = OpConsoleWatcher(sys_pty, name="wait_for_it")
+        for key in matchers:
+            watcher.register(key)
+        watcher.add_line_listener(self.boot_timeline.console_line)
+        watcher.start()
+        self.console_watcher = watcher
+        return watcher
+
     def wait_for_it(self, **kwargs):
         default_vals = {'expect_dict': None, 'refresh': 1, 'buffer_kicker': 1, 'loop_max': 8,
                         'threshold': 1, 'reconnect': 1, 'fresh_start': 1, 'last_try': 1, 'timeout': 5}
@@ -648,77 +701,87 @@ class OpTestSystem(object):
         # check console type and pass 5 to skip SMS menu when booting an LPAR
         if isinstance(self.console, OpTestHMC.HMCConsole):
             sys_pty.sendline('5')
+            sys_pty.sendline()
         # we do not perform buffer_kicker here since it can cause changes to things like the petitboot menu and default boot
         if kwargs['refresh']:
             sys_pty.sendcontrol('l')
-        previous_before = 'emptyfirst'
-        x = 1
+        # the console watcher reacts as soon as a string shows up, loop_max and
+        # timeout now only bound the total wait, threshold * timeout seconds
+        # without any console data is what counts as a stale connection
+        budget = kwargs['loop_max'] * kwargs['timeout']
+        stale = kwargs['threshold'] * kwargs['timeout']
+        wait_start = time.time()
         reconnect_count = 0
-        timeout_count = 1
-        while (x <= kwargs['loop_max']):
-            sys_pty = self.console.get_console()  # preemptive in case EOF came
-            # check console type and pass 5 to skip SMS menu when booting an LPAR
-            if isinstance(self.console, OpTestHMC.HMCConsole) and x == 1:
-                sys_pty.sendline('5')
-                sys_pty.sendline()
-                time.sleep(80)
-            r = sys_pty.expect(expect_seq, kwargs['timeout'])
-            # if we have a stale buffer and we are still timing out
-            if (previous_before == sys_pty.before) and ((r + 1) in range(len(base_seq))):
-                timeout_count += 1
-                # only attempt reconnect if we've timed out per threshold
-                if (timeout_count % kwargs['threshold'] == 0):
-                    if kwargs['reconnect']:
-                        reconnect_count += 1
-                        try:
-                            sys_pty = self.console.connect()
-                        except Exception as e:
-                            log.error(e)
-                        if kwargs['refresh']:
-                            sys_pty.sendcontrol('l')
-                        if kwargs['buffer_kicker']:
-                            sys_pty.sendline("\r")
-                            sys_pty.expect("\n")
-                    previous_before = 'emptyagain'
+        x = 1
+        while (time.time() - wait_start) < budget:
+            watcher = self.watch_console(sys_pty, expect_seq[len(base_seq):])
+            event = None
+            try:
+                while event is None and (time.time() - wait_start) < budget:
+                    event = watcher.wait(kwargs['timeout'])
+                    if event is None and kwargs['reconnect'] and watcher.idle() >= stale:
+                        break
+            finally:
+                # the pty is ours again until the next wait resumes the watcher
+                watcher.pause()
+            if event is None:
+                if (time.time() - wait_start) >= budget:
+                    break
+                # nothing at all on the console for a while, the connection may be gone
+                reconnect_count += 1
+                log.debug("\n *** WaitForIt CURRENT STATE \"{:02}\" TARGET STATE \"{:02}\"\n"
+                          " *** WaitForIt no console data for \"{:.0f}\" seconds, reconnect attempt \"{:02}\"\n"
+                          " *** WaitForIt variables \"{}\"\n".format(self.state, self.target_state, watcher.idle(),
+                                                                   reconnect_count, sorted(kwargs['expect_dict'].keys())))
+                try:
+                    sys_pty = self.console.connect()
+                except Exception as e:
+                    log.error(e)
+                    sys_pty = self.console.get_console()
+                if kwargs['refresh']:
+                    sys_pty.sendcontrol('l')
+                if kwargs['buffer_kicker']:
+                    sys_pty.sendline("\r")
+                    sys_pty.expect("\n")
+                continue
+            if event.exception is not None:
+                raise event.exception
+            if event.index == -1:
+                r = base_seq.index(pexpect.EOF)
             else:
-                previous_before = sys_pty.before
-                timeout_count = 1
-
+                r = event.index + len(base_seq)
             working_r = self.check_it(my_r=r, check_base_seq=base_seq,
                                       check_expect_seq=expect_seq, check_expect_dict=kwargs['expect_dict'])
             # if we found a hit on the callers string return it, otherwise keep looking
             if working_r != -1:
+                self.boot_timeline.milestone(event.value, detail="{:.3f}".format(event.when - wait_start))
+                log.info("OpTestSystem state \"{:02}\" target \"{:02}\" detected \"{}\" {:.2f} seconds into the wait,"
+                         " {:.3f} seconds after it reached the console, reconnects \"{:02}\""
+                         .format(self.state, self.target_state, event.value, event.when - wait_start,
+                                 time.time() - event.when, reconnect_count))
                 return working_r, reconnect_count
-            else:
-                x += 1
-                log.debug("\n *** WaitForIt CURRENT STATE \"{:02}\" TARGET STATE \"{:02}\"\n"
-                          " *** WaitForIt working on transition\n"
-                          " *** Expect Buffer ID={}\n"
-                          " *** Current loop iteration \"{:02}\"             - Reconnect attempts \"{:02}\" - loop_max \"{:02}\"\n"
-                          " *** WaitForIt timeout interval \"{:02}\" seconds - Stale buffer check every \"{:02}\" times\n"
-                          " *** WaitForIt variables \"{}\"\n"
-                          " *** WaitForIt Refresh=\"{}\" Buffer Kicker=\"{}\" - Kill Cord=\"{:02}\"\n".format(self.state, self.target_state,
-                                                                                                              hex(id(
-                                                                                                                  sys_pty)), x, reconnect_count, kwargs['loop_max'], kwargs['timeout'], kwargs['threshold'],
-                                                                                                              sorted(kwargs['expect_dict'].keys()), kwargs['refresh'], kwargs['buffer_kicker'], self.kill_cord))
-            if (x >= kwargs['loop_max']):
-                if kwargs['last_try']:
-                    sys_pty = self.console.connect()
-                    sys_pty.sendcontrol('l')
-                    sys_pty.sendline("\r")
-                    r = sys_pty.expect(expect_seq, kwargs['timeout'])
-                    try:
-                        last_try_r = self.check_it(my_r=r, check_base_seq=base_seq, check_expect_seq=expect_seq,
-                                                   check_expect_dict=kwargs['expect_dict'])
-                        if last_try_r != -1:
-                            return last_try_r, reconnect_count
-                        else:
-                            raise WaitForIt(
-                                expect_dict=kwargs['expect_dict'], reconnect_count=reconnect_count)
-                    except Exception as e:
-                        raise e
-                raise WaitForIt(
-                    expect_dict=kwargs['expect_dict'], reconnect_count=reconnect_count)
+            x += 1
+            log.debug("\n *** WaitForIt CURRENT STATE \"{:02}\" TARGET STATE \"{:02}\"\n"
+                      " *** WaitForIt working on transition\n"
+                      " *** Expect Buffer ID={}\n"
+                      " *** Current event \"{:02}\"             - Reconnect attempts \"{:02}\" - budget \"{:.0f}\" seconds\n"
+                      " *** WaitForIt variables \"{}\"\n"
+                      " *** WaitForIt Refresh=\"{}\" Buffer Kicker=\"{}\" - Kill Cord=\"{:02}\"\n".format(self.state, self.target_state,
+                                                                                                          hex(id(sys_pty)), x, reconnect_count, budget,
+                                                                                                          sorted(kwargs['expect_dict'].keys()), kwargs['refresh'],
+                                                                                                          kwargs['buffer_kicker'], self.kill_cord))
+            sys_pty = self.console.get_console()  # EOF closed the console
+        if kwargs['last_try']:
+            sys_pty = self.console.connect()
+            sys_pty.sendcontrol('l')
+            sys_pty.sendline("\r")
+            r = sys_pty.expect(expect_seq, kwargs['timeout'])
+            last_try_r = self.check_it(my_r=r, check_base_seq=base_seq, check_expect_seq=expect_seq,
+                                       check_expect_dict=kwargs['expect_dict'])
+            if last_try_r != -1:
+                return last_try_r, reconnect_count
+        raise WaitForIt(
+            expect_dict=kwargs['expect_dict'], reconnect_count=reconnect_count)
 
     def check_it(self, **kwargs):
         default_vals = {'my_r': None, 'check_base_seq': None,
@@ -1792,6 +1855,26 @@ class OpTestQemuSystem(OpTestSystem):
     def sys_power_on(self):
         self.bmc.power_on()
 
+    def run_OFF(self, state):
+        # with --qemu-snapshot-dir go straight to a saved Petitboot shell
+        if state in [OpSystemState.PETITBOOT, OpSystemState.PETITBOOT_SHELL] \
+                and self.bmc.restore_snapshot("PETITBOOT_SHELL"):
+            if self.get_petitboot_prompt() == 1:
+                return OpSystemState.PETITBOOT_SHELL
+            log.warning("OpTestSystem Qemu snapshot restored but no Petitboot shell, removing it and IPLing")
+            self.bmc.power_off()
+            self.console.invalidate_snapshot()
+        return super(OpTestQemuSystem, self).run_OFF(state)
+
+    def run_IPLing(self, state):
+        new_state = super(OpTestQemuSystem, self).run_IPLing(state)
+        if new_state == OpSystemState.PETITBOOT and self.console.snapshot_wanted():
+            # snapshot the shell on arrival, before any test has used it
+            self.petitboot_exit_to_shell()
+            self.bmc.save_snapshot("PETITBOOT_SHELL")
+            return OpSystemState.PETITBOOT_SHELL
+        return new_state
+
     def get_my_ip_from_host_perspective(self):
         return "10.0.2.2"
 
@@ -1834,6 +1917,28 @@ class OpTestMamboSystem(OpTestSystem):
     def sys_power_on(self):
         self.bmc.power_on()
 
+    def run_OFF(self, state):
+        # with --mambo-checkpoint-dir go straight to a checkpointed Petitboot shell
+        if state in [OpSystemState.PETITBOOT, OpSystemState.PETITBOOT_SHELL] \
+                and self.bmc.restore_checkpoint("PETITBOOT_SHELL"):
+            if self.get_petitboot_prompt() == 1:
+                self.bmc.reached("PETITBOOT_SHELL")
+                return OpSystemState.PETITBOOT_SHELL
+            log.warning("OpTestSystem Mambo checkpoint restored but no Petitboot shell, removing it and booting")
+            self.bmc.power_off()
+            self.console.invalidate_checkpoint()
+        return super(OpTestMamboSystem, self).run_OFF(state)
+
+    def run_IPLing(self, state):
+        new_state = super(OpTestMamboSystem, self).run_IPLing(state)
+        if new_state == OpSystemState.PETITBOOT:
+            if self.console.checkpoint_wanted():
+                # checkpoint the shell on arrival, before any test has used it
+                self.petitboot_exit_to_shell()
+                new_state = OpSystemState.PETITBOOT_SHELL
+            self.bmc.reached(state_names[new_state])
+        return new_state
+
     def get_my_ip_from_host_perspective(self):
         return None
 
@@ -40,6 +40,7 @@ except ModuleNotFoundError:
     telnetlib = None
 import socket
 import select
+import threading
 import time
 import pty
 import pexpect
@@ -47,6 +48,7 @@ import subprocess
 import requests
 import traceback
 from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 #from requests.packages.urllib3.util import Retry
 from http.client import HTTPConnection
 # HTTPConnection.debuglevel = 1 # this will print some additional info to stdout
@@ -68,6 +70,24 @@ log = OpTestLogger.optest_logger_glob.get_logger(__name__)
 sudo_responses = ["not in the sudoers",
                   "incorrect password"]
 
+# commands which change the shell or its environment under us, these cannot
+# be wrapped with frame markers so try_command falls back to echo $?
+unframed_commands = ["sudo -s",
+                     "sudo su",
+                     "su ",
+                     "exec ",
+                     "exit",
+                     "logout"]
+
+# the markers are split with quotes on the command line so the echo of the
+# command itself never matches, only the output of the shell does
+FRAME_START = "__OPTS_{}__"
+FRAME_END = "__OPTE_{}__"
+# run_commands_batch splits its script into lines of at most this many
+# characters, the tty canonical line limit is 4096
+BATCH_LINE_MAX = 2048
+BATCH_FRAME_LEN = len("echo '__OPTS''_00000000_000__'; ; echo '__OPTE''_00000000_000__:'$?; ")
+
 
 class OpTestUtil():
 
@@ -2078,6 +2098,194 @@ class OpTestUtil():
                              " this will be retry \"{:02}\" of a total of \"{:02}\"\n \n".format(counter, retry))
 
     def try_command(self, term_obj, command, timeout=60):
+        if self.use_command_frames(term_obj, command):
+            return self.try_framed_command(term_obj, command, timeout)
+        return self.try_echo_command(term_obj, command, timeout)
+
+    def use_command_frames(self, term_obj, command):
+        # frame markers need a POSIX shell that will take a one line
+        # compound command, fall back to the echo $? round trip otherwise
+        if not getattr(term_obj, 'command_frames', True):
+            return False
+        # OpTestSystem imports this module, import at call time
+        from .OpTestSystem import OpSystemState
+        system = getattr(term_obj, 'system', None)
+        if system is not None and system.state == OpSystemState.PETITBOOT_SHELL:
+            return False
+        stripped = command.strip()
+        if not stripped or "\n" in command:
+            return False
+        if any(stripped.startswith(x) for x in unframed_commands):
+            return False
+        # background jobs, continuations, pipes and comments would swallow
+        # or detach the trailing end marker
+        if stripped.rstrip(';').rstrip().endswith(('&', '|', '\\')):
+            return False
+        if re.search(r'(^|\s)#', stripped):
+            return False
+        return True
+
+    def frame_command(self, command, tag):
+        # returns the command line to send, wrapped with start/end markers,
+        # the end marker carries the exit code of the command
+        command = command.strip().rstrip(';').rstrip()
+        start = FRAME_START.format(tag)
+        end = FRAME_END.format(tag)
+        return "echo '{}''{}'; {}; echo '{}''{}:'$?".format(
+            start[:6], start[6:], command, end[:6], end[6:])
+
+    def split_framed_output(self, command, before, tag):
+        # splits the raw buffer ahead of the end marker into the command
+        # output, anything seen before the start marker other than the echo
+        # of the command line is stray output left over between commands
+        lines = before.replace("\r\r\n", "\n").splitlines()
+        start = FRAME_START.format(tag)
+        for index, line in enumerate(lines):
+            if line.strip() == start:
+                stray = [x for x in lines[:index] if x.strip() and tag not in x]
+                if stray:
+                    log.warning("OpTestSystem detected stray console output ahead of"
+                                " command \"{}\", ignoring it".format(command))
+                    log.debug("stray output={}".format(stray))
+                return lines[index + 1:]
+        # start marker lost (line noise or a terminal eating it), do the best
+        # we can and just drop the echo of the command line
+        log.debug("Frame start marker missing for command \"{}\"".format(command))
+        return [x for x in lines if tag not in x]
+
+    def try_framed_command(self, term_obj, command, timeout=60):
+        # one expect gets us the output and the exit code, instead of
+        # following each command with a separate echo $? round trip
+        expect_prompt = term_obj.expect_prompt
+        tag = "{:08x}".format(random.getrandbits(32))
+        end_pattern = FRAME_END.format(tag) + r":(\d+)[\s\S]*?" + expect_prompt
+        pty = term_obj.get_console()
+        pty.sendline(self.frame_command(command, tag))
+        rc = pty.expect([end_pattern, r"[Pp]assword for",
+                         pexpect.TIMEOUT, pexpect.EOF], timeout=timeout)
+        if rc == 0:
+            echo_rc = int(pty.match.group(1))
+            output_list = self.split_framed_output(command, pty.before, tag)
+        elif rc == 1:
+            handle_output_list, echo_rc = self.handle_password(
+                term_obj, pty, command)
+            # remove the expect prompt since matched generic #
+            del handle_output_list[-1]
+            output_list = [x for x in handle_output_list if tag not in x]
+        elif rc == 2:  # timeout
+            output_list, echo_rc = self.try_sendcontrol(term_obj, command)
+        else:
+            term_obj.close()
+            raise CommandFailed(command, "run_command TIMEOUT or EOF, the command timed out or something,"
+                                " probably a connection issue, retry", -1)
+        if echo_rc != 0:
+            raise CommandFailed(command, output_list, echo_rc)
+        return output_list
+
+    def run_commands_batch(self, term_obj, commands, timeout=600):
+        # runs a list of commands sending them as framed scripts, so N short
+        # commands cost about one console round trip instead of 2N
+        # returns a list of (output_list, exit_code) tuples in command order,
+        # non-zero exit codes are returned to the caller, not raised
+        results = []
+        chunk = []
+        chunk_len = 0
+        for command in commands:
+            if not self.use_command_frames(term_obj, command):
+                results += self.try_framed_batch(term_obj, chunk, timeout)
+                chunk = []
+                chunk_len = 0
+                results.append(self.try_command_result(
+                    term_obj, command, timeout))
+                continue
+            # keep each script line well under the tty canonical line limit
+            if chunk and chunk_len + len(command) > BATCH_LINE_MAX:
+                results += self.try_framed_batch(term_obj, chunk, timeout)
+                chunk = []
+                chunk_len = 0
+            chunk.append(command)
+            chunk_len += len(command) + BATCH_FRAME_LEN
+        results += self.try_framed_batch(term_obj, chunk, timeout)
+        return results
+
+    def try_command_result(self, term_obj, command, timeout=60):
+        try:
+            return self.try_command(term_obj, command, timeout), 0
+        except CommandFailed as cf:
+            return cf.output, cf.exitcode
+
+    def frame_batch(self, commands, tags):
+        return "; ".join(self.frame_command(command, tag)
+                         for command, tag in zip(commands, tags))
+
+    def batch_tags(self, commands):
+        base = "{:08x}".format(random.getrandbits(32))
+        return ["{}_{}".format(base, x) for x in range(len(commands))]
+
+    def split_batch_output(self, commands, text, tags):
+        # walks the frame markers of each command in order, a command whose
+        # markers never showed up gets an exit code of -1
+        lines = text.replace("\r\r\n", "\n").splitlines()
+        results = []
+        position = 0
+        for command, tag in zip(commands, tags):
+            start = FRAME_START.format(tag)
+            end = re.compile(re.escape(FRAME_END.format(tag)) + r":(\d+)")
+            first = None
+            for index in range(position, len(lines)):
+                if lines[index].strip() == start:
+                    first = index
+                    break
+            if first is None:
+                log.debug("Batch frame missing for command \"{}\"".format(command))
+                results.append(([], -1))
+                continue
+            if position == 0:
+                stray = [x for x in lines[:first]
+                         if x.strip() and tags[0].split("_")[0] not in x]
+                if stray:
+                    log.warning("OpTestSystem detected stray console output ahead of"
+                                " batch \"{}\", ignoring it".format(command))
+                    log.debug("stray output={}".format(stray))
+            output_list = None
+            for index in range(first + 1, len(lines)):
+                m = end.search(lines[index])
+                if m:
+                    # commands that do not end their output with a newline
+                    # leave it on the same line as the end marker
+                    output_list = lines[first + 1:index]
+                    if lines[index][:m.start()].strip():
+                        output_list.append(lines[index][:m.start()])
+                    results.append((output_list, int(m.group(1))))
+                    position = index + 1
+                    break
+            if output_list is None:
+                results.append((lines[first + 1:], -1))
+                position = len(lines)
+        return results
+
+    def try_framed_batch(self, term_obj, commands, timeout=600):
+        if not commands:
+            return []
+        expect_prompt = term_obj.expect_prompt
+        tags = self.batch_tags(commands)
+        end_pattern = FRAME_END.format(tags[-1]) + r":\d+[\s\S]*?" + expect_prompt
+        pty = term_obj.get_console()
+        pty.sendline(self.frame_batch(commands, tags))
+        rc = pty.expect([end_pattern, r"[Pp]assword for",
+                         pexpect.TIMEOUT, pexpect.EOF], timeout=timeout)
+        if rc == 0:
+            return self.split_batch_output(commands, pty.before + pty.after, tags)
+        if rc in [1, 2]:
+            # a command in the batch hung or wants a password, we cannot tell
+            # which ones completed once we break in, so fail the whole batch
+            output_list, echo_rc = self.try_sendcontrol(term_obj, commands[0])
+            raise CommandFailed("; ".join(commands), output_list, -1)
+        term_obj.close()
+        raise CommandFailed("; ".join(commands), "run_commands_batch TIMEOUT or EOF, the commands timed out"
+                            " or something, probably a connection issue, retry", -1)
+
+    def try_echo_command(self, term_obj, command, timeout=60):
         running_sudo_s = False
         extra_sudo_output = False
         # Use the pre-built expect_prompt from term_obj to ensure consistency
@@ -2944,8 +3152,17 @@ class Server(object):
 
     Login is done for the caller, so no need to call login, just
     make the GET/PUT/POST/DELETE call.
+
+    The session is safe to share between threads, its connection pool
+    holds `pool_size` connections, concurrent 401s lead to one login and
+    retries back off exponentially with jitter. get_many() fetches several
+    URIs concurrently.
     '''
 
+    # retry backoff, seconds
+    BACKOFF_FIRST = 0.5
+    BACKOFF_MAX = 5
+
     def __init__(self, url=None,
                  base_url=None,
                  proxy=None,
@@ -2953,7 +3170,8 @@ class Server(object):
                  password=None,
                  verify=False,
                  minutes=3,
-                 timeout=30):
+                 timeout=30,
+                 pool_size=16):
         urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
         OpTestLogger.optest_logger_glob.setUpChildLogger("urllib3")
         self.username = username
@@ -2966,7 +3184,14 @@ class Server(object):
         self.xAuthHeader = {}
         self.timeout = timeout
         self.minutes = minutes
-        self.session.mount('https://', HTTPAdapter(max_retries=5))
+        self.pool_size = pool_size
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size,
+                              max_retries=5)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # single flight login, bumped on every successful login
+        self.login_lock = threading.Lock()
+        self.login_generation = 0
         # value.max_retries for future debug if needed
 #        for key, value in self.session.adapters.items():
 #            log.debug("max_retries={}".format(value.max_retries))
@@ -3043,8 +3268,29 @@ class Server(object):
                             "credentials are properly setup URL={} username={} "
                             "password={}, Exception={}"
                             .format(self._url(uri), username, password, e))
+        self.login_generation += 1
         return r
 
+    def relogin(self, generation):
+        '''
+        Logs in again after a 401 seen by a request sent at login
+        `generation`, unless another thread already did so meanwhile.
+        '''
+        with self.login_lock:
+            if self.login_generation != generation:
+                log.debug("loop_it unauthorized, another thread logged in already")
+                return
+            log.debug("loop_it unauthorized, trying to login")
+            self.login()
+
+    def backoff(self, attempt):
+        '''
+        Sleeps before retry `attempt` (0 based), exponential with jitter so
+        threads retrying together spread out.
+        '''
+        delay = min(self.BACKOFF_MAX, self.BACKOFF_FIRST * 2 ** attempt)
+        time.sleep(delay / 2 + random.uniform(0, delay / 2))
+
     def logout(self, uri=None):
         uri = "/logout"
         payload = {"data": []}
@@ -3083,6 +3329,21 @@ class Server(object):
         r = self.loop_it(**kwargs)
         return r
 
+    def get_many(self, uris, minutes=None, max_workers=None, **kwargs):
+        '''
+        GETs several uris concurrently over the connection pool, returns
+        the responses in the order of uris. An exception from any GET is
+        raised once all of them have finished.
+        '''
+        uris = list(uris)
+        if not uris:
+            return []
+        workers = min(len(uris), max_workers or self.pool_size)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(self.get, uri=uri, minutes=minutes, **kwargs)
+                       for uri in uris]
+        return [f.result() for f in futures]
+
     def loop_it(self, **kwargs):
         default_vals = {'cmd': None, 'uri': None, 'data': None,
                         'json': None, 'params': None, 'minutes': None,
@@ -3101,6 +3362,17 @@ class Server(object):
             loop_time = time.time() + 60*kwargs['minutes']
         else:
             loop_time = time.time() + 60*5  # enough time to cycle
+        attempt = 0
+        # a file-like body read by a try is sent again from where it started
+        body = kwargs['data']
+        if hasattr(body, 'rewind'):
+            rewind = body.rewind
+        elif hasattr(body, 'seek') and hasattr(body, 'tell'):
+            body_start = body.tell()
+            rewind = lambda: body.seek(body_start)
+        else:
+            rewind = None
+        sent = False
         while True:
             if time.time() > loop_time:
                 raise HTTPCheck(message="HTTP \"{}\" problem, we timed out "
@@ -3109,6 +3381,10 @@ class Server(object):
                                 .format(kwargs['cmd'], self._url(kwargs['uri']),
                                         kwargs['params'], kwargs['data'], kwargs['json'],
                                         kwargs['files'], kwargs['minutes']))
+            generation = self.login_generation
+            if sent and rewind is not None:
+                rewind()
+            sent = True
             try:
                 r = command_dict[kwargs['cmd']](self._url(kwargs['uri']),
                                                 params=kwargs['params'],
@@ -3124,12 +3400,12 @@ class Server(object):
                 log.debug("loop_it Exception={}".format(e))
                 if kwargs['minutes'] is None:
                     raise e
-                time.sleep(5)
+                self.backoff(attempt)
+                attempt += 1
                 continue
             if r.status_code == requests.codes.unauthorized:  # 401
                 try:
-                    log.debug("loop_it unauthorized, trying to login")
-                    self.login()
+                    self.relogin(generation)
                     continue
                 except Exception as e:
                     log.debug(
@@ -3137,11 +3413,14 @@ class Server(object):
                     if kwargs['minutes'] is None:
                         # caller did not want retry so give them the exception
                         raise e
-                    time.sleep(5)
+                    self.backoff(attempt)
+                    attempt += 1
                     continue
-            if r.status_code == requests.codes.ok:
+            if r.status_code in [requests.codes.ok, requests.codes.partial_content]:
+                # a streamed body is left for the caller to read in chunks
                 log.debug("OpTestSystem HTTP r={} r.status_code={} r.text={}"
-                          .format(r, r.status_code, r.text))
+                          .format(r, r.status_code,
+                                  "<streamed>" if kwargs['stream'] else r.text))
                 return r
             else:
                 if kwargs['minutes'] is None:
@@ -3149,7 +3428,8 @@ class Server(object):
                     log.debug("OpTestSystem HTTP (no retry) r={} r.status_code={} r.text={}"
                               .format(r, r.status_code, r.text))
                     return r
-            time.sleep(5)
+            self.backoff(attempt)
+            attempt += 1
 
     def close(self):
         self.session.close()
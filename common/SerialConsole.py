@@ -193,3 +193,6 @@ class SerialConsole():
 
     def run_command_ignore_fail(self, command, timeout=60, retry=0):
         return self.util.run_command_ignore_fail(self, command, timeout, retry)
+
+    def run_commands_batch(self, commands, timeout=600):
+        return self.util.run_commands_batch(self, commands, timeout)
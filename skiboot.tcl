@@ -552,8 +552,9 @@ mysim memory fread $mconf(payload_addr) $payload_size $mconf(payload)
 # Flatten it
 epapr::of2dtb mysim $mconf(epapr_dt_addr)
 
-# Set run speed
-mysim mode fastest
+# Set run speed, op-test sets MAMBO_SIM_MODE from --mambo-boot-mode
+mconfig sim_mode MAMBO_SIM_MODE fastest
+mysim mode $mconf(sim_mode)
 
 if { [info exists env(SKIBOOT_AUTORUN)] } {
     if [catch { mysim go }] {
@@ -49,6 +49,9 @@ log = OpTestLogger.optest_logger_glob.get_logger(__name__)
 
 
 class Base(unittest.TestCase):
+    # powers the system off through DPO
+    leaves_dirty = True
+
     def setUp(self):
         conf = OpTestConfiguration.conf
         self.cv_IPMI = conf.ipmi()
@@ -35,6 +35,9 @@ from common import OpTestInstallUtil
 
 
 class InstallHostOS(unittest.TestCase):
+    # installs the OS the tests after it run on, never reordered
+    required_state = None
+
     def setUp(self):
         self.conf = OpTestConfiguration.conf
         self.cv_HOST = self.conf.host()
@@ -39,6 +39,9 @@ log = OpTestLogger.optest_logger_glob.get_logger(__name__)
 
 
 class InstallRhel(unittest.TestCase):
+    # installs the OS the tests after it run on, never reordered
+    required_state = None
+
     def setUp(self):
         self.conf = OpTestConfiguration.conf
         self.cv_HOST = self.conf.host()
@@ -58,6 +58,9 @@ class MyIPfromHost(unittest.TestCase):
 
 
 class InstallUbuntu(unittest.TestCase):
+    # installs the OS the tests after it run on, never reordered
+    required_state = None
+
     def setUp(self):
         conf = OpTestConfiguration.conf
         self.conf = conf
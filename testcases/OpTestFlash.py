@@ -62,6 +62,9 @@ log = OpTestLogger.optest_logger_glob.get_logger(__name__)
 
 
 class OpTestFlashBase(unittest.TestCase):
+    # flashing changes the firmware every later test runs on, never reordered
+    required_state = None
+
     def setUp(self):
         conf = OpTestConfiguration.conf
         self.cv_SYSTEM = conf.system()
@@ -177,6 +177,8 @@ class OptestKernelDump(unittest.TestCase):
     '''
     Main super class to test dump functionality for various dump targets
     '''
+    # crashes the kernel or the firmware and reboots through a dump
+    leaves_dirty = True
 
     def setUp(self):
         '''
@@ -65,6 +65,9 @@ class NVRAMUpdateError(Exception):
 
 
 class OpTestNVRAM(unittest.TestCase):
+    # writes test keys into the NVRAM partitions the next IPL reads
+    leaves_dirty = True
+
     def setUp(self):
         conf = OpTestConfiguration.conf
         self.cv_HOST = conf.host()